@@ -0,0 +1,40 @@
+/* Clientside callbacks of phrases_or_entities_over_time.py: the label and the placeholder of the input box and the
+   visibility of the cluster dropdown only depend on the radio buttons, so they are set in the browser, without a
+   request to the server. Dash loads this file from the assets folder. */
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    radio_toggles: {
+        /* Sets the label of the input box based on the radio buttons selected */
+        set_label: function(termtype, timeperiod) {
+            if (termtype === 'Noun phrases' && timeperiod === 'yearly') {
+                return 'Graph the following concepts (comma-separated, using yearly frequencies):';
+            }
+            if (termtype === 'Noun phrases' && timeperiod === 'monthly') {
+                return 'Graph the following comma-separated noun phrases (monthly frequencies):';
+            }
+            if (termtype === 'Wikipedia entities' && timeperiod === 'yearly') {
+                return 'Graph the following comma-separated entities (yearly frequencies):';
+            }
+            if (termtype === 'Wikipedia entities' && timeperiod === 'monthly') {
+                return 'Graph the following comma-separated entities (monthly frequencies):';
+            }
+            return 'Enter a phrase and show its cluster together with its other concepts:';
+        },
+
+        /* Sets the placeholder of the input box based on the radio buttons selected */
+        set_placeholder: function(termtype) {
+            if (termtype === 'Noun phrases') {
+                return 'E.g. search: "machine learning, model validation"';
+            }
+            if (termtype === 'Wikipedia entities') {
+                return 'E.g. search: "machine learning, model validation": each search term will automatically be ' +
+                       'converted to http://en.wikipedia.org/wiki/<search_term>';
+            }
+            return 'E.g. model validation (one phrase only)';
+        },
+
+        /* Shows the cluster dropdown only if the Clusters radio button is selected */
+        show_dropdown: function(termtype) {
+            return termtype === 'Clusters' ? {'display': 'block'} : {'display': 'none'};
+        }
+    }
+});
@@ -0,0 +1,66 @@
+""" This module builds the alias table of the entity dashboards (see entity_aliases.py) from the xLiSA annotation files
+which the nounphrases_wikipedia index is built from (1 line per entity mention: URL, surface form, start, end) and
+from WikidataAlgorithms.tsv (1 algorithm name per line). Each surface form is mapped to the URL it is most often linked
+to; the title of every URL and the Wikidata names of indexed URLs are added if they aren't surface forms already. Run it
+(from this folder) again whenever the index is rebuilt:
+    python3 build_entity_aliases.py [--folder /home/ashwath/Files/arxiv-cs-dataset-LREC2018-xlisa-annotations] """
+import argparse
+import os
+from collections import Counter, defaultdict
+from glob import iglob
+from time import time
+from entity_aliases import ALIASES_FILE, WIKIPEDIA_PREFIX, normalize_alias, url_title
+
+ANNOTATIONS_FOLDER = '/home/ashwath/Files/arxiv-cs-dataset-LREC2018-xlisa-annotations'
+WIKIDATA_FILE = 'WikidataAlgorithms.tsv'
+# Surface forms linked fewer times than this are left out (titles are always kept)
+MIN_ALIAS_COUNT = 2
+
+def read_annotations(folder):
+    """ Returns a dict: normalized surface form -> Counter of the URLs it is linked to. The URLs are lowercased and
+    stripped like in index_noun_phrases_wiki.py. """
+    alias_urls = defaultdict(Counter)
+    for filepath in iglob(os.path.join(folder, '*annotations.txt')):
+        with open(filepath, 'r') as file:
+            for line in file:
+                fields = line.split('\t')
+                url = fields[0].lower().strip()
+                if url == '' or len(fields) < 2:
+                    continue
+                alias_urls[normalize_alias(fields[1])][url] += 1
+    return alias_urls
+
+def build_aliases(folder=ANNOTATIONS_FOLDER, wikidata_file=WIKIDATA_FILE, min_count=MIN_ALIAS_COUNT,
+                  filename=ALIASES_FILE):
+    """ Builds and saves the alias table. """
+    start_time = time()
+    alias_urls = read_annotations(folder)
+    urls = set()
+    for url_counts in alias_urls.values():
+        urls.update(url_counts)
+    aliases = {}
+    for alias, url_counts in alias_urls.items():
+        if alias != '' and sum(url_counts.values()) >= min_count:
+            aliases[alias] = url_counts.most_common(1)[0][0]
+    for url in urls:
+        aliases.setdefault(url_title(url), url)
+    with open(wikidata_file, 'r') as file:
+        for line in file:
+            name = line.strip()
+            url = WIKIPEDIA_PREFIX + '_'.join(name.split()).lower()
+            if name != '' and url in urls:
+                aliases.setdefault(normalize_alias(name), url)
+    with open(filename, 'w') as file:
+        for alias in sorted(aliases):
+            file.write('{}\t{}\n'.format(alias, aliases[alias]))
+    print("{} aliases of {} URLs saved in {} ({:.1f} seconds)".format(len(aliases), len(urls), filename,
+                                                                    time() - start_time))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Builds the alias table of the entity dashboards.')
+    parser.add_argument('--folder', default=ANNOTATIONS_FOLDER, help='folder of the xLiSA annotation files')
+    parser.add_argument('--wikidata', default=WIKIDATA_FILE, help='file with 1 Wikidata algorithm name per line')
+    parser.add_argument('--min-count', type=int, default=MIN_ALIAS_COUNT,
+                        help='min. no. of times a surface form must be linked to be kept')
+    args = parser.parse_args()
+    build_aliases(args.folder, args.wikidata, args.min_count)
@@ -0,0 +1,107 @@
+""" This module builds the matrices which are served by phrase_matrices.py: for each term type (noun phrases from the
+nounphrases index, Wikipedia entities from the nounphrases_wikipedia index), it computes the no. of occurrences and
+the no. of documents of every phrase found in at least MIN_DOCUMENTS documents per month (the months of the json file
+with the monthly totals of the dashboards). The phrases are read from Solr with a facet query, and all the docs are
+then read with a cursor, 1 page at a time. The matrices are written directly into memory-mapped .npy files, so the
+build doesn't need to hold them in memory either. Run it (from this folder) again whenever the Solr indices are rebuilt:
+    python3 build_phrase_matrices.py [--min-documents 5] [--term-type nounphrases] """
+import argparse
+import os
+import sys
+from time import time
+import numpy as np
+import requests
+from phrase_matrices import MATRICES_FOLDER, MATRIX_KINDS, MIN_DOCUMENTS, phrase_hashes, matrix_filename
+from time_series import TERM_TYPES, read_totals
+
+SOLR_URL = 'http://localhost:8983/solr/'
+ROWS_PER_PAGE = 10000
+
+def solr_get(collection, url_params):
+    """ Sends a select request to a Solr collection and returns the parsed json. """
+    solr_response = requests.get(SOLR_URL + collection + '/select', params=url_params)
+    if not solr_response.ok:
+        print("Invalid response returned from Solr")
+        sys.exit(11)
+    return solr_response.json()
+
+def frequent_phrases(collection, field, min_documents):
+    """ Returns the list of the phrases which are found in at least min_documents documents (1 Solr doc per
+    phrase and paper, so the facet count is the no. of documents). """
+    url_params = {'q': '*:*', 'rows': 0, 'facet': 'true', 'facet.field': field, 'facet.mincount': min_documents,
+                  'facet.limit': -1, 'facet.sort': 'index', 'wt': 'json'}
+    counts = solr_get(collection, url_params)['facet_counts']['facet_fields'][field]
+    return counts[::2]
+
+def read_pages(collection, field):
+    """ Pages through all the docs of a collection with a cursor, and yields 1 page (list of docs with the phrase,
+    published_date and num_occurrences) at a time. """
+    cursor_mark = '*'
+    while True:
+        url_params = {'q': '*:*', 'rows': ROWS_PER_PAGE, 'sort': 'id asc', 'cursorMark': cursor_mark,
+                      'fl': '{},published_date,num_occurrences'.format(field), 'wt': 'json'}
+        data = solr_get(collection, url_params)
+        yield data['response']['docs']
+        if data['nextCursorMark'] == cursor_mark:
+            return
+        cursor_mark = data['nextCursorMark']
+
+def create_matrix(term_type, kind, shape, dtype, folder):
+    """ Creates a memory-mapped .npy file filled with 0s. """
+    return np.lib.format.open_memmap(matrix_filename(term_type, kind, folder), mode='w+', dtype=dtype, shape=shape)
+
+def build_matrices(term_type, min_documents=MIN_DOCUMENTS, folder=MATRICES_FOLDER):
+    """ Builds and saves the matrices of a term type. """
+    collection, field, monthly_json = TERM_TYPES[term_type]
+    months = sorted(read_totals(monthly_json)[0])
+    start_time = time()
+    phrases = frequent_phrases(collection, field, min_documents)
+    # Rows are sorted by hash. 2 phrases with the same hash are left out (they are fetched from Solr).
+    hashes = phrase_hashes(phrases)
+    _, inverse, hash_counts = np.unique(hashes, return_inverse=True, return_counts=True)
+    kept = np.flatnonzero(hash_counts[inverse] == 1)
+    if len(kept) < len(phrases):
+        print("{} phrases left out because of hash collisions".format(len(phrases) - len(kept)))
+    kept = kept[np.argsort(hashes[kept])]
+    hashes = hashes[kept]
+    rows = {phrases[position]: row for row, position in enumerate(kept)}
+    print("{}: {} phrases in at least {} documents ({:.1f} seconds)".format(term_type, len(rows), min_documents,
+                                                                          time() - start_time))
+    os.makedirs(folder, exist_ok=True)
+    np.save(matrix_filename(term_type, 'hashes', folder), hashes)
+    np.save(matrix_filename(term_type, 'months', folder), np.array(months))
+
+    # Monthly counts, read from Solr 1 page at a time
+    start_time = time()
+    month_columns = {month: column for column, month in enumerate(months)}
+    matrices = {kind: create_matrix(term_type, kind, (len(hashes), len(months)), np.int32, folder)
+                for kind in MATRIX_KINDS}
+    num_docs = 0
+    for docs in read_pages(collection, field):
+        doc_rows, doc_columns, doc_occurrences = [], [], []
+        for doc in docs:
+            row = rows.get(doc.get(field))
+            column = month_columns.get((doc.get('published_date') or '')[:7])
+            if row is not None and column is not None:
+                doc_rows.append(row)
+                doc_columns.append(column)
+                doc_occurrences.append(doc.get('num_occurrences', 0))
+        if doc_rows != []:
+            np.add.at(matrices['occurrences'], (doc_rows, doc_columns), doc_occurrences)
+            np.add.at(matrices['documents'], (doc_rows, doc_columns), 1)
+        num_docs += len(docs)
+    for matrix in matrices.values():
+        matrix.flush()
+    print("{}: {} docs read from Solr, matrices saved in {} ({:.1f} seconds)".format(term_type, num_docs, folder,
+                                                                                   time() - start_time))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Builds the phrase x month matrices of the dashboards.')
+    parser.add_argument('--term-type', choices=sorted(TERM_TYPES), action='append',
+                        help='term type(s) to build (default: all)')
+    parser.add_argument('--min-documents', type=int, default=MIN_DOCUMENTS,
+                        help='min. no. of documents a phrase must be found in to get a row')
+    parser.add_argument('--folder', default=MATRICES_FOLDER, help='folder of the .npy files')
+    args = parser.parse_args()
+    for term_type in args.term_type or sorted(TERM_TYPES):
+        build_matrices(term_type, args.min_documents, args.folder)
@@ -0,0 +1,86 @@
+""" This module builds the "did you mean" index which is served by phrase_suggestions.py: for each term type, the
+whole vocabulary (every phrase or Wikipedia URL with its no. of documents) is read from Solr with 1 facet query, split
+into words, and the deletion index of the words and the hashes of the phrases are written into .npy files. Run it
+(from this folder) again whenever the Solr indices are rebuilt:
+    python3 build_phrase_suggestions.py [--term-type nounphrases] """
+import argparse
+import os
+from collections import Counter
+from time import time
+import numpy as np
+from build_phrase_matrices import solr_get
+from phrase_matrices import phrase_hashes
+from phrase_suggestions import SUGGESTIONS_FOLDER, suggestions_filename, word_deletes, url_to_phrase
+from time_series import TERM_TYPES
+
+# Longer words are left out of the vocabulary (mostly text extraction errors)
+MAX_WORD_LENGTH = 40
+# No. of words whose deletions are hashed at a time
+WORDS_PER_CHUNK = 50000
+
+def vocabulary(collection, field):
+    """ Returns the list of all the values of the phrase field of a collection, and their no. of documents. """
+    url_params = {'q': '*:*', 'rows': 0, 'facet': 'true', 'facet.field': field, 'facet.mincount': 1,
+                  'facet.limit': -1, 'facet.sort': 'index', 'wt': 'json'}
+    counts = solr_get(collection, url_params)['facet_counts']['facet_fields'][field]
+    return counts[::2], counts[1::2]
+
+def build_suggestions(term_type, folder=SUGGESTIONS_FOLDER):
+    """ Builds and saves the suggestion index of a term type. """
+    collection, field = TERM_TYPES[term_type][:2]
+    start_time = time()
+    values, counts = vocabulary(collection, field)
+    if term_type == 'entities':
+        values = [url_to_phrase(value) for value in values]
+    phrases = Counter()
+    for value, count in zip(values, counts):
+        phrases[' '.join(value.lower().split())] += count
+    print("{}: {} phrases read from Solr ({:.1f} seconds)".format(term_type, len(phrases), time() - start_time))
+    os.makedirs(folder, exist_ok=True)
+
+    # Phrases: sorted hashes and no. of documents (summed for the phrases with the same hash)
+    start_time = time()
+    hashes, inverse = np.unique(phrase_hashes(list(phrases)), return_inverse=True)
+    frequencies = np.bincount(inverse, weights=list(phrases.values()), minlength=len(hashes)).astype(np.int64)
+    np.save(suggestions_filename(term_type, 'phrase_hashes', folder), hashes)
+    np.save(suggestions_filename(term_type, 'phrase_frequencies', folder), frequencies)
+
+    # Words: no. of documents of the phrases they occur in
+    word_counts = Counter()
+    for phrase, count in phrases.items():
+        for word in phrase.split():
+            if len(word) <= MAX_WORD_LENGTH:
+                word_counts[word] += count
+    words = sorted(word_counts)
+    np.save(suggestions_filename(term_type, 'words', folder), np.array(words))
+    np.save(suggestions_filename(term_type, 'word_frequencies', folder),
+            np.array([word_counts[word] for word in words], dtype=np.int64))
+
+    # Deletion index: hash of each deletion of each word -> word id, sorted by hash
+    delete_hashes = []
+    delete_words = []
+    for start in range(0, len(words), WORDS_PER_CHUNK):
+        deletes = []
+        delete_ids = []
+        for word_id, word in enumerate(words[start: start + WORDS_PER_CHUNK], start):
+            word_delete_set = word_deletes(word)
+            deletes.extend(word_delete_set)
+            delete_ids.extend([word_id] * len(word_delete_set))
+        delete_hashes.append(phrase_hashes(deletes))
+        delete_words.append(np.array(delete_ids, dtype=np.int32))
+    delete_hashes = np.concatenate(delete_hashes) if delete_hashes != [] else np.array([], dtype=np.uint64)
+    delete_words = np.concatenate(delete_words) if delete_words != [] else np.array([], dtype=np.int32)
+    order = np.argsort(delete_hashes, kind='mergesort')
+    np.save(suggestions_filename(term_type, 'delete_hashes', folder), delete_hashes[order])
+    np.save(suggestions_filename(term_type, 'delete_words', folder), delete_words[order])
+    print("{}: {} words, {} deletions saved in {} ({:.1f} seconds)".format(term_type, len(words), len(order), folder,
+                                                                         time() - start_time))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Builds the "did you mean" index of the dashboards.')
+    parser.add_argument('--term-type', choices=sorted(TERM_TYPES), action='append',
+                        help='term type(s) to build (default: all)')
+    parser.add_argument('--folder', default=SUGGESTIONS_FOLDER, help='folder of the .npy files')
+    args = parser.parse_args()
+    for term_type in args.term_type or sorted(TERM_TYPES):
+        build_suggestions(term_type, args.folder)
@@ -0,0 +1,193 @@
+""" This module measures where the time of the dashboard callbacks goes. Each invocation of a callback decorated with
+timed_callback gets a CallbackTiming record, in which the code it runs adds the duration of its stages (timed_stage)
+and the size of its payloads (add_size):
+  - fetch: time spent waiting for the data of the terms (term_fetch.py)
+  - solr, matrices, totals, aggregation: time of the Solr queries (and the parsing of their json), of the phrase
+    matrices, of the loading of the json files of the monthly totals and of the Pandas aggregation (time_series.py).
+    The terms are fetched by the threads of term_fetch.py at the same time, so these are summed over the terms and
+    may add up to more than fetch.
+  - figure: the rest of the callback (building the Plotly figures and the html components), i.e. callback - fetch
+  - callback: the whole callback function
+  - serialization: from the end of the callback to the response (Dash serializes the figures into json)
+  - request: the whole HTTP request, from Flask's point of view
+The sizes are the bytes of the Solr responses (solr_bytes), of the request sent by the browser (request_bytes) and of
+the json response sent back to it (response_bytes). The transfer itself happens after the response leaves the server:
+it is the difference between the network time of the request in the browser's developer tools and request.
+Once the request is over, the record is printed as 1 json line ('callback_timing {...}', if PRINT_TIMINGS) and kept
+with the last MAX_TIMINGS records of the callback. The URL TIMINGS_URL of each app (added by instrument_app) returns
+a summary of them: for each callback, the no. of calls and the mean, median, 95th percentile and max of each stage
+and size, and the last records. """
+import functools
+import json
+import threading
+from collections import deque
+from contextlib import contextmanager
+from time import perf_counter, time
+import numpy as np
+import flask
+
+# Print a json line for each callback invocation
+PRINT_TIMINGS = True
+# No. of records kept per callback for the summary
+MAX_TIMINGS = 1000
+# URL of the summary (added to the Flask server of each app)
+TIMINGS_URL = '/_callback_timings'
+# No. of records of each callback returned with the summary
+RECENT_TIMINGS = 10
+
+class CallbackTiming:
+    """ The stage durations (in seconds) and payload sizes (in bytes) of 1 callback invocation. """
+    def __init__(self, callback):
+        self.callback = callback
+        self.timestamp = time()
+        self.stages = {}
+        self.sizes = {}
+        self.error = None
+        self.finished = False
+        # Stages are added by the threads which fetch the terms as well
+        self.lock = threading.Lock()
+
+    def add_stage(self, stage, seconds):
+        with self.lock:
+            # Slow terms keep loading after the request is over: they aren't part of it
+            if not self.finished:
+                self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def add_size(self, size, num_bytes):
+        with self.lock:
+            if not self.finished:
+                self.sizes[size] = self.sizes.get(size, 0) + num_bytes
+
+    def finish(self):
+        """ Closes the record: derives the figure stage, prints the record and keeps it for the summary. """
+        with self.lock:
+            if self.finished:
+                return
+            self.finished = True
+            if 'callback' in self.stages:
+                self.stages['figure'] = max(self.stages['callback'] - self.stages.get('fetch', 0.0), 0.0)
+        if PRINT_TIMINGS:
+            print('callback_timing', json.dumps(self.to_dict(), sort_keys=True))
+        with timings_lock:
+            timings.setdefault(self.callback, deque(maxlen=MAX_TIMINGS)).append(self)
+
+    def to_dict(self):
+        return {'callback': self.callback, 'timestamp': round(self.timestamp, 3), 'error': self.error,
+                'stages': {stage: round(seconds, 6) for stage, seconds in self.stages.items()},
+                'sizes': dict(self.sizes)}
+
+# key: callback name, value: deque of its last MAX_TIMINGS finished records
+timings = {}
+timings_lock = threading.Lock()
+# The record of the callback invocation which the current thread works for
+current = threading.local()
+
+def current_timing():
+    """ Returns the record of the callback invocation of the current thread, or None (no timed callback). """
+    return getattr(current, 'timing', None)
+
+def run_with_timing(timing, function, *args, **kwargs):
+    """ Calls function(*args, **kwargs) in the current thread on behalf of a callback invocation (e.g. in the threads
+    which fetch the terms), so that its stages are added to the record of the invocation. """
+    previous = current_timing()
+    current.timing = timing
+    try:
+        return function(*args, **kwargs)
+    finally:
+        current.timing = previous
+
+@contextmanager
+def timed_stage(stage):
+    """ Context manager which adds the duration of its block to a stage of the current record (if any):
+            with timed_stage('solr'):
+                ... """
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        timing = current_timing()
+        if timing is not None:
+            timing.add_stage(stage, perf_counter() - start)
+
+def add_size(size, num_bytes):
+    """ Adds a payload size (in bytes) to the current record (if any). """
+    timing = current_timing()
+    if timing is not None:
+        timing.add_size(size, num_bytes)
+
+def timed_callback(function):
+    """ Decorator of the callbacks, to be put under @app.callback. Each invocation gets a record, which is finished
+    at the end of the request by instrument_app (serialization, request and response size), or at the end of the
+    invocation if it isn't called by a request. """
+    callback = '{}.{}'.format(function.__module__, function.__name__)
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        timing = CallbackTiming(callback)
+        start = perf_counter()
+        try:
+            return run_with_timing(timing, function, *args, **kwargs)
+        except Exception as exception:
+            timing.error = type(exception).__name__
+            raise
+        finally:
+            timing.add_stage('callback', perf_counter() - start)
+            if flask.has_request_context() and 'callback_timings' in flask.g:
+                timing.callback_end = perf_counter()
+                flask.g.callback_timings.append(timing)
+            else:
+                timing.finish()
+    return wrapper
+
+def summarize(values):
+    """ Returns the mean, median, 95th percentile and max of a list of numbers. """
+    values = np.array(values, dtype=np.float64)
+    return {'mean': float(values.mean()), 'p50': float(np.percentile(values, 50)),
+            'p95': float(np.percentile(values, 95)), 'max': float(values.max())}
+
+def timing_summary(recent=RECENT_TIMINGS):
+    """ Returns the summary of the kept records: dict callback -> calls, errors, stages (stage -> statistics of its
+    durations in seconds), sizes (size -> statistics in bytes), recent (the last records). """
+    with timings_lock:
+        callback_timings = {callback: list(records) for callback, records in timings.items()}
+    summary = {}
+    for callback, records in callback_timings.items():
+        stage_values = {}
+        size_values = {}
+        for record in records:
+            for stage, seconds in record.stages.items():
+                stage_values.setdefault(stage, []).append(seconds)
+            for size, num_bytes in record.sizes.items():
+                size_values.setdefault(size, []).append(num_bytes)
+        summary[callback] = {'calls': len(records),
+                             'errors': sum(record.error is not None for record in records),
+                             'stages': {stage: summarize(values) for stage, values in stage_values.items()},
+                             'sizes': {size: summarize(values) for size, values in size_values.items()},
+                             'recent': [record.to_dict() for record in records[-recent:]] if recent > 0 else []}
+    return summary
+
+def instrument_app(app):
+    """ Adds to the Flask server of a Dash app the hooks which finish the records of its callbacks at the end of
+    each request, and the summary URL (TIMINGS_URL). """
+    server = app.server
+
+    @server.before_request
+    def start_request_timing():
+        flask.g.request_start = perf_counter()
+        flask.g.callback_timings = []
+
+    @server.after_request
+    def finish_request_timings(response):
+        end = perf_counter()
+        for timing in flask.g.get('callback_timings', []):
+            timing.add_stage('serialization', end - timing.callback_end)
+            timing.add_stage('request', end - flask.g.request_start)
+            timing.add_size('request_bytes', flask.request.content_length or 0)
+            if not response.direct_passthrough:
+                timing.add_size('response_bytes', response.content_length or len(response.get_data()))
+            timing.finish()
+        return response
+
+    @server.route(TIMINGS_URL)
+    def callback_timings():
+        return flask.jsonify(timing_summary(flask.request.args.get('recent', RECENT_TIMINGS, type=int)))
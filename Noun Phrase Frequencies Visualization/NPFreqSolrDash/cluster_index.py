@@ -0,0 +1,56 @@
+""" This module is an inverted index of the clusters file (cluster_phrase_semicolon_50.txt: 1 line per cluster, the
+cluster number and its noun phrases separated by semicolons), built once when the dashboard starts. It is used by the
+Clusters view of phrases_or_entities_over_time.py to find the cluster of the phrase entered by the user:
+  1. exact match: a dict from each phrase to its cluster number, i.e. 1 lookup instead of a substring search of the
+     phrases of all the clusters on every submit.
+  2. token match (only if there is no exact match): a dict from each word to the phrases it occurs in. The phrases
+     which contain all the words of the query are found by intersecting the sets of the words, so 'tree' finds
+     'decision tree' but not 'street'. The cluster with the most of these phrases is returned.
+The phrases in the file are lowercase, so the queries are lowercased too. """
+from collections import Counter
+
+def phrase_tokens(phrase):
+    """ Splits a phrase into its (lowercase) words. """
+    return phrase.lower().split()
+
+class ClusterIndex:
+    """ Exact and token indices of the phrases of each cluster. """
+    def __init__(self, phrases_df):
+        """ ARGUMENTS: phrases_df, a Pandas df with index=cluster_number and a column 'phrases' (semicolon-separated
+                       phrases of the cluster) """
+        # key: phrase, value: cluster number (the first cluster, for the rare phrases which are in 2 clusters)
+        self.phrase_clusters = {}
+        # key: word, value: set of the phrases which contain it
+        self.token_phrases = {}
+        # key: cluster number, value: list of its phrases
+        self.cluster_phrases = {}
+        for cluster_number, phrases in phrases_df['phrases'].items():
+            # Lines may end with a semicolon: no empty phrases
+            phrase_list = [phrase for phrase in phrases.split(';') if phrase != '']
+            self.cluster_phrases[cluster_number] = phrase_list
+            for phrase in phrase_list:
+                self.phrase_clusters.setdefault(phrase, cluster_number)
+                for token in phrase_tokens(phrase):
+                    self.token_phrases.setdefault(token, set()).add(phrase)
+
+    def find_cluster(self, query):
+        """ Returns the cluster number of the phrase entered by the user, or None if none of the phrases matches.
+        An exact match is tried first, then the phrases which contain all the words of the query. """
+        query = ' '.join(phrase_tokens(query))
+        if query == '':
+            return None
+        if query in self.phrase_clusters:
+            return self.phrase_clusters[query]
+        token_sets = [self.token_phrases.get(token, set()) for token in query.split()]
+        # Start the intersection with the smallest set (the rarest word)
+        token_sets.sort(key=len)
+        matching_phrases = token_sets[0].intersection(*token_sets[1:])
+        if not matching_phrases:
+            return None
+        cluster_counts = Counter(self.phrase_clusters[phrase] for phrase in matching_phrases)
+        # The cluster with the most matching phrases (the lowest cluster number if there is a tie)
+        return min(cluster_counts, key=lambda cluster_number: (-cluster_counts[cluster_number], cluster_number))
+
+    def phrases(self, cluster_number):
+        """ Returns the list of the phrases of a cluster. """
+        return self.cluster_phrases[cluster_number]
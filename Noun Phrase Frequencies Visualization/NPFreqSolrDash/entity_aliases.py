@@ -0,0 +1,65 @@
+""" This module maps the phrases entered in the entity dashboards to the Wikipedia URLs of the nounphrases_wikipedia
+index. Without it, a phrase is converted into a URL (word1 word2 -> http://en.wikipedia.org/wiki/word1_word2) which
+only exists if the phrase is exactly the title of the article: another surface form of the entity (e.g. 'svm' for
+support_vector_machine, or a redirect) costs a Solr query which finds nothing. build_entity_aliases.py writes a table
+(ALIASES_FILE, 1 line per alias: normalized surface form, tab, URL) with the surface forms linked to each URL in the
+xLiSA annotation files (the ones the index is built from), the title of each URL, and the names of
+WikidataAlgorithms.tsv. It is loaded into a dict when the dashboard starts, so a phrase is resolved with 1 lookup, and
+a URL which isn't in the table isn't in the index either, so it is reported as not found without a Solr query. """
+import os
+import re
+import threading
+
+ALIASES_FILE = 'entity_aliases.tsv'
+WIKIPEDIA_PREFIX = 'http://en.wikipedia.org/wiki/'
+
+def normalize_alias(text):
+    """ Normalizes a surface form or the title of a URL: lowercase, words separated by 1 space (underscores are
+    spaces). """
+    return ' '.join(re.split(r'[\s_]+', text.lower())).strip()
+
+def url_title(url):
+    """ Returns the normalized title of a Wikipedia URL (http://en.wikipedia.org/wiki/word1_word2 -> word1 word2). """
+    if url.startswith(WIKIPEDIA_PREFIX):
+        url = url[len(WIKIPEDIA_PREFIX):]
+    return normalize_alias(url)
+
+class EntityAliases:
+    """ The alias table: normalized surface form -> URL, and the set of all the URLs. """
+    def __init__(self, filename=ALIASES_FILE):
+        self.aliases = {}
+        # 1 string object per URL, shared by the dict and the set
+        urls = {}
+        with open(filename, 'r') as file:
+            for line in file:
+                alias, url = line.rstrip('\n').split('\t')
+                self.aliases[alias] = urls.setdefault(url, url)
+        self.urls = set(urls)
+
+    def resolve(self, phrase):
+        """ Returns the URL of a phrase, or None if it isn't a known surface form. """
+        return self.aliases.get(normalize_alias(phrase))
+
+# The table, loaded once per process by get_entity_aliases
+entity_aliases = {}
+entity_aliases_lock = threading.Lock()
+
+def get_entity_aliases():
+    """ Returns the alias table, loading it the first time it is needed, or None if it hasn't been built. """
+    with entity_aliases_lock:
+        if 'aliases' not in entity_aliases:
+            entity_aliases['aliases'] = EntityAliases() if os.path.exists(ALIASES_FILE) else None
+        return entity_aliases['aliases']
+
+def resolve_entity(phrase):
+    """ Returns the URL of the entity a phrase refers to, or None if the phrase isn't in the alias table (or the
+    table hasn't been built). """
+    aliases = get_entity_aliases()
+    if aliases is None:
+        return None
+    return aliases.resolve(phrase)
+
+def entity_url_exists(url):
+    """ Returns False if a URL is certainly not in the index (it isn't in the alias table), True otherwise. """
+    aliases = get_entity_aliases()
+    return aliases is None or url in aliases.urls
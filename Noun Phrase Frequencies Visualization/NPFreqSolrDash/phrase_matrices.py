@@ -0,0 +1,84 @@
+""" This module serves the monthly counts of the dashboard terms from precomputed matrices instead of Solr. For each
+term type (noun phrases and Wikipedia entities), build_phrase_matrices.py writes 2 matrices with 1 row per phrase and
+1 column per month: no. of occurrences and no. of documents. Only the phrases which are found in at least
+MIN_DOCUMENTS documents get a row. The rows are sorted by a 64-bit hash of the phrase, so the row of a phrase is found
+with a binary search of the (sorted) hashes, and the matrices are memory-mapped .npy files: answering a term is 1 row
+read per matrix, and the operating system shares the pages between all the dashboard processes. The series of every
+resolution (month, quarter, year...) are derived from these counts by time_series.py. Terms which are not in the
+matrices (rare phrases, or matrices which haven't been built) are still fetched from Solr. """
+import os
+import threading
+import zlib
+import numpy as np
+import pandas as pd
+
+MATRICES_FOLDER = 'phrase_matrices'
+# Kinds of matrices built for every term type
+MATRIX_KINDS = ['occurrences', 'documents']
+# Phrases found in fewer documents than this don't get a row
+MIN_DOCUMENTS = 5
+
+def phrase_hashes(phrases):
+    """ Stable 64-bit hashes of a list of phrases (a NumPy uint64 array): CRC32 in the upper 32 bits, Adler-32 in
+    the lower 32 bits. Unlike Python's hash(), they are the same in every process.
+    ARGUMENTS: phrases, list of strings
+    RETURNS: NumPy uint64 array with the hash of each phrase """
+    encoded = [phrase.encode('utf-8') for phrase in phrases]
+    crc = np.fromiter(map(zlib.crc32, encoded), dtype=np.uint64, count=len(encoded))
+    adler = np.fromiter(map(zlib.adler32, encoded), dtype=np.uint64, count=len(encoded))
+    return (crc << np.uint64(32)) | adler
+
+def matrix_filename(term_type, kind, folder=MATRICES_FOLDER):
+    """ Returns the path of one of the .npy files, e.g. phrase_matrices/nounphrases_occurrences.npy. kind is one of
+    MATRIX_KINDS, 'months' (the month of each column) or 'hashes' (the sorted phrase hashes). """
+    return os.path.join(folder, '{}_{}.npy'.format(term_type, kind))
+
+class PhraseMatrices:
+    """ The memory-mapped matrices of 1 term type. """
+    def __init__(self, term_type, folder=MATRICES_FOLDER):
+        self.hashes = np.load(matrix_filename(term_type, 'hashes', folder), mmap_mode='r')
+        self.months = pd.PeriodIndex(np.load(matrix_filename(term_type, 'months', folder)), freq='M')
+        self.matrices = {kind: np.load(matrix_filename(term_type, kind, folder), mmap_mode='r')
+                         for kind in MATRIX_KINDS}
+
+    def row(self, phrase):
+        """ Returns the row of a phrase, or None if the phrase doesn't have one. """
+        phrase_hash = phrase_hashes([phrase])[0]
+        position = int(np.searchsorted(self.hashes, phrase_hash))
+        if position < len(self.hashes) and self.hashes[position] == phrase_hash:
+            return position
+        return None
+
+    def monthly_counts(self, phrase):
+        """ Returns the monthly counts of a phrase: a Pandas df with index=month (PeriodIndex, all the months of the
+        matrices) and columns occurrences, documents. Returns None if the phrase doesn't have a row. """
+        row = self.row(phrase)
+        if row is None:
+            return None
+        return pd.DataFrame({kind: self.matrices[kind][row].astype('int64') for kind in MATRIX_KINDS},
+                            index=self.months)
+
+# key: term type, value: PhraseMatrices, or None if they haven't been built
+loaded_matrices = {}
+matrices_lock = threading.Lock()
+
+def get_phrase_matrices(term_type):
+    """ Returns the matrices of a term type, loading them the first time they are needed, or None if they haven't
+    been built. """
+    with matrices_lock:
+        if term_type not in loaded_matrices:
+            if os.path.exists(matrix_filename(term_type, 'occurrences')):
+                loaded_matrices[term_type] = PhraseMatrices(term_type)
+            else:
+                loaded_matrices[term_type] = None
+        return loaded_matrices[term_type]
+
+def matrix_monthly_counts(phrase, term_type):
+    """ Returns the monthly counts of a phrase from the matrices, or None if it has to be fetched from Solr (the
+    phrase has no row, or the matrices haven't been built).
+    ARGUMENTS: phrase, string: one of the parts of the user's comma-separated query
+               term_type, string: 'nounphrases' or 'entities' """
+    phrase_matrices = get_phrase_matrices(term_type)
+    if phrase_matrices is None:
+        return None
+    return phrase_matrices.monthly_counts(phrase)
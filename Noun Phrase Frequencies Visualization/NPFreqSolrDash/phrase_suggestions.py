@@ -0,0 +1,177 @@
+""" This module suggests the phrases a user probably meant when a term of the query is not found ("did you mean"),
+from the full vocabularies of the nounphrases and nounphrases_wikipedia indices. build_phrase_suggestions.py writes,
+for each term type:
+  - the words of all the phrases (sorted) and their frequencies (no. of documents of the phrases they occur in),
+  - a SymSpell-style deletion index of the words: the hashes of all the strings obtained by deleting up to
+    MAX_EDIT_DISTANCE characters from the first PREFIX_LENGTH characters of each word (sorted), and the word each of
+    them comes from,
+  - the hashes of all the phrases (sorted) and their no. of documents.
+A misspelled word and the words it is a typo of have a deletion in common, so the candidates of a word are found by
+generating its own deletions (a few dozen strings) and looking up their hashes with a binary search, and only these
+candidates are compared with the word (edit distance). The phrases made of the candidates of the words of the term,
+with at most MAX_EDIT_DISTANCE edits in total, are looked up in the phrase hashes, and the ones which exist are ranked
+by no. of edits, then by no. of documents. All the arrays are memory-mapped .npy files (like phrase_matrices.py),
+so a suggestion is computed in about a millisecond whatever the size of the vocabulary. """
+import os
+import threading
+from itertools import combinations, product
+import numpy as np
+from phrase_matrices import phrase_hashes
+
+SUGGESTIONS_FOLDER = 'phrase_suggestions'
+MAX_EDIT_DISTANCE = 2
+# Only the first PREFIX_LENGTH characters of a word are used for the deletions (fewer deletions per word, the
+# candidates are compared with the whole word anyway)
+PREFIX_LENGTH = 7
+# Max. no. of candidates of each word of a term, and of suggestions of a term
+MAX_WORD_CANDIDATES = 5
+MAX_SUGGESTIONS = 5
+WIKIPEDIA_PREFIX = 'http://en.wikipedia.org/wiki/'
+
+def word_deletes(word, max_distance=MAX_EDIT_DISTANCE, prefix_length=PREFIX_LENGTH):
+    """ Returns the set of the strings obtained by deleting 0 to max_distance characters from the prefix of a word. """
+    deletes = {word[:prefix_length]}
+    current = deletes
+    for _ in range(max_distance):
+        current = {string[:position] + string[position + 1:] for string in current for position in range(len(string))}
+        deletes |= current
+    return deletes
+
+def edit_distance(word1, word2, max_distance=MAX_EDIT_DISTANCE):
+    """ Returns the Damerau-Levenshtein distance (optimal string alignment: insertions, deletions, substitutions and
+    transpositions of 2 adjacent characters) between 2 words, or max_distance + 1 if it is larger than max_distance.
+    Only the cells at most max_distance away from the diagonal are computed, and it stops as soon as a whole row is
+    larger than max_distance. """
+    too_far = max_distance + 1
+    if abs(len(word1) - len(word2)) > max_distance:
+        return too_far
+    before_previous_row = None
+    row = list(range(len(word2) + 1))
+    for i in range(1, len(word1) + 1):
+        previous_row, row = row, [too_far] * (len(word2) + 1)
+        if i <= max_distance:
+            row[0] = i
+        character = word1[i - 1]
+        for j in range(max(1, i - max_distance), min(len(word2), i + max_distance) + 1):
+            # Substitution (or match), deletion, insertion
+            distance = previous_row[j - 1] if character == word2[j - 1] else previous_row[j - 1] + 1
+            if previous_row[j] + 1 < distance:
+                distance = previous_row[j] + 1
+            if row[j - 1] + 1 < distance:
+                distance = row[j - 1] + 1
+            # Transposition
+            if (i > 1 and j > 1 and character == word2[j - 2] and word1[i - 2] == word2[j - 1]
+                    and before_previous_row[j - 2] + 1 < distance):
+                distance = before_previous_row[j - 2] + 1
+            row[j] = distance
+        if min(row) > max_distance:
+            return too_far
+        before_previous_row = previous_row
+    return min(row[-1], too_far)
+
+def url_to_phrase(url):
+    """ Converts a Wikipedia URL (http://en.wikipedia.org/wiki/word1_word2) to the phrase word1 word2. """
+    if url.startswith(WIKIPEDIA_PREFIX):
+        url = url[len(WIKIPEDIA_PREFIX):]
+    return ' '.join(url.split('_'))
+
+def suggestions_filename(term_type, kind, folder=SUGGESTIONS_FOLDER):
+    """ Returns the path of one of the .npy files, e.g. phrase_suggestions/nounphrases_words.npy. kind is one of
+    'words', 'word_frequencies', 'delete_hashes', 'delete_words', 'phrase_hashes', 'phrase_frequencies'. """
+    return os.path.join(folder, '{}_{}.npy'.format(term_type, kind))
+
+class PhraseSuggestions:
+    """ The memory-mapped vocabulary and deletion index of 1 term type. """
+    def __init__(self, term_type, folder=SUGGESTIONS_FOLDER):
+        self.words = np.load(suggestions_filename(term_type, 'words', folder), mmap_mode='r')
+        arrays = {kind: np.load(suggestions_filename(term_type, kind, folder), mmap_mode='r')
+                  for kind in ('word_frequencies', 'delete_hashes', 'delete_words', 'phrase_hashes', 'phrase_frequencies')}
+        self.word_frequencies = arrays['word_frequencies']
+        self.delete_hashes = arrays['delete_hashes']
+        self.delete_words = arrays['delete_words']
+        self.phrase_hashes = arrays['phrase_hashes']
+        self.phrase_frequencies = arrays['phrase_frequencies']
+
+    def word_candidates(self, word):
+        """ Returns a list of (distance, word) of the MAX_WORD_CANDIDATES most frequent words of the vocabulary which
+        are at most MAX_EDIT_DISTANCE edits away from a word, the closest first (the word itself if it is in the
+        vocabulary). """
+        hashes = np.sort(phrase_hashes(list(word_deletes(word))))
+        starts = np.searchsorted(self.delete_hashes, hashes, side='left')
+        ends = np.searchsorted(self.delete_hashes, hashes, side='right')
+        if (ends - starts).sum() == 0:
+            return []
+        word_ids = np.unique(np.concatenate([self.delete_words[start: end] for start, end in zip(starts, ends)]))
+        candidates = []
+        for word_id in word_ids:
+            candidate = str(self.words[word_id])
+            distance = edit_distance(word, candidate)
+            if distance <= MAX_EDIT_DISTANCE:
+                candidates.append((distance, -int(self.word_frequencies[word_id]), candidate))
+        candidates.sort()
+        return [(distance, candidate) for distance, _, candidate in candidates[:MAX_WORD_CANDIDATES]]
+
+    def phrase_frequencies_of(self, phrases):
+        """ Returns the no. of documents of each phrase (0 for the phrases which aren't in the vocabulary). """
+        hashes = phrase_hashes(phrases)
+        positions = np.minimum(np.searchsorted(self.phrase_hashes, hashes), len(self.phrase_hashes) - 1)
+        found = self.phrase_hashes[positions] == hashes
+        return np.where(found, self.phrase_frequencies[positions], 0)
+
+    def suggest(self, term, max_suggestions=MAX_SUGGESTIONS):
+        """ Returns up to max_suggestions phrases of the vocabulary which are close to a term (at most
+        MAX_EDIT_DISTANCE edits in total), the closest and most frequent first. The term itself is left out. """
+        words = term.lower().split()
+        if words == [] or len(self.phrase_hashes) == 0:
+            return []
+        word_candidates = [self.word_candidates(word) for word in words]
+        # Phrases with at most MAX_EDIT_DISTANCE edits: the words which aren't changed keep their own spelling
+        phrases = {}
+        for num_changed in range(1, min(MAX_EDIT_DISTANCE, len(words)) + 1):
+            for positions in combinations(range(len(words)), num_changed):
+                alternatives = [[(distance, candidate) for distance, candidate in word_candidates[position]
+                                 if distance > 0] for position in positions]
+                for changes in product(*alternatives):
+                    distance = sum(change[0] for change in changes)
+                    if distance > MAX_EDIT_DISTANCE:
+                        continue
+                    phrase_words = list(words)
+                    for position, (_, candidate) in zip(positions, changes):
+                        phrase_words[position] = candidate
+                    phrase = ' '.join(phrase_words)
+                    phrases[phrase] = min(distance, phrases.get(phrase, distance))
+        if phrases == {}:
+            return []
+        phrase_list = list(phrases)
+        frequencies = self.phrase_frequencies_of(phrase_list)
+        ranked = sorted((phrases[phrase], -int(frequency), phrase)
+                        for phrase, frequency in zip(phrase_list, frequencies) if frequency > 0)
+        return [phrase for _, _, phrase in ranked[:max_suggestions]]
+
+# key: term type, value: PhraseSuggestions, or None if the files haven't been built
+loaded_suggestions = {}
+suggestions_lock = threading.Lock()
+
+def get_phrase_suggestions(term_type):
+    """ Returns the suggestion index of a term type, loading it the first time it is needed, or None if it hasn't
+    been built. """
+    with suggestions_lock:
+        if term_type not in loaded_suggestions:
+            if os.path.exists(suggestions_filename(term_type, 'delete_hashes')):
+                loaded_suggestions[term_type] = PhraseSuggestions(term_type)
+            else:
+                loaded_suggestions[term_type] = None
+        return loaded_suggestions[term_type]
+
+def did_you_mean(term, term_type):
+    """ Returns the suggestions for a term which is not found (a list of phrases, empty if the suggestion index
+    hasn't been built).
+    ARGUMENTS: term, string: one of the parts of the user's comma-separated query (a Wikipedia URL for entities)
+               term_type, string: 'nounphrases' or 'entities' """
+    phrase_suggestions = get_phrase_suggestions(term_type)
+    if phrase_suggestions is None:
+        return []
+    term = term.strip()
+    if term_type == 'entities':
+        term = url_to_phrase(term)
+    return phrase_suggestions.suggest(term)
@@ -10,7 +10,7 @@ import json
 import dash
 import dash_core_components as dcc
 import dash_html_components as html
-from dash.dependencies import Input, Output, State
+from dash.dependencies import Input, Output, State, ClientsideFunction
 import plotly.graph_objs as go
 import base64
 
@@ -20,6 +20,8 @@ import nounphrase_visualization_monthly as npvm
 import nounphrase_visualization_yearly as npvy
 import entity_mentions_visualization_monthly as emvm
 import entity_mentions_visualization_yearly as emvy
+from cluster_index import ClusterIndex
+from callback_timing import timed_callback, instrument_app
 
 
 # Read the list of suggested noun phrases
@@ -38,6 +40,8 @@ list_of_clusters = centres_df.index.tolist()
 
 phrases_df = pd.read_csv('cluster_phrase_semicolon_50.txt', sep='\t', names=['cluster_number', 'phrases'])
 phrases_df = phrases_df.set_index('cluster_number', drop=True)
+# Inverted index phrase -> cluster (and word -> phrases), built once: used to find the cluster of a searched phrase
+cluster_index = ClusterIndex(phrases_df)
 
 def phrases_df_notfound_message(nounphrase):
     """ Takes a noun phrase which is not found in the phrases_df input filef and prints a messages
@@ -50,6 +54,8 @@ def phrases_df_notfound_message(nounphrase):
             )
 
 app = dash.Dash(__name__)
+# Stage timings and payload sizes of the callbacks (see callback_timing.py)
+instrument_app(app)
 
 # Add the default Dash CSS, and some custom (very simple) CSS to remove the undo button
 # app.css.append_css({'external_url': 'https://www.jsdelivr.com/package/npm/normalize.css'})
@@ -113,9 +119,11 @@ app.layout = html.Div(style={'backgroundColor': colours['background'],
                 'fontSize': '1.4em',
                 'margin-left': '1%'
             }, className='setorlabel'),
+        # The options are sent once with the layout (the dropdown is only shown with the Clusters radio button)
         dcc.Dropdown(
         id='cluster_dropdown',
         className='cluster_dropdown',
+        options=[{'label': cluster, 'value': cluster} for cluster in list_of_clusters],
         placeholder='Choose a cluster to get phrases from that cluster')], id='dropdown_div', style={'display': 'none'}),
 
     html.Div([
@@ -210,18 +218,13 @@ html.Div([
         placeholder='Choose a cluster to get phrases from that cluster)')], id='dropdown_div', style={'display': 'none'}),
 """
 
-@app.callback(
+# The label, the placeholder and the cluster dropdown only depend on the radio buttons: they are set by clientside
+# callbacks (assets/radio_toggles.js), without a request to the server
+app.clientside_callback(
+    ClientsideFunction(namespace='radio_toggles', function_name='set_label'),
     Output('setlabel', 'children'),
     [Input('type_of_term', 'value'),
     Input('time_period', 'value')])
-def set_label(termtype, timeperiod):
-    """ Sets label based on the radio buttons selected"""
-    label = 'Graph the following concepts (comma-separated, using yearly frequencies):' if termtype == 'Noun phrases' and timeperiod == 'yearly' \
-            else 'Graph the following comma-separated noun phrases (monthly frequencies):' if termtype == 'Noun phrases' and timeperiod == 'monthly' \
-            else 'Graph the following comma-separated entities (yearly frequencies):' if termtype == 'Wikipedia entities' and timeperiod == 'yearly' \
-            else 'Graph the following comma-separated entities (monthly frequencies):' if termtype == 'Wikipedia entities' and timeperiod == 'monthly' \
-            else 'Enter a phrase and show its cluster together with its other concepts:'
-    return label
 
 '''@app.callback(
     Output('setorlabel', 'children'),
@@ -231,16 +234,10 @@ def set_or_label(termtype):
     if termtype == 'Clusters':
         return 'Or'''
 
-@app.callback(
+app.clientside_callback(
+    ClientsideFunction(namespace='radio_toggles', function_name='show_dropdown'),
     Output('dropdown_div', 'style'),
     [Input('type_of_term', 'value')])
-def show_dropdown(termtype):
-    '''Disable dropdown if termtype is not clusters'''
-    if termtype == 'Clusters':
-        style = {'display': 'block'}
-    else:
-        style = {'display': 'none'}
-        return style
 
 
 '''
@@ -268,31 +265,10 @@ def show_timeinterval_radio(termtype):
         return style
 '''
 
-@app.callback(
-    Output('cluster_dropdown', 'options'),
-    [Input('type_of_term', 'value'),
-    Input('dropdown_div', 'style')])
-def set_dropdown_options(termtype, dropdown_style):
-    """ Sets dropdown only if the clusters radio button is selected"""
-    #  IMPORTANT: this wasted a lot of time, dropdown_style is None when it is not set to {display:none}
-    if dropdown_style is None:
-        if termtype == 'Clusters':
-            options=[{'label': cluster, 'value': cluster} for cluster in list_of_clusters]
-        else:
-            options = []
-    else:
-        options = []
-    return options
-
-@app.callback(
+app.clientside_callback(
+    ClientsideFunction(namespace='radio_toggles', function_name='set_placeholder'),
     Output('npinput1-state', 'placeholder'),
     [Input('type_of_term', 'value')])
-def set_placeholder(termtype):
-    """ Sets input placeholder based on the radio buttons selected"""
-    placeholder = 'E.g. search: "machine learning, model validation"' if termtype == 'Noun phrases'\
-            else 'E.g. search: "machine learning, model validation": each search term will automatically be converted to http://en.wikipedia.org/wiki/<search_term>' \
-            if termtype == 'Entity mentions' else 'E.g. model validation (one phrase only)'
-    return placeholder
 
 @app.callback(
     Output('output1', 'children'),
@@ -300,6 +276,7 @@ def set_placeholder(termtype):
     Input('time_period', 'value'),
     Input('submit-button', 'n_clicks')],
     [State('npinput1-state', 'value')])
+@timed_callback
 def create_graph(termtype, timeperiod, n_clicks, input_box):
     """ Wrapped function which takes user input in a text box, and 2 radio buttons, returns the
     appropriate graph if the query produces a hit in Solr, returns an error message otherwise.
@@ -324,22 +301,16 @@ def create_graph(termtype, timeperiod, n_clicks, input_box):
     if termtype == 'Wikipedia entities' and timeperiod == 'yearly':
         return emvy.show_graph_unique_not_callback(n_clicks, input_box)
     if termtype == 'Clusters' and n_clicks>0 and input_box!="":
-        # !!! DO NOT modify global variables
-        phrases_df_copy = phrases_df.copy()
-        # Add a new column which is 1 only for the cluster in which the term in input box is found.
-        phrases_df_copy['clusterfound'] = phrases_df_copy['phrases'].apply(lambda x: 1 if x.find(input_box.strip()) != -1 else 0)
-
-        if (phrases_df_copy.clusterfound==0).all():
+        # Exact match of the phrase, or the cluster with the most phrases containing all its words
+        cluster_number = cluster_index.find_cluster(input_box.strip())
+        if cluster_number is None:
             return html.H5('Noun phrase "{}" not found. Try searching again!'.format(input_box.strip()),
             style={'color': colours['text']}
             )
-        # one_phrase_df will contain only one row
-        one_phrase_df = phrases_df_copy.loc[phrases_df_copy.clusterfound==1]
-        current_cluster = one_phrase_df.index.values[0]
-        current_cluster_message = 'Other noun phrases in same cluster (cluster {}):\n'.format(str(current_cluster))
-        current_cluster = 'Cluster {}'.format(current_cluster)
-        # Get the list of words using iloc[0] (only one row) and build it into a string with commas (input file had semicolons)
-        current_cluster_phrases = ', '.join(one_phrase_df.phrases.iloc[0].split(';'))
+        current_cluster_message = 'Other noun phrases in same cluster (cluster {}):\n'.format(str(cluster_number))
+        current_cluster = 'Cluster {}'.format(cluster_number)
+        # Build the list of words into a string with commas (input file had semicolons)
+        current_cluster_phrases = ', '.join(cluster_index.phrases(cluster_number))
 
         data = [
             go.Scatter(
@@ -378,6 +349,7 @@ def create_graph(termtype, timeperiod, n_clicks, input_box):
     Input('time_period', 'value'),
     Input('submit-button', 'n_clicks'),
     Input('cluster_dropdown', 'value')])
+@timed_callback
 def select_cluster_phrases(termtype, timeperiod, n_clicks, dropdown_val):
     """ Wrapped function which takes user input in a text box, and 2 radio buttons, returns the
     appropriate graph if the query produces a hit in Solr, returns an error message otherwise.
@@ -391,20 +363,17 @@ def select_cluster_phrases(termtype, timeperiod, n_clicks, dropdown_val):
              Solr, error messages of all terms which don't have results from Solr.
              The 1 graph is generated based on the radio buttons' values. """
     if termtype == 'Clusters' and dropdown_val != "" and dropdown_val is not None:
-        phrases_df_copy = phrases_df.copy()
         dropdown_val = dropdown_val.strip()
         cluster_only_number = int(dropdown_val.split()[-1])
-        one_phrase_df = phrases_df_copy.loc[cluster_only_number]
 
         #if (phrases_df_copy.clusterfound==0).all():
         #    return html.H5('Noun phrase "{}" not found. Try searching again!'.format(input_box.strip()),
         #    style={'color': colours['text']}
         #    )
-        # one_phrase_df will contain only one row
         current_cluster = dropdown_val
         current_cluster_message = 'Noun phrases in {}:\n'.format(str(dropdown_val))
-        # Get the list of words using iloc[0] (only one row) and build it into a string with commas (input file had semicolons)
-        current_cluster_phrases = ', '.join(one_phrase_df.phrases.split(';'))
+        # Build the list of words into a string with commas (input file had semicolons)
+        current_cluster_phrases = ', '.join(cluster_index.phrases(cluster_only_number))
 
         # Plot the graph for the current cluster as well
         data = [
@@ -445,6 +414,7 @@ def select_cluster_phrases(termtype, timeperiod, n_clicks, dropdown_val):
     [Input('type_of_term', 'value'),
     Input('submit-button', 'n_clicks')],
     [State('npinput1-state', 'value')])
+@timed_callback
 def create_second_graph(termtype, n_clicks, input_box):
     """ Wrapped function which takes user input in a text box, and 2 radio buttons, returns the
     graph for document frequency trends according to clusters
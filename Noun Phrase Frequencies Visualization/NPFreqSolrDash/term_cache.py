@@ -0,0 +1,207 @@
+""" This module is a server-side memoized store for the data of the search terms of the dashboards. The monthly
+counts of a term (time_series.py) come from the phrase matrices or from a Solr query, and all the graphs are derived
+from them: the graph of total occurrences and the graph of unique occurrences (document frequencies), which are drawn
+by separate callbacks triggered by the same Submit click, the monthly and yearly graphs, and the graphs of
+phrases_or_entities_over_time.py. With this store, the counts are fetched only once per (term, term type): the first
+call computes them and stores them, and the other callbacks read them. If a callback asks for a term which is still
+being computed by another callback of the same process (the callbacks of one click run at the same time), it waits
+for that result instead of sending the same query to Solr.
+The store has 2 tiers (cache_backends, which can be replaced with set_cache_backends):
+  1. LocalCache: the MAX_CACHED_TERMS most recently used terms, in the memory of the process.
+  2. SQLiteCache: an SQLite database on disk (CACHE_DATABASE) shared by all the dashboard processes (e.g. the
+     workers of gunicorn) and kept across restarts, so a term is computed once for all of them.
+The keys contain the version of the Solr index of the term type (read from Solr every INDEX_VERSION_TTL seconds), so
+the stored data of an index which has been rebuilt is never used again. If the version can't be read, only the local
+tier is used.
+IMPORTANT: the stored dataframes are shared by all the callers, they must not be modified. """
+import functools
+import pickle
+import sqlite3
+import threading
+from collections import OrderedDict
+from time import time
+from term_fetch import solr_session
+
+MAX_CACHED_TERMS = 512
+CACHE_DATABASE = 'term_cache.sqlite3'
+# Max. no. of terms in the SQLite database (the least recently used ones are deleted)
+MAX_DATABASE_TERMS = 100000
+# The database is pruned once every PRUNE_EVERY terms stored by a process
+PRUNE_EVERY = 1000
+# No. of seconds during which the index version of a term type is reused before being read from Solr again
+INDEX_VERSION_TTL = 300
+SOLR_URL = 'http://localhost:8983/solr/'
+# Solr collection of each term type
+TERM_TYPE_COLLECTIONS = {'nounphrases': 'nounphrases', 'entities': 'nounphrases_wikipedia'}
+
+# Returned by the get method of the backends for a key which isn't stored (None is a valid value)
+MISSING = object()
+
+class LocalCache:
+    """ In-memory LRU store of 1 process. """
+    # Only visible to the process which stores the values
+    shared = False
+
+    def __init__(self, max_terms=MAX_CACHED_TERMS):
+        self.max_terms = max_terms
+        # key: (term, kind of data, term type, index version), least recently used first
+        self.values = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.values:
+                return MISSING
+            self.values.move_to_end(key)
+            return self.values[key]
+
+    def set(self, key, value):
+        with self.lock:
+            self.values[key] = value
+            self.values.move_to_end(key)
+            while len(self.values) > self.max_terms:
+                self.values.popitem(last=False)
+
+class SQLiteCache:
+    """ On-disk store shared by all the processes which use the same database file. The values are pickled.
+    Database errors (e.g. a locked or full disk) are printed and the term is treated as not stored. """
+    shared = True
+
+    def __init__(self, filename=CACHE_DATABASE, max_terms=MAX_DATABASE_TERMS):
+        self.filename = filename
+        self.max_terms = max_terms
+        # 1 connection per thread (sqlite3 connections can't be shared between threads)
+        self.connections = threading.local()
+        self.num_stored = 0
+
+    def connection(self):
+        if getattr(self.connections, 'connection', None) is None:
+            connection = sqlite3.connect(self.filename, timeout=30)
+            # Readers don't block the writer (and vice versa) in WAL mode
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS terms (key TEXT PRIMARY KEY, value BLOB, last_used REAL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS terms_last_used ON terms (last_used)')
+            self.connections.connection = connection
+        return self.connections.connection
+
+    def get(self, key):
+        try:
+            connection = self.connection()
+            row = connection.execute('SELECT value FROM terms WHERE key = ?', (repr(key),)).fetchone()
+            if row is None:
+                return MISSING
+            with connection:
+                connection.execute('UPDATE terms SET last_used = ? WHERE key = ?', (time(), repr(key)))
+        except sqlite3.Error as error:
+            print("Term cache database error: {}".format(error))
+            return MISSING
+        return pickle.loads(row[0])
+
+    def set(self, key, value):
+        try:
+            connection = self.connection()
+            with connection:
+                connection.execute('INSERT OR REPLACE INTO terms VALUES (?, ?, ?)',
+                                   (repr(key), pickle.dumps(value, pickle.HIGHEST_PROTOCOL), time()))
+            self.num_stored += 1
+            if self.num_stored % PRUNE_EVERY == 0:
+                with connection:
+                    connection.execute('DELETE FROM terms WHERE key NOT IN '
+                                       '(SELECT key FROM terms ORDER BY last_used DESC LIMIT ?)', (self.max_terms,))
+        except sqlite3.Error as error:
+            print("Term cache database error: {}".format(error))
+
+# Tiers of the store, searched in this order
+cache_backends = [LocalCache(), SQLiteCache()]
+
+def set_cache_backends(backends):
+    """ Replaces the tiers of the store, e.g. set_cache_backends([LocalCache()]) to keep everything in memory.
+    A backend has a get(key) method returning MISSING for keys which aren't stored, a set(key, value) method,
+    and a shared attribute (True if other processes see the values it stores). """
+    cache_backends[:] = backends
+
+# key: term type, value: (index version, time at which it was read)
+index_versions = {}
+index_versions_lock = threading.Lock()
+
+def get_index_version(term_type):
+    """ Returns the version of the Solr index of a term type (it changes whenever the index is modified), or None if
+    it can't be read. """
+    with index_versions_lock:
+        if term_type in index_versions and time() - index_versions[term_type][1] < INDEX_VERSION_TTL:
+            return index_versions[term_type][0]
+    try:
+        solr_response = solr_session.get(SOLR_URL + TERM_TYPE_COLLECTIONS[term_type] + '/admin/luke',
+                                         params={'numTerms': 0, 'show': 'index', 'wt': 'json'}, timeout=5)
+        index_version = solr_response.json()['index']['version'] if solr_response.ok else None
+    except (OSError, ValueError, KeyError):
+        index_version = None
+    with index_versions_lock:
+        index_versions[term_type] = (index_version, time())
+    return index_version
+
+class PendingTerm:
+    """ A term whose data is being computed: the other callers wait on done, then read result (or error). """
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+# key: (term, kind of data, term type, index version), value: PendingTerm
+pending_terms = {}
+cache_lock = threading.Lock()
+
+def cached_value(key, backends):
+    """ Returns the stored value of a key (copied to the tiers before the one it was found in), or MISSING. """
+    for position, backend in enumerate(backends):
+        value = backend.get(key)
+        if value is not MISSING:
+            for upper_backend in backends[:position]:
+                upper_backend.set(key, value)
+            return value
+    return MISSING
+
+def memoized_aggregates(kind, term_type):
+    """ Decorator for a function which computes the data of a term (e.g. the monthly counts of time_series.py) and
+    stores its results in the shared store.
+    ARGUMENTS: kind, string: the kind of data, part of the key (e.g. 'monthly_counts')
+               term_type, string: 'nounphrases' or 'entities'
+    RETURNS: the decorator. The decorated function takes a (stripped) search term and returns the same value
+             as the function (None for a term which is not found is stored too). """
+    def decorator(compute):
+        @functools.wraps(compute)
+        def wrapper(query):
+            index_version = get_index_version(term_type)
+            key = (query, kind, term_type, index_version)
+            backends = [backend for backend in cache_backends if index_version is not None or not backend.shared]
+            value = cached_value(key, backends)
+            if value is not MISSING:
+                return value
+            with cache_lock:
+                pending = pending_terms.get(key)
+                computes = pending is None
+                if computes:
+                    pending = pending_terms[key] = PendingTerm()
+            if not computes:
+                # Another callback is computing the same term: wait for it
+                pending.done.wait()
+                if pending.error is not None:
+                    raise pending.error
+                return pending.result
+            try:
+                # Another process may have stored it in the meantime
+                pending.result = cached_value(key, backends)
+                if pending.result is MISSING:
+                    pending.result = compute(query)
+                    for backend in backends:
+                        backend.set(key, pending.result)
+            except BaseException as error:
+                pending.error = error
+                raise
+            finally:
+                with cache_lock:
+                    del pending_terms[key]
+                pending.done.set()
+            return pending.result
+        return wrapper
+    return decorator
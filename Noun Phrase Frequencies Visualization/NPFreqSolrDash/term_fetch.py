@@ -0,0 +1,52 @@
+""" This module fetches the aggregated data of all the terms of a comma-separated dashboard query at the same time.
+The graph functions of the nounphrase/entity_mentions visualization modules used to call get_aggregated_data for 1
+term after the other, so a comparison of 10 terms took 10 times as long as 1 term. fetch_terms submits all the terms
+to a thread pool shared by all the callbacks, and the Solr requests of time_series.py go through 1 pooled
+HTTP session (solr_session), which keeps its connections to Solr open between requests.
+Each query waits at most TERM_TIMEOUT seconds for its terms: the graphs are drawn with the terms which are ready, and
+the other (slow) terms are listed in a message above the graph. A slow term is not cancelled: its Solr request goes on
+(up to SOLR_TIMEOUT seconds) and its result is stored by term_cache.py, so submitting the query again shows it. """
+import concurrent.futures
+from time import time
+import requests
+from callback_timing import current_timing, run_with_timing, timed_stage
+
+# Max. no. of seconds a graph waits for the data of its terms
+TERM_TIMEOUT = 10
+# Max. no. of seconds of a Solr request (a slow term keeps loading in the background after TERM_TIMEOUT)
+SOLR_TIMEOUT = 120
+# Max. no. of terms fetched at the same time (by all the callbacks), and no. of pooled connections to Solr
+MAX_PARALLEL_TERMS = 16
+
+solr_session = requests.Session()
+solr_session.mount('http://', requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=MAX_PARALLEL_TERMS))
+term_executor = concurrent.futures.ThreadPoolExecutor(max_workers=MAX_PARALLEL_TERMS)
+
+def fetch_terms(get_aggregated_data, terms, timeout=TERM_TIMEOUT):
+    """ Calls get_aggregated_data for all the terms at the same time.
+    ARGUMENTS: get_aggregated_data, function: the get_aggregated_data of a visualization module
+               terms, list of strings: the (stripped) terms of the user's query
+               timeout, int: max. no. of seconds to wait for all the terms
+    RETURNS: fetched_terms, dict: term -> (docs_df_total, docs_df_unique) of the terms which were fetched in time
+             slow_terms, list of the terms which weren't (or whose Solr request timed out) """
+    start_time = time()
+    # Duplicate terms are fetched once, their stages are timed for the calling callback (see callback_timing.py)
+    timing = current_timing()
+    futures = {term: term_executor.submit(run_with_timing, timing, get_aggregated_data, term)
+               for term in dict.fromkeys(terms)}
+    with timed_stage('fetch'):
+        concurrent.futures.wait(futures.values(), timeout=timeout)
+    fetched_terms = {}
+    slow_terms = []
+    for term, future in futures.items():
+        if not future.done():
+            slow_terms.append(term)
+            continue
+        try:
+            fetched_terms[term] = future.result()
+        except requests.exceptions.Timeout:
+            slow_terms.append(term)
+    if slow_terms != []:
+        print("Terms not fetched in {} seconds ({:.1f} seconds for {} terms): {}".format(
+            timeout, time() - start_time, len(futures), ', '.join(slow_terms)))
+    return fetched_terms, slow_terms
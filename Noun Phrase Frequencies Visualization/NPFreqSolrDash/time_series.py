@@ -0,0 +1,174 @@
+""" This module is the time series engine of the dashboards. The monthly and yearly dashboards (noun phrases and
+Wikipedia entities) used to fetch every term from Solr for each granularity and aggregate it with their own copy of
+the code. Here, the monthly counts of a term (no. of occurrences and no. of documents per month) are fetched once, from
+the phrase matrices (phrase_matrices.py) or from Solr, and stored by term_cache.py. The series of every resolution are
+derived from them with vectorized Pandas operations, so switching between monthly and yearly graphs doesn't fetch
+anything:
+  - month, quarter, year: the counts and the total no. of phrases/documents of the months of the period are summed,
+    and the percentages are the summed counts divided by the summed totals.
+  - rolling windows of N months: the counts and the totals are summed over the last N months.
+The totals come from the json files of the monthly totals (the yearly totals are their sums). Periods with fewer than
+MIN_PERIOD_DOCUMENTS documents in the whole corpus are left out: e.g. March 2007 has only 2 documents, a phrase present
+in 1 of them would be present in 50% of the documents in the graph, and would destroy the scale. Weeks aren't
+supported: there are no weekly totals to divide by. """
+import json
+import sys
+import threading
+import numpy as np
+import pandas as pd
+from term_cache import memoized_aggregates
+from term_fetch import solr_session, SOLR_TIMEOUT
+from phrase_matrices import matrix_monthly_counts
+from entity_aliases import entity_url_exists
+from callback_timing import timed_stage, add_size
+
+SOLR_URL = 'http://localhost:8983/solr/'
+# term type: Solr collection, phrase field, json file with the monthly total no. of phrases and docs
+TERM_TYPES = {'nounphrases': ('nounphrases', 'phrase', 'phrases_and_docs_monthly.json'),
+              'entities': ('nounphrases_wikipedia', 'wikipedia_url', 'phrase_urls_and_docs_monthly.json')}
+# resolution: Pandas period frequency, no. of months of the rolling window (None: no window), period column
+RESOLUTIONS = {'monthly': ('M', None, 'monthyear'),
+               'quarterly': ('Q', None, 'quarter'),
+               'yearly': ('Y', None, 'year'),
+               'rolling_3_months': ('M', 3, 'monthyear'),
+               'rolling_12_months': ('M', 12, 'monthyear')}
+# Periods with fewer documents in the whole corpus are left out of the series
+MIN_PERIOD_DOCUMENTS = 10
+
+def read_totals(filename):
+    """ Reads a json file with the total no. of phrases and docs per month (a json array of 2 objects).
+    RETURNS: phrases_total, dict: month -> no. of phrases, docs_total, dict: month -> no. of docs """
+    with open(filename, 'r') as file:
+        json_array = json.load(file)
+    return json_array[0], json_array[1]
+
+# key: term type, value: Pandas df with index=month and columns phrases, documents (the monthly totals)
+monthly_totals = {}
+monthly_totals_lock = threading.Lock()
+
+def get_monthly_totals(term_type):
+    """ Returns the monthly totals of a term type (read from the json file the first time they are needed). """
+    with monthly_totals_lock:
+        if term_type not in monthly_totals:
+            with timed_stage('totals'):
+                phrases_total, docs_total = read_totals(TERM_TYPES[term_type][2])
+            months = sorted(phrases_total)
+            monthly_totals[term_type] = pd.DataFrame(
+                {'phrases': [float(phrases_total[month]) for month in months],
+                 'documents': [float(docs_total.get(month, 0)) for month in months]},
+                index=pd.PeriodIndex(months, freq='M'))
+        return monthly_totals[term_type]
+
+def search_solr_docs(term, term_type):
+    """ Searches the collection of a term type for a phrase (exact search on the phrase field) and returns the list
+    of the docs (1 per paper, with published_date and num_occurrences). """
+    collection, search_field = TERM_TYPES[term_type][:2]
+    url_params = {'q': '"' + term + '"', 'rows': 100000, 'df': search_field, 'fl': 'published_date,num_occurrences',
+                  'wt': 'json'}
+    # Pooled connections to Solr (the terms of a query are fetched at the same time, see term_fetch.py)
+    with timed_stage('solr'):
+        solr_response = solr_session.get(SOLR_URL + collection + '/select', params=url_params, timeout=SOLR_TIMEOUT)
+        if solr_response.ok:
+            add_size('solr_bytes', len(solr_response.content))
+            return solr_response.json()['response']['docs']
+    print("Invalid response returned from Solr")
+    sys.exit(11)
+
+def monthly_counts_from_docs(docs, months):
+    """ Returns the monthly counts of the Solr docs of a term: a Pandas df with index=months and columns occurrences
+    (sum of num_occurrences) and documents (no. of docs). """
+    docs_df = pd.DataFrame(docs)
+    # published_date is a Solr timestamp (2017-08-31T00:00:00Z): the month is its 1st 7 characters
+    docs_df['month'] = docs_df.published_date.str[:7]
+    counts = docs_df.groupby('month').num_occurrences.agg(['sum', 'count'])
+    counts.columns = ['occurrences', 'documents']
+    counts = counts.reindex([str(month) for month in months], fill_value=0).astype('int64')
+    counts.index = months
+    return counts
+
+def fetch_monthly_counts(term, term_type):
+    """ Returns the monthly counts of a term (Pandas df with index=month and columns occurrences, documents), from
+    the phrase matrices if the phrase has a row, from Solr otherwise. Returns None if the term is not found. """
+    with timed_stage('matrices'):
+        counts = matrix_monthly_counts(term, term_type)
+    if counts is not None:
+        return counts
+    # URLs which aren't in the alias table aren't in the index either: no Solr query
+    if term_type == 'entities' and not entity_url_exists(term):
+        return None
+    docs = search_solr_docs(term, term_type)
+    if docs == []:
+        return None
+    months = get_monthly_totals(term_type).index
+    with timed_stage('aggregation'):
+        return monthly_counts_from_docs(docs, months)
+
+# The monthly counts are computed once per term (whatever the resolution of the graphs) and stored by term_cache.py
+@memoized_aggregates('monthly_counts', 'nounphrases')
+def nounphrase_monthly_counts(term):
+    return fetch_monthly_counts(term, 'nounphrases')
+
+@memoized_aggregates('monthly_counts', 'entities')
+def entity_monthly_counts(term):
+    return fetch_monthly_counts(term, 'entities')
+
+MONTHLY_COUNTS = {'nounphrases': nounphrase_monthly_counts, 'entities': entity_monthly_counts}
+
+def resample_counts(counts, totals, resolution):
+    """ Aggregates monthly counts and totals to a resolution (see RESOLUTIONS).
+    ARGUMENTS: counts, Pandas df with index=month and columns occurrences, documents
+               totals, Pandas df with index=month and columns phrases, documents (the corpus totals)
+               resolution, string: one of the keys of RESOLUTIONS
+    RETURNS: Pandas df with index=period and columns occurrences, documents, phrases_total, documents_total
+             (only the periods with at least MIN_PERIOD_DOCUMENTS documents in the corpus) """
+    frequency, window, _ = RESOLUTIONS[resolution]
+    frame = pd.DataFrame({'occurrences': counts.occurrences, 'documents': counts.documents,
+                          'phrases_total': totals.phrases, 'documents_total': totals.documents},
+                         index=totals.index).fillna(0)
+    if frequency != 'M':
+        frame = frame.groupby(frame.index.asfreq(frequency)).sum()
+    if window is not None:
+        frame = frame.rolling(window).sum().dropna()
+    return frame[frame.documents_total >= MIN_PERIOD_DOCUMENTS]
+
+def series_from_counts(counts, totals, resolution):
+    """ Returns the series (docs_df_total, docs_df_unique, see term_series) of the monthly counts of a term at a
+    resolution, or (None, None) if the term doesn't occur in any period of the resolution. """
+    frame = resample_counts(counts, totals, resolution)
+    nonzero = np.flatnonzero(frame.occurrences.values)
+    if len(nonzero) == 0:
+        return None, None
+    frame = frame.iloc[nonzero[0]: nonzero[-1] + 1]
+    index = frame.index.to_timestamp(how='end').normalize().rename('published_date')
+    period_column = RESOLUTIONS[resolution][2]
+    periods = frame.index.astype(str)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        docs_df_total = pd.DataFrame({'num_occurrences': frame.occurrences.values.astype('int64'),
+                                      period_column: periods,
+                                      'percentage_occurrences': np.nan_to_num(
+                                          100 * frame.occurrences.values / frame.phrases_total.values)},
+                                     index=index)
+        docs_df_unique = pd.DataFrame({'num_occurrences': frame.documents.values.astype('int64'),
+                                       period_column: periods,
+                                       'percentage_occurrences': np.nan_to_num(
+                                           100 * frame.documents.values / frame.documents_total.values)},
+                                      index=index)
+    return docs_df_total, docs_df_unique
+
+def term_series(term, term_type, resolution):
+    """ Returns the series of a term at a resolution, in the format used by the graphs of the dashboards.
+    ARGUMENTS: term, string: one of the parts of the user's comma-separated query (a Wikipedia URL for entities)
+               term_type, string: 'nounphrases' or 'entities'
+               resolution, string: one of the keys of RESOLUTIONS, e.g. 'monthly' or 'yearly'
+    RETURNS: docs_df_total, a Pandas df with index=published_date (the end of each period), columns
+             num_occurrences (no. of occurrences in the period), the period column (e.g. monthyear) and
+             percentage_occurrences (percentage of all the phrases of the period).
+             docs_df_unique, the same with the no. of documents and the percentage of all the documents.
+             Only the periods from the first to the last one in which the term occurs are kept. (None, None) is
+             returned if the term is not found. """
+    counts = MONTHLY_COUNTS[term_type](term)
+    if counts is None:
+        return None, None
+    totals = get_monthly_totals(term_type)
+    with timed_stage('aggregation'):
+        return series_from_counts(counts, totals, resolution)
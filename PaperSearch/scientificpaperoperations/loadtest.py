@@ -0,0 +1,267 @@
+    #-------------------------------------------------------------------------------
+    # Name:        PaperSearch load test
+    # Purpose:     Replays a query log (recorded or synthetic) against the 5 search views
+    #              of a running PaperSearch server with increasing concurrency, and reports
+    #              p50/p95/p99 latency, throughput and error rate per search type and concurrency
+    #              level (latencies and throughput only count the successful requests).
+    #              Reports are saved as JSON and can be compared with a previous run to
+    #              catch regressions before a release.
+    #              Solr can be replaced by a stand-in which serves recorded responses from a
+    #              fixture file, so that runs are repeatable and independent of the index.
+    #
+    # Usage:       1. Record Solr responses (real Solr moved to another port, e.g. 8984):
+    #                 python loadtest.py --record-fixture solr_fixture.json --upstream http://localhost:8984
+    #              2. Replay against the fixture (nothing else may listen on port 8983):
+    #                 python loadtest.py --fixture solr_fixture.json --query-log queries.tsv --report run.json
+    #              3. Compare 2 runs:
+    #                 python loadtest.py --fixture solr_fixture.json --report new.json --compare run.json
+    #              The PaperSearch server (manage.py runserver / gunicorn) must be running at --base-url.
+    #              Query log format: 1 query per line, tab-separated: search type, query, numrows. Search
+    #              types: phrase, title, author, citedpaper, citedauthor.
+    #-------------------------------------------------------------------------------
+import argparse
+import concurrent.futures
+import json
+import math
+import threading
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import cycle, islice
+from time import perf_counter
+from urllib.parse import urlencode, urlparse, parse_qsl
+import requests
+
+# Search type in the query log -> results URL (papersearchengine/urls.py)
+SEARCH_URLS = {'phrase': '/searchengine/phrasesearchresults/',
+               'title': '/searchengine/titlesearchresults/',
+               'author': '/searchengine/authorsearchresults/',
+               'citedpaper': '/searchengine/citedpapersearchresults/',
+               'citedauthor': '/searchengine/citedauthorsearchresults/'}
+
+# Queries used when no query log is given
+SYNTHETIC_QUERIES = {'phrase': ['semantic cognition', 'knowledge base completion', 'stochastic pooling', 'neural network'],
+                     'title': ['linked data quality', 'deep learning', 'question answering'],
+                     'author': ['Tim Berners-Lee', 'Yoshua Bengio', 'Christopher D. Manning; Richard Socher'],
+                     'citedpaper': ['ImageNet classification with deep convolutional neural networks', 'Latent Dirichlet allocation'],
+                     'citedauthor': ['Yoshua Bengio', 'Geoffrey Hinton', 'Tim Berners-Lee']}
+PERCENTILES = (50, 95, 99)
+# A p95 latency increase or a throughput decrease above this fraction is reported as a regression (and so is any
+# increase of the error rate)
+REGRESSION_THRESHOLD = 0.1
+
+def read_query_log(filename):
+    """ Reads a query log: each line has the search type, the query and (optionally) numrows separated by tabs.
+    Returns a list of (search type, query, numrows) tuples. Unknown search types are skipped."""
+    queries = []
+    with open(filename, 'r') as file:
+        for line in file:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) < 2 or fields[0] not in SEARCH_URLS:
+                continue
+            numrows = int(fields[2]) if len(fields) > 2 and fields[2] != '' else 100
+            queries.append((fields[0], fields[1], numrows))
+    return queries
+
+def synthetic_query_log(numrows=100):
+    """ Returns a query log with all the synthetic queries of all the search types, interleaved. """
+    queries = []
+    for search_type, search_queries in SYNTHETIC_QUERIES.items():
+        queries.extend((search_type, query, numrows) for query in search_queries)
+    # Interleave the search types, so that every concurrency level gets a mix of them
+    queries.sort(key=lambda entry: SYNTHETIC_QUERIES[entry[0]].index(entry[1]))
+    return queries
+
+def fixture_key(path, params):
+    """ Key of a Solr request in the fixture: the path (collection) and the sorted query parameters. """
+    return path + '?' + urlencode(sorted(params))
+
+def make_solr_handler(fixture, upstream=None, lock=None):
+    """ Creates the request handler class of the Solr stand-in. If upstream is None, recorded responses are
+    served from fixture (an empty result is returned for requests which weren't recorded). Otherwise, each
+    request is forwarded to the real Solr at upstream, and the response is recorded in fixture. """
+    class SolrStandInHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = parse_qsl(url.query)
+            key = fixture_key(url.path, params)
+            if upstream is not None:
+                solr_response = requests.get(upstream + url.path, params=params)
+                body = solr_response.text
+                if solr_response.ok:
+                    with lock:
+                        fixture[key] = body
+                status = solr_response.status_code
+            else:
+                status = 200
+                body = fixture.get(key)
+                if body is None:
+                    params = dict(params)
+                    body = json.dumps({'responseHeader': {'status': 0, 'params': params},
+                                       'response': {'numFound': 0, 'start': 0, 'docs': []},
+                                       'nextCursorMark': params.get('cursorMark', '*')})
+            body = body.encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # Don't print a line for every request
+            pass
+    return SolrStandInHandler
+
+def start_solr_stand_in(fixture, upstream=None, lock=None, port=8983):
+    """ Starts the Solr stand-in on port (8983 is where PaperSearch expects Solr) in a background thread. """
+    server = ThreadingHTTPServer(('localhost', port), make_solr_handler(fixture, upstream, lock))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def send_query(session, base_url, search_type, query, numrows):
+    """ Sends one search request and returns (search type, latency in seconds, ok). """
+    start = perf_counter()
+    try:
+        response = session.get(base_url + SEARCH_URLS[search_type], params={'query': query, 'numrows': numrows})
+        ok = response.ok
+    except requests.RequestException:
+        ok = False
+    return search_type, perf_counter() - start, ok
+
+def percentile(sorted_values, percent):
+    """ Nearest-rank percentile of an already sorted list. """
+    if sorted_values == []:
+        return None
+    rank = max(math.ceil(percent / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+def summarize(latencies, errors, elapsed):
+    """ Summary statistics of one search type (or all) at one concurrency level. latencies (seconds) are those of
+    the successful requests only: a failed request (connection refused, 5xx) is often fast, and would make the
+    latencies look better than they are. The failed requests are counted in errors and error_rate instead. """
+    latencies = sorted(latencies)
+    num_requests = len(latencies) + errors
+    summary = {'requests': num_requests, 'errors': errors, 'error_rate': errors / num_requests if num_requests else 0,
+               'throughput': len(latencies) / elapsed if elapsed > 0 else 0}
+    for percent in PERCENTILES:
+        summary['p{}'.format(percent)] = percentile(latencies, percent)
+    return summary
+
+def run_level(base_url, queries, concurrency, num_requests):
+    """ Replays num_requests queries from the log (cycling through it) with concurrency parallel clients, and
+    returns the summary per search type plus an 'all' summary. Only the successful requests have a latency. """
+    sessions = threading.local()
+    def worker(entry):
+        if not hasattr(sessions, 'session'):
+            sessions.session = requests.Session()
+        return send_query(sessions.session, base_url, *entry)
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    start = perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for search_type, latency, ok in executor.map(worker, islice(cycle(queries), num_requests)):
+            for key in (search_type, 'all'):
+                if ok:
+                    latencies[key].append(latency)
+                else:
+                    errors[key] += 1
+    elapsed = perf_counter() - start
+    search_types = set(latencies) | set(errors)
+    return {search_type: summarize(latencies[search_type], errors[search_type], elapsed) for search_type in search_types}
+
+def format_latency(latency):
+    """ Formats a latency in seconds (None if no request succeeded). """
+    return 'n/a' if latency is None else '{:.3f}s'.format(latency)
+
+def run(base_url, queries, concurrency_levels, requests_per_level, warmup):
+    """ Runs the warm-up requests (not measured), then each concurrency level in increasing order.
+    Returns the report: {concurrency level: {search type: summary}}. """
+    if warmup > 0:
+        run_level(base_url, queries, 1, warmup)
+    report = {}
+    for concurrency in sorted(concurrency_levels):
+        report[str(concurrency)] = run_level(base_url, queries, concurrency, requests_per_level)
+        overall = report[str(concurrency)]['all']
+        print('concurrency={:<3} p50={} p95={} p99={} throughput={:.1f} req/s errors={} ({:.1%})'.format(
+            concurrency, format_latency(overall['p50']), format_latency(overall['p95']), format_latency(overall['p99']),
+            overall['throughput'], overall['errors'], overall['error_rate']))
+    return report
+
+def compare_reports(old_report, new_report, threshold=REGRESSION_THRESHOLD):
+    """ Prints the change in p95 latency, throughput and error rate for every (concurrency, search type) present
+    in both reports, and returns the list of regressions (p95 up or throughput down by more than threshold, or a
+    higher error rate). """
+    regressions = []
+    for concurrency, search_types in new_report.items():
+        for search_type, new in search_types.items():
+            old = old_report.get(concurrency, {}).get(search_type)
+            if old is None or not old['p95'] or not old['throughput']:
+                continue
+            old_error_rate = old.get('error_rate', old['errors'] / old['requests'])
+            error_rate_change = new['error_rate'] - old_error_rate
+            if new['p95'] is None:
+                # No request succeeded
+                p95_change = math.inf
+            else:
+                p95_change = (new['p95'] - old['p95']) / old['p95']
+            throughput_change = (new['throughput'] - old['throughput']) / old['throughput']
+            regressed = p95_change > threshold or throughput_change < -threshold or error_rate_change > 0
+            print('{}concurrency={:<3} {:<12} p95 {} -> {} ({:+.0%}), throughput {:.1f} -> {:.1f} req/s ({:+.0%}), '
+                  'errors {:.1%} -> {:.1%}'.format(
+                'REGRESSION ' if regressed else '', concurrency, search_type, format_latency(old['p95']),
+                format_latency(new['p95']), p95_change, old['throughput'], new['throughput'], throughput_change,
+                old_error_rate, new['error_rate']))
+            if regressed:
+                regressions.append((concurrency, search_type))
+    return regressions
+
+def main():
+    """ Parses the arguments, starts the Solr stand-in if a fixture is used, runs the load test and
+    saves/compares the reports. """
+    parser = argparse.ArgumentParser(description='Load test for the PaperSearch search views.')
+    parser.add_argument('--base-url', default='http://localhost:8000', help='URL of the running PaperSearch server')
+    parser.add_argument('--query-log', help='tab-separated query log (default: synthetic queries)')
+    parser.add_argument('--concurrency', default='1,2,4,8,16', help='comma-separated concurrency levels (ramp-up)')
+    parser.add_argument('--requests', type=int, default=200, help='no. of requests per concurrency level')
+    parser.add_argument('--warmup', type=int, default=10, help='no. of unmeasured warm-up requests')
+    parser.add_argument('--fixture', help='serve Solr responses recorded in this file (Solr stand-in on port 8983)')
+    parser.add_argument('--record-fixture', help='record the Solr responses of this run into this file')
+    parser.add_argument('--upstream', default='http://localhost:8984', help='real Solr used when recording')
+    parser.add_argument('--report', help='save the report (JSON) to this file')
+    parser.add_argument('--compare', help='compare with a previously saved report')
+    args = parser.parse_args()
+
+    queries = read_query_log(args.query_log) if args.query_log else synthetic_query_log()
+    if queries == []:
+        parser.error('{} has no valid query (1 per line: search type, query, numrows, tab-separated; search types: '
+                     '{})'.format(args.query_log, ', '.join(SEARCH_URLS)))
+    if args.requests < 1:
+        parser.error('--requests must be at least 1')
+    concurrency_levels = [int(level) for level in args.concurrency.split(',')]
+    server = None
+    fixture = {}
+    if args.record_fixture:
+        server = start_solr_stand_in(fixture, upstream=args.upstream, lock=threading.Lock())
+    elif args.fixture:
+        with open(args.fixture, 'r') as file:
+            fixture = json.load(file)
+        server = start_solr_stand_in(fixture)
+    try:
+        report = run(args.base_url, queries, concurrency_levels, args.requests, args.warmup)
+    finally:
+        if server is not None:
+            server.shutdown()
+    if args.record_fixture:
+        with open(args.record_fixture, 'w') as file:
+            json.dump(fixture, file)
+        print('Recorded {} Solr responses in {}'.format(len(fixture), args.record_fixture))
+    if args.report:
+        with open(args.report, 'w') as file:
+            json.dump(report, file, indent=2)
+    if args.compare:
+        with open(args.compare, 'r') as file:
+            old_report = json.load(file)
+        regressions = compare_reports(old_report, report)
+        print('{} regression(s) found.'.format(len(regressions)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+""" Admission control for the Solr requests of PaperSearch. Each Solr core gets a bounded number of concurrent
+requests (SOLR_CORE_LIMITS). A request which finds the core busy waits in a queue for at most QUEUE_TIMEOUT
+seconds; if the queue is already MAX_QUEUED deep, or the wait times out, it is rejected with SolrOverloaded
+instead of piling more work on Solr. Errors and timeouts of Solr itself raise SolrUnavailable (instead of
+killing the worker with sys.exit). AdmissionMiddleware turns both into a 503 "try again" response, so a few
+expensive searches on one core degrade their own requests instead of stalling every view. The queue depth,
+in-flight requests and admitted/rejected/failed counters of each core are exported on the metrics endpoint.
+NOTE: the limits are per process (per worker): the limit of Solr is roughly limit x no. of workers. """
+import threading
+import requests
+from django.http import JsonResponse
+from django.shortcuts import render
+from .timing import timed_stage, register_metrics
+
+# Max. no. of concurrent requests per core in each worker. references_plus serves the expensive
+# cited paper/author searches (up to 10 x numrows sentences per request), so it gets fewer slots.
+SOLR_CORE_LIMITS = {'papers_plus': 8, 'metadata_plus': 8, 'references_plus': 4, 'citation_stats': 4}
+DEFAULT_CORE_LIMIT = 4
+# Max. no. of seconds a request waits for a free slot, and max. no. of requests waiting per core
+QUEUE_TIMEOUT = 5
+MAX_QUEUED = 16
+# Max. no. of seconds to wait for Solr's response
+SOLR_TIMEOUT = 60
+# Seconds after which the client is told to retry (Retry-After header)
+RETRY_AFTER = 10
+
+class SolrUnavailable(Exception):
+    """ Solr returned an error, didn't respond in time or couldn't be reached. """
+
+class SolrOverloaded(SolrUnavailable):
+    """ The request wasn't sent to Solr because too many requests are already running or waiting for the core. """
+
+class CoreGate:
+    """ Bounded-concurrency gate of 1 Solr core, with its counters. """
+    def __init__(self, limit):
+        self.limit = limit
+        self.slots = threading.BoundedSemaphore(limit)
+        self.lock = threading.Lock()
+        self.queued = 0
+        self.in_flight = 0
+        self.counters = {'admitted': 0, 'rejected': 0, 'failed': 0}
+
+    def acquire(self):
+        """ Waits for a free slot. Raises SolrOverloaded if the queue is full or the wait times out. """
+        # Fast path: a slot is free
+        if self.slots.acquire(blocking=False):
+            self.admit()
+            return
+        with self.lock:
+            if self.queued >= MAX_QUEUED:
+                self.counters['rejected'] += 1
+                raise SolrOverloaded('Too many requests waiting for Solr')
+            self.queued += 1
+        try:
+            with timed_stage('solr_queue'):
+                acquired = self.slots.acquire(timeout=QUEUE_TIMEOUT)
+        finally:
+            with self.lock:
+                self.queued -= 1
+        if not acquired:
+            with self.lock:
+                self.counters['rejected'] += 1
+            raise SolrOverloaded('Timed out waiting for Solr')
+        self.admit()
+
+    def admit(self):
+        with self.lock:
+            self.in_flight += 1
+            self.counters['admitted'] += 1
+
+    def release(self, failed=False):
+        with self.lock:
+            self.in_flight -= 1
+            if failed:
+                self.counters['failed'] += 1
+        self.slots.release()
+
+# key: core name, value: CoreGate (created on first use)
+gates = {}
+gates_lock = threading.Lock()
+
+def get_gate(collection):
+    """ Returns the gate of a Solr core. """
+    with gates_lock:
+        if collection not in gates:
+            gates[collection] = CoreGate(SOLR_CORE_LIMITS.get(collection, DEFAULT_CORE_LIMIT))
+        return gates[collection]
+
+def solr_get(collection, solr_url, params, timeout=SOLR_TIMEOUT):
+    """ Sends a GET request to a Solr core through the core's gate and returns the response. Raises
+    SolrOverloaded if the request isn't admitted, and SolrUnavailable if Solr fails or times out. """
+    gate = get_gate(collection)
+    gate.acquire()
+    failed = True
+    try:
+        with timed_stage('solr'):
+            solr_response = requests.get(solr_url, params=params, timeout=timeout)
+        failed = not solr_response.ok
+    except requests.RequestException as error:
+        raise SolrUnavailable('Solr request failed: {}'.format(error))
+    finally:
+        gate.release(failed)
+    if failed:
+        raise SolrUnavailable('Invalid response returned from Solr (HTTP {})'.format(solr_response.status_code))
+    return solr_response
+
+def metric_lines():
+    """ Queue depth, in-flight requests and counters of each core in the Prometheus text format. """
+    lines = ['# HELP papersearch_solr_queue_depth Requests waiting for a Solr core.',
+             '# TYPE papersearch_solr_queue_depth gauge',
+             '# HELP papersearch_solr_in_flight Requests running on a Solr core.',
+             '# TYPE papersearch_solr_in_flight gauge',
+             '# HELP papersearch_solr_requests_total Solr requests per core and outcome (admitted, rejected, failed).',
+             '# TYPE papersearch_solr_requests_total counter']
+    with gates_lock:
+        core_gates = sorted(gates.items())
+    for collection, gate in core_gates:
+        with gate.lock:
+            lines.append('papersearch_solr_queue_depth{{core="{}"}} {}'.format(collection, gate.queued))
+            lines.append('papersearch_solr_in_flight{{core="{}"}} {}'.format(collection, gate.in_flight))
+            for outcome, count in sorted(gate.counters.items()):
+                lines.append('papersearch_solr_requests_total{{core="{}",outcome="{}"}} {}'.format(collection, outcome, count))
+    return lines
+
+register_metrics(metric_lines)
+
+class AdmissionMiddleware:
+    """ Django middleware which returns a degraded 503 response (HTML page, or JSON for the API) with a
+    Retry-After header when a view fails because Solr is overloaded or unavailable. """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_exception(self, request, exception):
+        if not isinstance(exception, SolrUnavailable):
+            return None
+        overloaded = isinstance(exception, SolrOverloaded)
+        message = ('The search engine is busy right now. Please try again in a few seconds.' if overloaded
+                   else 'The search engine is temporarily unavailable. Please try again later.')
+        if request.path.startswith('/searchengine/api/'):
+            response = JsonResponse({'error': message}, status=503)
+        else:
+            response = render(request, 'papersearchengine/tryagain.html', {'message': message}, status=503)
+        response['Retry-After'] = str(RETRY_AFTER)
+        return response
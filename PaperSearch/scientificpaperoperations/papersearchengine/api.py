@@ -0,0 +1,180 @@
+""" Versioned JSON API for the PaperSearch searches (phrase, title, author, cited paper, cited author and similar
+papers).
+Each search can be used in 2 modes:
+1. /searchengine/api/v1/<search_type>/?query=...&numrows=...: returns the same (max. 1000) results as the
+   HTML results page, as JSON.
+2. /searchengine/api/v1/<search_type>/export/?query=...&format=ndjson|csv: streams ALL the matching Solr
+   docs (all the search types except similar papers) as NDJSON or CSV. Solr is paged through with a cursor, and rows are sent to the client as soon as
+   each page arrives, so that the server never holds the whole result set in memory. If Solr fails during the
+   export, the response (already sent with a 200 status) ends with an error record instead: a JSON line with an
+   "error" key, or a CSV row whose first field starts with EXPORT_ERROR_PREFIX."""
+import csv
+import json
+from django.http import JsonResponse, StreamingHttpResponse
+from .forms import SearchPapersForm, SearchCitedAuthorsForm, SearchCitedPaperForm, SearchAuthorsForm, SearchMetatitleForm
+from .forms import SimilarPapersForm
+from .django_paper_search_v2 import search_sentences_plus, search_meta_titles, search_authors, \
+                                    search_references_plus, search_solr_cursor, search_citation_stats, \
+                                    search_similar_papers, author_export_query, filter_queries
+from .author_names import split_authors
+from .admission import SolrUnavailable
+
+API_VERSION = 'v1'
+# First field of the last CSV row of an export which Solr couldn't complete
+EXPORT_ERROR_PREFIX = '#ERROR'
+
+# Column order of the results returned by the search functions (the same order in which the
+# results templates unpack them).
+SENTENCE_COLUMNS = ['arxiv_identifier', 'arxiv_url', 'authors', 'dblp_url', 'published_date', 'revision_dates',
+                    'sentence', 'sentencenum', 'title']
+METADATA_COLUMNS = ['arxiv_identifier', 'arxiv_url', 'authors', 'dblp_url', 'published_date', 'revision_dates', 'title']
+SIMILAR_PAPERS_COLUMNS = METADATA_COLUMNS + ['similarity']
+CITATION_COLUMNS = ['annotation', 'cited_paper_details', 'citing_sentence', 'citing_arxiv_identifier', 'citing_paper_title',
+                    'citing_paper_authors', 'citing_arxiv_url', 'citing_published_date', 'citing_revision_dates',
+                    'citing_dblp_url']
+# Fields which are exported for each of the collections (fl parameter in Solr, header of the CSV file)
+REFERENCES_EXPORT_FIELDS = ['annotation', 'cited_paper_details', 'citing_sentence', 'citing_sentencenum',
+                            'citing_arxiv_identifier', 'citing_paper_title', 'citing_paper_authors', 'citing_arxiv_url',
+                            'citing_published_date', 'citing_revision_dates', 'citing_dblp_url']
+
+# search_type: form which validates the query, function which runs the search, columns of its results,
+# and the Solr parameters used for the export (collection, search field, query type, sort field, fields), or
+# None if the search can't be exported. The author searches are exported with the author key filters of the
+# search, their query type is the one of the proximity fallback (see author_export_query).
+SEARCH_TYPES = {
+    'phrase': {'form': SearchPapersForm, 'search': search_sentences_plus, 'columns': SENTENCE_COLUMNS,
+               'export': ('papers_plus', 'sentence', 'exact', 'published_date desc', SENTENCE_COLUMNS)},
+    'title': {'form': SearchMetatitleForm, 'search': search_meta_titles, 'columns': METADATA_COLUMNS,
+              'export': ('metadata_plus', 'title', 'exact', 'published_date desc', METADATA_COLUMNS)},
+    'author': {'form': SearchAuthorsForm, 'search': search_authors, 'columns': METADATA_COLUMNS,
+               'export': ('metadata_plus', 'authors', 'and', 'published_date desc', METADATA_COLUMNS)},
+    'similar': {'form': SimilarPapersForm, 'search': search_similar_papers, 'columns': SIMILAR_PAPERS_COLUMNS,
+                'export': None},
+    'citedpaper': {'form': SearchCitedPaperForm, 'search': lambda query, numrows, filters: search_references_plus(query, numrows, 'title', filters),
+                   'columns': CITATION_COLUMNS,
+                   'export': ('references_plus', 'cited_paper_details', 'proximity_title', 'citing_published_date desc',
+                              REFERENCES_EXPORT_FIELDS)},
+    'citedauthor': {'form': SearchCitedAuthorsForm, 'search': lambda query, numrows, filters: search_references_plus(query, numrows, 'authors', filters),
+                    'columns': CITATION_COLUMNS,
+                    'export': ('references_plus', 'cited_paper_details', 'proximity_authors', 'citing_published_date desc',
+                               REFERENCES_EXPORT_FIELDS)},
+}
+
+def error_response(message, status):
+    """ Returns a JSON error message with the given HTTP status code. """
+    return JsonResponse({'version': API_VERSION, 'error': message}, status=status)
+
+def validate_request(request, search_type):
+    """ Checks that search_type exists and validates the GET parameters with the search type's form.
+    Returns (search type dict, cleaned query, numrows, None) if the request is valid, and
+    (None, None, None, error response) otherwise."""
+    if search_type not in SEARCH_TYPES:
+        return None, None, None, error_response('Unknown search type: {}. Choose one of: {}.'.format(
+            search_type, ', '.join(SEARCH_TYPES)), 404)
+    search_config = SEARCH_TYPES[search_type]
+    form = search_config['form'](request.GET)
+    if not form.is_valid():
+        return None, None, None, JsonResponse({'version': API_VERSION, 'error': form.errors}, status=400)
+    query = form.cleaned_data.get('query')
+    numrows = form.cleaned_data.get('numrows')
+    if numrows is None:
+        numrows = 100
+    if search_type in ('author', 'citedauthor') and split_authors(query) == []:
+        return None, None, None, error_response('Enter at least 1 author.', 400)
+    if search_type == 'author':
+        # Same as the author search view: a list of authors separated by semicolons
+        query = split_authors(query)
+    return search_config, query, numrows, None
+
+def citing_sentences_to_dicts(sentence_list):
+    """ Converts the list of [sentence, 'start:end', '0:start', 'end:'] lists produced for the results
+    template into a list of dicts with the sentence and the integer offsets of the annotation. """
+    sentences = []
+    for sentence_with_offsets in sentence_list:
+        start, end = sentence_with_offsets[1].split(':')
+        sentences.append({'sentence': sentence_with_offsets[0], 'annotation_start': int(start),
+                          'annotation_end': int(end)})
+    return sentences
+
+def search(request, search_type):
+    """ Runs one of the searches and returns its results as JSON. The query and numrows GET parameters
+    are validated exactly like the search forms. Results can be filtered with fq parameters (facet:value,
+    like on the results pages), and the facet counts are returned. """
+    search_config, query, numrows, error = validate_request(request, search_type)
+    if error is not None:
+        return error
+    filters = tuple(request.GET.getlist('fq'))
+    reslist = search_config['search'](query, numrows, filters)
+    if reslist == []:
+        results, num_results, facets = [], 0, {}
+    else:
+        results, num_results, num_rows, _, facets = reslist
+    records = [dict(zip(search_config['columns'], result)) for result in results]
+    response = {'version': API_VERSION, 'search_type': search_type, 'query': request.GET.get('query'),
+                'numrows': numrows, 'numresults': num_results, 'filters': filters, 'results': records,
+                'facets': {facet: [{'value': value, 'label': label, 'count': count} for value, label, count in values]
+                           for facet, values in facets.items()}}
+    if search_config['columns'] is CITATION_COLUMNS:
+        for record in records:
+            record['citing_sentence'] = citing_sentences_to_dicts(record['citing_sentence'])
+        # Exact citation counts, citing papers per year and sentiment breakdown (precomputed in citation_stats)
+        response['citation_stats'] = search_citation_stats(query, 'title' if search_type == 'citedpaper' else 'authors') \
+                                     if results != [] else None
+    return JsonResponse(response)
+
+class Echo:
+    """ File-like object which returns what is written into it instead of storing it. This is used
+    with csv.writer to produce the CSV rows one by one for a StreamingHttpResponse. """
+    def write(self, value):
+        return value
+
+def export_error_message(error):
+    """ Returns the message of the error record which ends an incomplete export. """
+    return 'The export is incomplete, Solr failed while it was running ({}). Please try again.'.format(
+        type(error).__name__)
+
+def stream_ndjson(docs):
+    """ Yields 1 line of JSON for each doc. If Solr fails, the last line is {"error": message, "complete": false}. """
+    try:
+        for doc in docs:
+            yield json.dumps(doc) + '\n'
+    except SolrUnavailable as error:
+        yield json.dumps({'error': export_error_message(error), 'complete': False}) + '\n'
+
+def stream_csv(docs, fields):
+    """ Yields a CSV header with the field names, followed by 1 CSV row for each doc. If Solr fails, the last row
+    is EXPORT_ERROR_PREFIX and the error message. """
+    writer = csv.writer(Echo())
+    yield writer.writerow(fields)
+    try:
+        for doc in docs:
+            yield writer.writerow([doc.get(field) for field in fields])
+    except SolrUnavailable as error:
+        yield writer.writerow([EXPORT_ERROR_PREFIX, export_error_message(error)])
+
+def export(request, search_type):
+    """ Streams all the Solr docs which match the query as NDJSON (default) or CSV (format=csv). The fq parameters
+    filter the docs like in the search endpoint. Unlike the search endpoint, no limit is applied (numrows is
+    ignored), and rows are not grouped or sentiment-tagged: each row is one Solr doc. """
+    search_config, query, numrows, error = validate_request(request, search_type)
+    if error is not None:
+        return error
+    if search_config['export'] is None:
+        return error_response('The {} search can\'t be exported.'.format(search_type), 400)
+    export_format = request.GET.get('format', 'ndjson')
+    if export_format not in ('ndjson', 'csv'):
+        return error_response('Unknown export format: {}. Choose ndjson or csv.'.format(export_format), 400)
+    collection, search_field, query_type, sort_field, fields = search_config['export']
+    # The facet values selected by the user (fq parameters), like in the search
+    facet_queries = filter_queries(request.GET.getlist('fq'), collection, [])
+    filter_query = facet_queries if facet_queries != [] else None
+    if search_type in ('author', 'citedauthor'):
+        # Same author key filters (or proximity fallback) as the search
+        query, query_type, filter_query = author_export_query(query, collection, query_type, facet_queries)
+    docs = search_solr_cursor(query, collection, search_field, query_type, sort_field, fields, filter_query)
+    if export_format == 'csv':
+        response = StreamingHttpResponse(stream_csv(docs, fields), content_type='text/csv')
+    else:
+        response = StreamingHttpResponse(stream_ndjson(docs), content_type='application/x-ndjson')
+    response['Content-Disposition'] = 'attachment; filename="{}_search.{}"'.format(search_type, export_format)
+    return response
@@ -0,0 +1,148 @@
+""" Normalized author keys: the lowercased surname, and the surname + '_' + the first initial. They are indexed in the
+multi-valued author_keys field of metadata_plus and cited_author_keys field of references_plus and citation_stats
+(Solr/Indexing/author_keys.py loads this module for the indexers), and the author searches of
+django_paper_search_v2.py look up the same keys, so both sides always build them with the same code.
+Names are recognised in the formats of the arXiv metadata and of the reference strings:
+  - 'Tim Berners-Lee' and 'T. Berners-Lee' (first names or initials, then the surname)
+  - 'Berners-Lee, Tim' and 'Berners-Lee, T.' (surname, comma, first names or initials)
+  - 'Berners-Lee T' and 'Berners-Lee TJ' (surname, then 1 or 2 capital initials)
+NOTE: this module must not import Django or any PaperSearch module: it is also imported by the indexers. """
+import re
+import unicodedata
+
+# Separators of the names in an author list
+NAME_SEPARATORS = r',|;|&|\band\b'
+# The author list of a reference ends at a colon ('Hendler, J.: Title') or at a year in brackets
+# ('Hendler, J. (2001) Title')
+AUTHOR_LIST_END = r':|\(\s*(?:1[89]|20)\d\d'
+
+def normalize_name_part(text):
+    """ Lowercases text, strips accents and removes everything which is not a letter or a digit, so that
+    'Berners-Lee' and 'berners lee' both become 'bernerslee'. """
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return re.sub(r'[\W_]+', '', text)
+
+def is_initials(token):
+    """ True if token is 1 or 2 capital initials, with or without full stops or a hyphen: 'T', 'T.', 'TJ', 'T.J.',
+    'J.-P.'. Surnames of 2 letters ('Li', 'Ng') aren't: they aren't all capitals. """
+    letters = re.sub(r'[.\-]', '', token)
+    return 1 <= len(letters) <= 2 and letters.isalpha() and letters.isupper()
+
+def split_name(name):
+    """ Splits an author name into (surname, list of other names or initials). 'Tim Berners-Lee',
+    'Berners-Lee, Tim' and 'Berners-Lee T' all give ('Berners-Lee', [...]). """
+    if ',' in name:
+        surname, other_names = name.split(',', 1)
+        return surname.strip(), other_names.split()
+    tokens = name.split()
+    if tokens == []:
+        return '', []
+    # 'Surname I' or 'Surname IJ': trailing initials after a word which isn't one
+    num_initials = 0
+    while num_initials < len(tokens) - 1 and is_initials(tokens[-1 - num_initials]):
+        num_initials += 1
+    if num_initials > 0 and not is_initials(tokens[0]):
+        return ' '.join(tokens[:-num_initials]), tokens[-num_initials:]
+    return tokens[-1], tokens[:-1]
+
+def name_keys(surname, other_names):
+    """ Returns the keys of a name split by split_name: the normalized surname, and the normalized surname
+    followed by '_' and the first initial (if there is a first name or an initial), e.g. ['bernerslee',
+    'bernerslee_t']. """
+    surname = normalize_name_part(surname)
+    if surname == '':
+        return []
+    keys = [surname]
+    other_names = [normalize_name_part(other_name) for other_name in other_names]
+    other_names = [other_name for other_name in other_names if other_name != '']
+    if other_names != []:
+        keys.append('{}_{}'.format(surname, other_names[0][0]))
+    return keys
+
+def author_keys(name):
+    """ Returns the keys for one author name, e.g. ['bernerslee', 'bernerslee_t']. """
+    return name_keys(*split_name(name))
+
+def author_key(name):
+    """ Returns the most specific key for an author name entered by the user: surname_initial if a first name or
+    an initial is given ('Tim Berners-Lee', 'Berners-Lee, T.' or 'Berners-Lee T' -> 'bernerslee_t'), the surname
+    alone otherwise ('Berners-Lee' -> 'bernerslee'). """
+    keys = author_keys(name)
+    return keys[-1] if keys != [] else ''
+
+def author_keys_from_list(authors):
+    """ Returns the unique keys of all the authors in a list of author names. """
+    keys = []
+    for author in authors:
+        for key in author_keys(author):
+            if key not in keys:
+                keys.append(key)
+    return keys
+
+def split_authors(query):
+    """ Splits a query of authors separated by semicolons into the list of authors, leaving out the empty ones
+    (e.g. after a trailing semicolon). """
+    return [author.strip() for author in query.split(';') if author.strip() != '']
+
+def starts_with_surname_initials(details):
+    """ True if a reference string starts with an author in the 'Surname I' format: a word followed by capital
+    initials which end the name ('Berners-Lee T, Hendler J. ...', or 'Hendler J. The semantic web ...' for 1
+    author). 'Christopher D. Manning, ...' isn't: the word after the initial is followed by the end of the name. """
+    match = re.match(r'\s*([^\s,;.:]+)((?:\s+[^\s,;.:]+)*?)\s+((?:[^\W\d_][.\-]?){1,2})(?=[\s,;.:]|$)', details)
+    if match is None or is_initials(match.group(1)) or not is_initials(match.group(3)):
+        return False
+    rest = details[match.end():]
+    if rest.strip() == '' or re.match(r'\.?\s*(?:,|;|:|&|\band\b)', rest):
+        return True
+    # 'Hendler J. The semantic web': the full stop ends the author list if it is followed by more than 1 word
+    # before the next separator (a title), not by the surname of 'Christopher D. Manning, ...'
+    following = re.match(r'\.?\s+([^,;.:]*)', rest)
+    return following is not None and len(following.group(1).split()) > 1
+
+def extract_author_segment(details):
+    """ Returns the part of a cited paper's details (a free-text reference string such as 'Tim Berners-Lee,
+    James Hendler, and Ora Lassila. The semantic web. Scientific American, 2001.') which contains the authors.
+    It ends at a colon or a year in brackets (AUTHOR_LIST_END), or at the first full stop which ends a word:
+    any word in the 'Surname I' format (where initials have no full stops between names), any word but an
+    initial otherwise ('J. Hendler', 'Hendler, J.'). If there is no such end, the whole string is returned. """
+    end = re.search(AUTHOR_LIST_END, details)
+    if end is not None:
+        details = details[:end.start()]
+    surname_initials = starts_with_surname_initials(details)
+    for match in re.finditer(r'\.(\s|$)', details):
+        # The word which ends with this full stop: an initial (e.g. 'J.') doesn't end the author list
+        words = details[:match.start()].split()
+        preceding_word = words[-1] if words != [] else ''
+        if surname_initials or len(preceding_word.strip('.')) > 1:
+            return details[:match.start()]
+    return details
+
+def cited_author_keys(details):
+    """ Returns the author keys of a cited paper from its details string. The author segment is split into names on
+    commas, semicolons, 'and' and '&'. A part which only has initials is the rest of the name before it
+    ('Berners-Lee, T.' -> 'Berners-Lee' and 'T.'), 'et al.' is left out. """
+    segment = extract_author_segment(details)
+    parts = [part.strip() for part in re.split(NAME_SEPARATORS, segment)]
+    parts = [re.sub(r'(?:^|\s+)et\.?\s+al\.?$', '', part) for part in parts]
+    # Parts without a letter (e.g. a year) aren't names
+    parts = [part for part in parts if re.search(r'[^\W\d_]', part)]
+    names = []
+    for part in parts:
+        tokens = part.split()
+        if all(is_initials(token) for token in tokens):
+            # The initials of the previous surname; initials without a surname are left out
+            if names != [] and names[-1][1] == []:
+                names[-1] = (names[-1][0], tokens)
+            continue
+        if len(tokens) == 1:
+            # A surname alone, its initials may follow ('Berners-Lee, T.')
+            names.append((tokens[0], []))
+        else:
+            names.append(split_name(part))
+    keys = []
+    for surname, other_names in names:
+        for key in name_keys(surname, other_names):
+            if key not in keys:
+                keys.append(key)
+    return keys
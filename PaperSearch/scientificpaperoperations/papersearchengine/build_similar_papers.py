@@ -0,0 +1,161 @@
+""" Builds the index of the "similar papers" search (see similar_papers.py) from the papers_plus source files:
+1 text file per paper, 1 sentence per line, named after the arXiv identifier. Each paper is represented by the
+TF-IDF vector of its full text, reduced to N_COMPONENTS dimensions with a truncated SVD (LSA), so that the index
+is a small dense matrix which can be memory-mapped by the Django workers.
+The files are processed in parallel in 3 passes, none of which holds the sparse TF-IDF matrix of the whole corpus:
+  1. document frequencies: each worker hashes a chunk of files (HashingVectorizer, which needs no fitted
+     vocabulary) and returns the no. of papers each column occurs in; these are added up into the IDF weights.
+  2. SVD: the TF-IDF vectors of a random sample of SVD_SAMPLE_SIZE papers are computed in parallel, and the SVD
+     is fitted on them.
+  3. projection: each worker hashes a chunk of files again and projects the TF-IDF vectors on the SVD
+     components. The vectors are l2-normalized, so a dot product is the cosine similarity.
+Run it from the scientificpaperoperations folder after indexing_papers_plus.py, e.g.
+    python papersearchengine/build_similar_papers.py --folder /home/ashwath/Files/arxiv-cs-dataset-LREC2018/ """
+import argparse
+import concurrent.futures
+import os
+import random
+from glob import glob
+from time import time
+import numpy as np
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.decomposition import TruncatedSVD
+from sklearn.preprocessing import normalize
+from similar_papers import SimilarPapersIndex, save_index
+
+SOURCE_FOLDER = '/home/ashwath/Files/arxiv-cs-dataset-LREC2018/'
+INDEX_PREFIX = 'papersearchengine/similar_papers'
+N_FEATURES = 2**20
+N_COMPONENTS = 256
+# No. of papers the SVD is fitted on (the projection is applied to all the papers)
+SVD_SAMPLE_SIZE = 50000
+# No. of files hashed by a worker in 1 task
+CHUNK_SIZE = 500
+# Papers with fewer sentences than this are left out (mostly failed text extractions)
+MIN_SENTENCES = 5
+
+# Set in each worker process by init_worker (passed once instead of with every task)
+worker_state = {}
+
+def make_vectorizer():
+    """ Stateless vectorizer: raw term counts of unigrams and bigrams, English stop words removed. """
+    return HashingVectorizer(n_features=N_FEATURES, ngram_range=(1, 2), stop_words='english', alternate_sign=False,
+                             norm=None, dtype=np.float32)
+
+def arxiv_identifier_from_path(filepath):
+    """ Same identifier as the one indexed by indexing_papers_plus.py. """
+    return '.'.join(os.path.basename(filepath).split('.')[:2])
+
+def read_paper(filepath):
+    """ Returns the full text of a paper (its sentences joined), or None if it has fewer than MIN_SENTENCES
+    sentences. Lines starting with == are skipped, like in indexing_papers_plus.py. """
+    with open(filepath, 'r') as file:
+        sentences = [line.strip() for line in file if not line.startswith('==')]
+    if len(sentences) < MIN_SENTENCES:
+        return None
+    return ' '.join(sentences)
+
+def hash_papers(filepaths):
+    """ Returns the arXiv identifiers and the term count matrix (sparse, 1 row per paper) of the files. """
+    arxiv_identifiers = []
+    texts = []
+    for filepath in filepaths:
+        text = read_paper(filepath)
+        if text is not None:
+            arxiv_identifiers.append(arxiv_identifier_from_path(filepath))
+            texts.append(text)
+    return arxiv_identifiers, make_vectorizer().transform(texts)
+
+def tfidf(counts, idf):
+    """ Sublinear TF-IDF, l2-normalized (like TfidfTransformer(sublinear_tf=True)). """
+    counts = counts.tocsr(copy=True)
+    counts.data = np.log(counts.data) + 1
+    return normalize(counts.multiply(idf).tocsr())
+
+def document_frequencies(filepaths):
+    """ Pass 1: no. of papers each column occurs in, and no. of papers, for a chunk of files. """
+    _, counts = hash_papers(filepaths)
+    return np.bincount(counts.indices, minlength=N_FEATURES).astype(np.int64), counts.shape[0]
+
+def init_worker(idf, components=None):
+    worker_state['idf'] = idf
+    worker_state['components'] = components
+
+def tfidf_papers(filepaths):
+    """ Pass 2: TF-IDF vectors of a chunk of files. """
+    _, counts = hash_papers(filepaths)
+    return tfidf(counts, worker_state['idf'])
+
+def project_papers(filepaths):
+    """ Pass 3: arXiv identifiers and l2-normalized SVD vectors (float32) of a chunk of files. """
+    arxiv_identifiers, counts = hash_papers(filepaths)
+    vectors = tfidf(counts, worker_state['idf']).dot(worker_state['components'].T)
+    return arxiv_identifiers, normalize(vectors).astype(np.float32)
+
+def chunks(filepaths, chunk_size=CHUNK_SIZE):
+    return [filepaths[i: i + chunk_size] for i in range(0, len(filepaths), chunk_size)]
+
+def build_index(folder=SOURCE_FOLDER, prefix=INDEX_PREFIX, workers=None, n_components=N_COMPONENTS,
+                sample_size=SVD_SAMPLE_SIZE):
+    """ Runs the 3 passes and saves the index. """
+    filepaths = sorted(glob(os.path.join(folder, '*.txt')))
+    print("{} papers found".format(len(filepaths)))
+    start_time = time()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        frequencies = np.zeros(N_FEATURES, dtype=np.int64)
+        num_papers = 0
+        for chunk_frequencies, chunk_papers in executor.map(document_frequencies, chunks(filepaths)):
+            frequencies += chunk_frequencies
+            num_papers += chunk_papers
+    # Smoothed IDF (like TfidfTransformer)
+    idf = (np.log((1 + num_papers) / (1 + frequencies)) + 1).astype(np.float32)
+    print("Pass 1 (document frequencies of {} papers) done in {:.1f} seconds".format(num_papers, time() - start_time))
+
+    start_time = time()
+    sample = sorted(random.Random(13).sample(filepaths, min(sample_size, len(filepaths))))
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                                initargs=(idf,)) as executor:
+        sample_tfidf = sp.vstack(list(executor.map(tfidf_papers, chunks(sample)))).tocsr()
+    svd = TruncatedSVD(n_components=n_components, algorithm='randomized', random_state=13)
+    svd.fit(sample_tfidf)
+    del sample_tfidf
+    print("Pass 2 (SVD on {} papers, explained variance {:.2f}) done in {:.1f} seconds".format(
+        len(sample), svd.explained_variance_ratio_.sum(), time() - start_time))
+
+    start_time = time()
+    arxiv_identifiers = []
+    vectors = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                                initargs=(idf, svd.components_.astype(np.float32))) as executor:
+        for chunk_identifiers, chunk_vectors in executor.map(project_papers, chunks(filepaths)):
+            arxiv_identifiers.extend(chunk_identifiers)
+            vectors.append(chunk_vectors)
+    save_index(prefix, np.vstack(vectors), arxiv_identifiers)
+    print("Pass 3 (projection) done in {:.1f} seconds, index saved to {}.*.npy".format(time() - start_time, prefix))
+
+def measure_latency(prefix=INDEX_PREFIX, num_queries=100, k=10):
+    """ Prints the mean and max. latency of most_similar for random papers of the saved index. """
+    index = SimilarPapersIndex.load(prefix)
+    arxiv_identifiers = random.Random(13).sample(list(index.arxiv_identifiers), min(num_queries, len(index.arxiv_identifiers)))
+    latencies = []
+    for arxiv_identifier in arxiv_identifiers:
+        start_time = time()
+        index.most_similar(arxiv_identifier, k)
+        latencies.append(time() - start_time)
+    print("most_similar over {} papers: mean {:.1f} ms, max {:.1f} ms".format(
+        len(index.arxiv_identifiers), 1000 * np.mean(latencies), 1000 * np.max(latencies)))
+
+def main():
+    parser = argparse.ArgumentParser(description='Builds the similar papers index from the papers_plus source files.')
+    parser.add_argument('--folder', default=SOURCE_FOLDER, help='folder with 1 text file per paper')
+    parser.add_argument('--prefix', default=INDEX_PREFIX, help='prefix of the index files')
+    parser.add_argument('--workers', type=int, default=None, help='no. of processes (default: no. of CPUs)')
+    parser.add_argument('--components', type=int, default=N_COMPONENTS, help='no. of SVD dimensions')
+    parser.add_argument('--sample', type=int, default=SVD_SAMPLE_SIZE, help='no. of papers the SVD is fitted on')
+    args = parser.parse_args()
+    build_index(args.folder, args.prefix, args.workers, args.components, args.sample)
+    measure_latency(args.prefix)
+
+if __name__ == '__main__':
+    main()
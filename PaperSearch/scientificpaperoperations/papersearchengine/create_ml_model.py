@@ -1,22 +1,45 @@
+import argparse
+import concurrent.futures
+import os
+import tempfile
+import zlib
+from time import perf_counter
 from sklearn.externals import joblib
 import pandas as pd
 import numpy as np
 from nltk.corpus import stopwords
 
 from sklearn.pipeline import Pipeline
-from sklearn.feature_extraction.text import TfidfTransformer, TfidfVectorizer, CountVectorizer
-from sklearn.model_selection import train_test_split
+from sklearn.feature_extraction.text import TfidfTransformer, TfidfVectorizer, CountVectorizer, HashingVectorizer
+from sklearn.model_selection import train_test_split, ParameterGrid
 from sklearn.linear_model import SGDClassifier
 from sklearn.svm import LinearSVC
 from sklearn.metrics import f1_score, precision_recall_curve, precision_score
 from sklearn.metrics import recall_score, accuracy_score, classification_report, confusion_matrix
-from sklearn.externals import joblib
+from sentiment_scorer import LinearTextScorer, save_artifact, ARTIFACT_FILENAME
 
+CORPUS_FILENAME = 'citation_sentiment_corpus.txt'
+# No. of lines of the corpus which are read (and hashed) at a time by the streaming trainer
+BATCH_SIZE = 1000
+# 1 in TEST_FOLDS sentences goes to the test set in the streaming trainer
+TEST_FOLDS = 5
+# No. of passes over the training batches made by the streaming trainer (SGDClassifier.partial_fit)
+STREAMING_EPOCHS = 10
+# Hyperparameters tried by the sweep (HashingVectorizer + TF-IDF + SGD)
+HASHING_PARAM_GRID = {'n_features': [2**16, 2**18, 2**20],
+                      'ngram_range': [(1, 2), (1, 3)],
+                      'remove_stopwords': [True, False],
+                      'alpha': [1e-4, 1e-5]}
+# Models whose macro F1 is within this distance of the best one count as equally good; the
+# fastest of them (predict throughput) is picked.
+F1_TOLERANCE = 0.01
+# No. of times the model is loaded/the test set is predicted when measuring load time and throughput
+TIMING_REPEATS = 3
 
 def read_corpus_create_X_and_y():
     """ Reads the corpus supplied by Athar, produce and return a dataframe called X which has sentences from the corpus, and a Series y
     which has the sentiments (labels)."""
-    filename = 'citation_sentiment_corpus.txt'
+    filename = CORPUS_FILENAME
     df = pd.read_csv(filename, sep="\t", skiprows=18, names=['col1', 'col2', 'sentiment', 'sentence'], usecols=['sentiment', 'sentence'])
     #print(df.head())
 
@@ -76,15 +99,208 @@ def calculate_holdoutset_metrics(y_train, y_test, y_pred, text_pipeline):
     print(classification_report(y_test, y_pred, target_names=['negative', 'neutral', 'positive'] ))
     print("Confusion matrix: ", confusion_matrix(y_test, y_pred))
 
+def apply_hashing_pipeline(n_features=2**18, ngram_range=(1, 3), remove_stopwords=True, alpha=0.0001):
+    """ Same pipeline as apply_pipeline, but the features are extracted by a HashingVectorizer: n-grams are
+    hashed into n_features columns, so there is no vocabulary to build during training or to pickle. The
+    vectorizer doesn't normalize (norm=None) and doesn't alternate signs, so that the TfidfTransformer gets
+    plain counts like it does after the CountVectorizer. """
+    stop_words = stopwords.words('english') if remove_stopwords else None
+    text_pipeline = Pipeline([('vect', HashingVectorizer(n_features=n_features, ngram_range=ngram_range, stop_words=stop_words,
+                                                         alternate_sign=False, norm=None)),
+                              ('tfidf', TfidfTransformer()),
+                              ('clf', SGDClassifier(alpha=alpha, loss='hinge', max_iter=1000))
+                              ])
+    return text_pipeline
+
+def stream_corpus(filename=CORPUS_FILENAME, batch_size=BATCH_SIZE):
+    """ Reads the corpus batch_size lines at a time, and yields (sentences, labels) Series for each batch. """
+    reader = pd.read_csv(filename, sep="\t", skiprows=18, names=['col1', 'col2', 'sentiment', 'sentence'],
+                         usecols=['sentiment', 'sentence'], chunksize=batch_size)
+    for batch in reader:
+        yield batch.sentence, batch.sentiment
+
+def is_test_sentence(sentence):
+    """ Deterministic train/test split for the streaming trainer: the same sentence always goes to the
+    same set, whatever the batch size and the order in which the batches arrive. """
+    return zlib.crc32(sentence.encode('utf-8')) % TEST_FOLDS == 0
+
+def document_frequencies_streaming(vectorizer, filename=CORPUS_FILENAME, batch_size=BATCH_SIZE):
+    """ First pass of the streaming trainer: streams the corpus through the (stateless) vectorizer one batch at a
+    time, and counts the no. of training sentences in which each column occurs. Only the counts are kept, not the
+    hashed matrices. Returns the document frequencies, the no. of training sentences, the labels (classes) and the
+    test sentences and labels (kept as text, because they are used to measure the throughput of the whole
+    pipeline). """
+    document_frequencies = np.zeros(vectorizer.n_features, dtype=np.int64)
+    num_train_sentences = 0
+    classes = set()
+    test_sentences, test_labels = [], []
+    for sentences, labels in stream_corpus(filename, batch_size):
+        test_mask = sentences.apply(is_test_sentence).values
+        X_batch = vectorizer.transform(sentences[~test_mask])
+        # The hashed matrix has 1 entry per (sentence, column), like TfidfTransformer counts them
+        document_frequencies += np.bincount(X_batch.indices, minlength=vectorizer.n_features)
+        num_train_sentences += X_batch.shape[0]
+        classes.update(labels[~test_mask])
+        test_sentences.extend(sentences[test_mask])
+        test_labels.extend(labels[test_mask])
+    return document_frequencies, num_train_sentences, np.array(sorted(classes)), test_sentences, pd.Series(test_labels)
+
+def set_idf(tfidf, document_frequencies, num_sentences):
+    """ Sets the idf weights of a TfidfTransformer from document frequencies counted over num_sentences
+    sentences, with the same formula as TfidfTransformer.fit. """
+    smooth = int(tfidf.smooth_idf)
+    tfidf.idf_ = np.log((num_sentences + smooth) / (document_frequencies + smooth)) + 1
+    tfidf.n_features_in_ = len(document_frequencies)
+
+def fit_hashing_pipeline(text_pipeline, filename=CORPUS_FILENAME, batch_size=BATCH_SIZE, epochs=STREAMING_EPOCHS):
+    """ Fits a pipeline created by apply_hashing_pipeline on the corpus streamed in batches, so that the memory
+    used doesn't grow with the corpus. The vectorizer needs no fitting. The idf weights of the TF-IDF transformer
+    are computed from the document frequencies of a first pass, then the classifier is trained with partial_fit
+    on the TF-IDF weighted batches, in epochs passes over the corpus. Returns the fitted pipeline and the test
+    sentences and labels. """
+    vect, tfidf, clf = [step for _, step in text_pipeline.steps]
+    document_frequencies, num_train_sentences, classes, test_sentences, y_test = \
+        document_frequencies_streaming(vect, filename, batch_size)
+    set_idf(tfidf, document_frequencies, num_train_sentences)
+    for _ in range(epochs):
+        for sentences, labels in stream_corpus(filename, batch_size):
+            train_mask = ~sentences.apply(is_test_sentence).values
+            if train_mask.any():
+                clf.partial_fit(tfidf.transform(vect.transform(sentences[train_mask])), labels[train_mask],
+                                classes=classes)
+    return text_pipeline, test_sentences, y_test
+
+def measure_serving_costs(text_pipeline, test_sentences):
+    """ Measures what matters for serving the model in the Django workers: the size of the joblib file
+    (MB), the time to load it (seconds, best of TIMING_REPEATS), and the batch prediction throughput on
+    the test sentences (sentences/second, best of TIMING_REPEATS). """
+    handle, filename = tempfile.mkstemp(suffix='.joblib')
+    os.close(handle)
+    try:
+        joblib.dump(text_pipeline, filename)
+        size = os.path.getsize(filename) / 2**20
+        load_times = []
+        for _ in range(TIMING_REPEATS):
+            start = perf_counter()
+            joblib.load(filename)
+            load_times.append(perf_counter() - start)
+    finally:
+        os.remove(filename)
+    predict_times = []
+    for _ in range(TIMING_REPEATS):
+        start = perf_counter()
+        text_pipeline.predict(test_sentences)
+        predict_times.append(perf_counter() - start)
+    return {'size_mb': size, 'load_seconds': min(load_times), 'sentences_per_second': len(test_sentences) / min(predict_times)}
+
+def evaluate_configuration(params):
+    """ Trains a hashing pipeline with the hyperparameters in params (a dict with the keyword arguments of
+    apply_hashing_pipeline) and returns params with the macro F1 on the test set and the serving costs.
+    This runs in a separate process for each configuration of the sweep. """
+    text_pipeline, test_sentences, y_test = fit_hashing_pipeline(apply_hashing_pipeline(**params))
+    y_pred = text_pipeline.predict(test_sentences)
+    result = dict(params)
+    result['f1_macro'] = f1_score(y_test, y_pred, average='macro')
+    result.update(measure_serving_costs(text_pipeline, test_sentences))
+    return result
+
+def hyperparameter_sweep(param_grid=HASHING_PARAM_GRID, workers=None):
+    """ Evaluates all the configurations in param_grid in parallel (1 process per configuration, at most
+    workers processes at a time) and returns the results sorted by macro F1 (best first). """
+    configurations = list(ParameterGrid(param_grid))
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(evaluate_configuration, configurations))
+    return sorted(results, key=lambda result: result['f1_macro'], reverse=True)
+
+def pick_fastest_model(results, tolerance=F1_TOLERANCE):
+    """ Picks the configuration with the highest predict throughput among those whose macro F1 is within
+    tolerance of the best one. """
+    best_f1 = max(result['f1_macro'] for result in results)
+    candidates = [result for result in results if result['f1_macro'] >= best_f1 - tolerance]
+    return max(candidates, key=lambda result: result['sentences_per_second'])
+
+def print_sweep_results(results, chosen):
+    """ Prints 1 line per configuration with its F1 and serving costs; the chosen one is marked with a *. """
+    print("  {:>10} {:>8} {:>9} {:>8} {:>8} {:>9} {:>9} {:>12}".format('n_features', 'ngrams', 'stopwords', 'alpha',
+                                                                       'F1', 'size(MB)', 'load(s)', 'sentences/s'))
+    for result in results:
+        print("{} {:>10} {:>8} {:>9} {:>8} {:>8.4f} {:>9.2f} {:>9.3f} {:>12.0f}".format(
+            '*' if result is chosen else ' ', result['n_features'], '{}-{}'.format(*result['ngram_range']),
+            str(result['remove_stopwords']), result['alpha'], result['f1_macro'], result['size_mb'],
+            result['load_seconds'], result['sentences_per_second']))
+
+def export_inference_artifact(text_pipeline, filename=ARTIFACT_FILENAME):
+    """ Compiles a fitted pipeline (CountVectorizer or HashingVectorizer, TfidfTransformer, linear classifier)
+    into the NumPy artifact read by sentiment_scorer.LinearTextScorer. A CountVectorizer's vocabulary gives the
+    known n-grams, and only their columns are kept. A HashingVectorizer has no vocabulary: the scorer hashes every
+    n-gram like the vectorizer, and save_artifact keeps the weights of the columns seen at training time (the others
+    share the highest idf weight and have no coefficients), so its predictions are the same as the pipeline's. """
+    vect, tfidf, clf = [step for _, step in text_pipeline.steps]
+    if vect.analyzer != 'word' or vect.preprocessor is not None or vect.tokenizer is not None or vect.strip_accents is not None:
+        raise ValueError("Only the default word analyzer can be compiled into the NumPy scorer.")
+    if tfidf.norm != 'l2' or not tfidf.use_idf:
+        raise ValueError("Only l2-normalized TF-IDF can be compiled into the NumPy scorer.")
+    stop_words = vect.get_stop_words() or []
+    if isinstance(vect, HashingVectorizer):
+        if vect.norm is not None or vect.binary:
+            raise ValueError("The HashingVectorizer must produce plain counts (norm=None, binary=False).")
+        save_artifact(filename, [], [], tfidf.idf_, clf.coef_.T, clf.intercept_, clf.classes_, stop_words,
+                      vect.ngram_range, vect.token_pattern, vect.lowercase, tfidf.sublinear_tf,
+                      n_features=vect.n_features, alternate_sign=vect.alternate_sign)
+        return filename
+    terms = list(vect.vocabulary_)
+    # Renumber the used columns 0..n-1, so that idf and coef only have rows for them
+    used_columns, term_columns = np.unique([vect.vocabulary_[term] for term in terms], return_inverse=True)
+    save_artifact(filename, terms, term_columns, tfidf.idf_[used_columns], clf.coef_[:, used_columns].T,
+                  clf.intercept_, clf.classes_, stop_words, vect.ngram_range, vect.token_pattern, vect.lowercase,
+                  tfidf.sublinear_tf)
+    return filename
+
+def compare_scorer_with_pipeline(text_pipeline, filename, test_sentences):
+    """ Loads the exported artifact and prints the share of test sentences for which it predicts the same label
+    as the pipeline, and the batch prediction throughput (sentences/second) of both. """
+    scorer = LinearTextScorer.load(filename)
+    throughputs = {}
+    predictions = {}
+    for name, model in (('pipeline', text_pipeline), ('scorer', scorer)):
+        start = perf_counter()
+        predictions[name] = model.predict(test_sentences)
+        throughputs[name] = len(test_sentences) / (perf_counter() - start)
+    agreement = np.mean(np.asarray(predictions['pipeline']) == np.asarray(predictions['scorer']))
+    print("Exported {} ({:.2f} MB): same prediction as the pipeline for {:.2%} of the test sentences. Throughput: pipeline {:.0f}, "
+          "scorer {:.0f} sentences/s".format(filename, os.path.getsize(filename) / 2**20, agreement, throughputs['pipeline'],
+                                             throughputs['scorer']))
+
 def main():
-    """ Main function to train and test the model, and finally pickle it"""
+    """ Main function to train and test the model, and finally pickle it. With --sweep, the hyperparameters
+    of the hashing pipeline are searched in parallel, and the fastest model with the best F1 (within
+    F1_TOLERANCE) is trained and pickled instead. In both cases, the model is also exported as a NumPy artifact
+    (ARTIFACT_FILENAME) which the Django workers use without sklearn. """
+    parser = argparse.ArgumentParser(description='Trains the citation sentiment model.')
+    parser.add_argument('--sweep', action='store_true', help='run the hyperparameter sweep of the hashing pipeline')
+    parser.add_argument('--workers', type=int, default=None, help='no. of processes used by the sweep (default: no. of CPUs)')
+    args = parser.parse_args()
+    if args.sweep:
+        results = hyperparameter_sweep(workers=args.workers)
+        chosen = pick_fastest_model(results)
+        print_sweep_results(results, chosen)
+        params = {key: chosen[key] for key in HASHING_PARAM_GRID}
+        text_pipeline, test_sentences, _ = fit_hashing_pipeline(apply_hashing_pipeline(**params))
+        joblib.dump(text_pipeline, 'citation_model_pipeline.joblib')
+        export_inference_artifact(text_pipeline)
+        compare_scorer_with_pipeline(text_pipeline, ARTIFACT_FILENAME, test_sentences)
+        return
     X, y = read_corpus_create_X_and_y()
     X_train, X_test, y_train, y_test = create_train_test(X, y)
     #print(X_train.shape, X_test.shape, y_train.shape, y_test.shape)
     y_pred, text_pipeline = train_and_test(X_train, y_train, X_test)
     calculate_holdoutset_metrics(y_train, y_test, y_pred, text_pipeline)
+    # Serving costs of the vocabulary-based model, to compare with the sweep
+    print("Serving costs: ", measure_serving_costs(text_pipeline, list(X_test.sentence)))
     # Pickle the model using joblib
     joblib.dump(text_pipeline, 'citation_model_pipeline.joblib')
+    export_inference_artifact(text_pipeline)
+    compare_scorer_with_pipeline(text_pipeline, ARTIFACT_FILENAME, list(X_test.sentence))
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
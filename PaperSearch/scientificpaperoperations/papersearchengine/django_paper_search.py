@@ -9,14 +9,24 @@
     #-------------------------------------------------------------------------------
 
 import requests
+from requests.adapters import HTTPAdapter
 import copy
 import sys
 from collections import OrderedDict
+import concurrent.futures
 import datetime
 import pandas as pd
 from sklearn.externals import joblib
 import emoji
 
+# Max. no. of Solr lookups which are in flight at the same time when search_references fans out
+# over the unique annotations and the arxiv identifiers of their hits.
+MAX_SOLR_WORKERS = 16
+# A single pooled session is shared by all the threads, so that connections to Solr are kept
+# alive and reused instead of being opened again for every lookup.
+solr_session = requests.Session()
+solr_session.mount('http://', HTTPAdapter(pool_connections=4, pool_maxsize=MAX_SOLR_WORKERS))
+
 def search_sentences(query, num_rows):
     """ Takes user's query as input, finds all sentences with the given
     phrase, then finds the title, authors and url of the paper from the
@@ -38,37 +48,82 @@ def search_sentences(query, num_rows):
                                 'arxiv_metadata', 'arxiv_identifier', 'exact')
         res_dblp, _, _ = search_solr(arxiv_identifier, 1,
                                 'metadata', 'arxiv_identifier', 'exact')
-        if res_arxiv == []:
-            # Not found in arxiv_metadata
-            if res_dblp == []:
-                # Not found in metadata index too
-                # title, authors, arxiv url, published date, dblp url
-                result.extend(['No title found for this result', 'No author metadata found for this result', 
-                    'No Arxiv URL found for this result', 'No published date found for this result', None])
-            else:
-                # found in metadata index
-                dblp_url = res_dblp[0][2] if res_dblp[0][2] != '' and res_dblp[0][2] is not None else None
-                title = res_dblp[0][0] if res_dblp[0][0] != '' and res_dblp[0][0] is not None else 'No title found for this result'
-                authors = '; '.join(res_dblp[0][1]) if res_dblp[0][1] != [] and res_dblp[0][1] is not None else 'No author metadata found for this result'
+        add_metadata_to_sentence(result, res_arxiv, res_dblp)
+    results.sort(key=lambda x: x[5][0], reverse=True)
+    return results, query, num_rows, num_results
+
+def add_metadata_to_sentence(result, res_arxiv, res_dblp):
+    """ Extends one result of the papers index (sentence, arxiv identifier) with the title, authors,
+    arxiv url, published date and dblp url found in the arxiv_metadata (res_arxiv) and metadata
+    (res_dblp) indices for its arxiv identifier. Missing values are replaced by the error messages
+    which are displayed in the results page."""
+    if res_arxiv == []:
+        # Not found in arxiv_metadata
+        if res_dblp == []:
+            # Not found in metadata index too
+            # title, authors, arxiv url, published date, dblp url
+            result.extend(['No title found for this result', 'No author metadata found for this result', 
+                'No Arxiv URL found for this result', 'No published date found for this result', None])
+        else:
+            # found in metadata index
+            dblp_url = res_dblp[0][2] if res_dblp[0][2] != '' and res_dblp[0][2] is not None else None
+            title = res_dblp[0][0] if res_dblp[0][0] != '' and res_dblp[0][0] is not None else 'No title found for this result'
+            authors = '; '.join(res_dblp[0][1]) if res_dblp[0][1] != [] and res_dblp[0][1] is not None else 'No author metadata found for this result'
 
-                result.extend([title, authors, 'No arXiV URL found for this result', 'No published date found for this result', dblp_url])
+            result.extend([title, authors, 'No arXiV URL found for this result', 'No published date found for this result', dblp_url])
 
+    else:
+        # res contains title, authors, url, arxiv_identifier, published_date (from arxiv_metadata) 
+        # Note: authors and published_date are lists.
+        title, authors, arxiv_url, arxiv_identifier, published_date = res_arxiv[0]
+        # Normalize the fields except published_date, which is normalized later in Django views (as it should be sorted before normalizing)
+        title = title if title != '' and title is not None else 'No title found for this result'
+        authors = '; '.join(authors) if authors != [] and authors is not None else 'No author metadata found for this result'
+        arxiv_url = arxiv_url if arxiv_url is not None and arxiv_url != '' else 'No arXiV URL found for this result'
+
+        if res_dblp == []:
+            result.extend([title, authors, arxiv_url, published_date, None])
         else:
-            # res contains title, authors, url, arxiv_identifier, published_date (from arxiv_metadata) 
-            # Note: authors and published_date are lists.
-            title, authors, arxiv_url, arxiv_identifier, published_date = res_arxiv[0]
-            # Normalize the fields except published_date, which is normalized later in Django views (as it should be sorted before normalizing)
-            title = title if title != '' and title is not None else 'No title found for this result'
-            authors = '; '.join(authors) if authors != [] and authors is not None else 'No author metadata found for this result'
-            arxiv_url = arxiv_url if arxiv_url is not None and arxiv_url != '' else 'No arXiV URL found for this result'
+            dblp_url = res_dblp[0][2] if res_dblp[0][2] != '' and res_dblp[0][2] is not None else None
+            result.extend([title, authors, arxiv_url, published_date, dblp_url])
+    return result
 
-            if res_dblp == []:
-                result.extend([title, authors, arxiv_url, published_date, None])
-            else:
-                dblp_url = res_dblp[0][2] if res_dblp[0][2] != '' and res_dblp[0][2] is not None else None
-                result.extend([title, authors, arxiv_url, published_date, dblp_url])
-    results.sort(key=lambda x: x[5][0], reverse=True)
-    return results, query, num_rows, num_results
+def search_sentences_concurrently(annotations, num_rows, executor):
+    """ Concurrent version of search_sentences for a list of annotations, used by search_references.
+    The papers index is queried for all the annotations in parallel. The arxiv identifiers of all
+    the hits are then deduplicated, so that arxiv_metadata and metadata are queried only once per
+    citing paper (in parallel as well), however many annotations/sentences point to it. The total
+    latency is therefore bounded by the slowest lookup in each of the 2 rounds instead of the sum of
+    all the lookups. Returns a dict with key: annotation, value: list of results (the same lists as
+    search_sentences, sorted by published_date), annotations which are not found are left out."""
+    # Round 1: sentences which contain each of the annotations.
+    sentence_futures = OrderedDict((annotation, executor.submit(search_solr, annotation, num_rows,
+                                                                'papers', 'sentence', 'exact'))
+                                   for annotation in annotations)
+    sentences = OrderedDict()
+    for annotation, future in sentence_futures.items():
+        results, _, _ = future.result()
+        if results != []:
+            sentences[annotation] = results
+    # Round 2: metadata of each unique citing paper (dict.fromkeys keeps the order and drops duplicates)
+    arxiv_identifiers = list(dict.fromkeys(result[1] for results in sentences.values() for result in results))
+    arxiv_futures = {arxiv_identifier: executor.submit(search_solr, arxiv_identifier, 1,
+                                                       'arxiv_metadata', 'arxiv_identifier', 'exact')
+                     for arxiv_identifier in arxiv_identifiers}
+    dblp_futures = {arxiv_identifier: executor.submit(search_solr, arxiv_identifier, 1,
+                                                      'metadata', 'arxiv_identifier', 'exact')
+                    for arxiv_identifier in arxiv_identifiers}
+    metadata = {arxiv_identifier: (arxiv_futures[arxiv_identifier].result()[0],
+                                   dblp_futures[arxiv_identifier].result()[0])
+                for arxiv_identifier in arxiv_identifiers}
+    for annotation, results in sentences.items():
+        for result in results:
+            res_arxiv, res_dblp = metadata[result[1]]
+            # The metadata lists are shared between results of the same paper: add_metadata_to_sentence
+            # only reads them, it extends result.
+            add_metadata_to_sentence(result, res_arxiv, res_dblp)
+        results.sort(key=lambda x: x[5][0], reverse=True)
+    return sentences
                           
 def search_references(query, num_rows, search_type):
     """ Takes user's query as input, finds all references with the given
@@ -106,12 +161,16 @@ def search_references(query, num_rows, search_type):
     if num_rows * 3 < num_unique_citations:
         unique_citations = unique_citations[:num_rows*3]
     final_results = []
+    # Look up all the annotations and their citing papers concurrently instead of calling
+    # search_sentences for one annotation after the other.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_SOLR_WORKERS) as executor:
+        sentences = search_sentences_concurrently([annotation for annotation, details in unique_citations],
+                                                  num_rows, executor)
     for annotation, details in unique_citations:
-        reslist = search_sentences(annotation, num_rows)
-        if reslist == []:
+        if annotation not in sentences:
             # If the annotation was not found, go to next annotation
             continue
-        res = reslist[0]
+        res = sentences[annotation]
         # Append all the intermediate fields into intermediate results. This list will later be 
         # the final_results list.
         # Append all the fields like title, sentence, arxiv url etc. from papers
@@ -290,7 +349,7 @@ def search_solr(query, num_rows, collection, search_field, query_type):
     solr_url = 'http://localhost:8983/solr/' + collection + '/select'
     query = add_query_type(query, query_type)
     url_params = {'q': query, 'rows': num_rows, 'df': search_field}
-    solr_response = requests.get(solr_url, params=url_params)
+    solr_response = solr_session.get(solr_url, params=url_params)
     if solr_response.ok:
         data = solr_response.json()
         return parse_json(data, collection)
@@ -13,114 +13,265 @@
     # Copyright:   (c) Ashwath Sampath 2018
     #-------------------------------------------------------------------------------
 
-import requests
+import os
 import copy
-import sys
+import json
 import re
 from collections import OrderedDict
 import datetime
 import pandas as pd
-from sklearn.externals import joblib
 import emoji
+from .timing import timed_stage
+from .sentiment_scorer import LinearTextScorer
+from .singleflight import single_flight
+from .admission import solr_get, SolrUnavailable
+from .similar_papers import get_similar_papers_index
+from .author_names import author_key, split_authors
 
-def search_sentences_plus(query, num_rows):
+# uniqueKey of each of the v2 indices (needed as a tie-breaker in the sort when paging with a cursor)
+UNIQUE_KEYS = {'papers_plus': 'id', 'references_plus': 'id', 'metadata_plus': 'arxiv_identifier'}
+# Citation sentiment model: the NumPy artifact exported by create_ml_model.py is used if it exists, the
+# pickled sklearn pipeline otherwise.
+SENTIMENT_SCORER_FILENAME = 'papersearchengine/citation_model_scorer.npz'
+SENTIMENT_PIPELINE_FILENAME = 'papersearchengine/citation_model_pipeline.joblib'
+# The sentiment model, loaded once per process by load_sentiment_model
+sentiment_model = {}
+# Max. no. of cited papers (citation_stats docs) whose citing papers are merged into the citing papers per year of
+# 1 query (the most cited ones). The other statistics are counted by Solr over all the matching cited papers.
+CITATION_STATS_MAX_ROWS = 10000
+CITATION_STATS_FIELDS = ['citing_papers', 'citations_per_year', 'num_positive']
+# Statistics of all the matching citation_stats docs, computed by Solr (JSON facet API). citing_papers has 1 value
+# per citing paper (arxiv_identifier|year), so its unique values are the distinct citing papers.
+CITATION_STATS_FACET = {'num_citing_sentences': 'sum(num_citing_sentences)', 'num_citing_papers': 'unique(citing_papers)',
+                        'num_positive': 'sum(num_positive)', 'num_neutral': 'sum(num_neutral)',
+                        'num_negative': 'sum(num_negative)'}
+# Format of the published dates on the results pages (the *_plus indices store them preformatted)
+DISPLAY_DATE_FORMAT = '%B %d, %Y'
+# Facets on the results pages. Publication year (a range facet on the date field) for all the collections,
+# and facets on the values of string fields (facet name: Solr field) for references_plus.
+FACET_DATE_FIELDS = {'papers_plus': 'published_date', 'metadata_plus': 'published_date',
+                     'references_plus': 'citing_published_date'}
+FACET_VALUE_FIELDS = {'references_plus': OrderedDict([('author', 'citing_author_facet'), ('sentiment', 'citing_sentiment')])}
+FACET_LIMIT = 20
+# First year of the year facet (arXiv started in 1991)
+FACET_START_YEAR = 1991
+SENTIMENT_LABELS = {'p': 'positive', 'o': 'neutral', 'n': 'negative'}
+# The facet filters of the similar papers search drop some of the nearest neighbours: this many times more
+# neighbours are asked for in each round, until enough of them pass the filters. Their identifiers go in the
+# URL of the Solr request (terms filter), so they are capped below Solr's 8 KB request header limit.
+SIMILAR_PAPERS_OVERFETCH = 3
+SIMILAR_PAPERS_MAX_CANDIDATES = 300
+
+@single_flight
+def search_sentences_plus(query, num_rows, filters=()):
     """ Takes user's query as input, finds all sentences with the given
     phrase, then finds the title, authors and url of the paper from the
     metadata_plus index which is made up of . It also gets the results and
     normalizes it so that correct errors messages are displayed, and fields
-    are displayed in the right format. """
+    are displayed in the right format. filters are the facet values selected
+    by the user (see filter_queries), the facet counts are returned at the end. """
     # each result: sentence, filename (arxiv-identifier) and title
-    results_df, query, num_results = search_solr(query, num_rows * 10,
+    results_df, query, num_results, facets = search_solr(query, num_rows * 10,
                                              'papers_plus', 'sentence', 'exact', 
-                                             'published_date desc', None)
+                                             'published_date desc', filter_queries(filters, 'papers_plus'),
+                                             with_facets=True)
     if len(results_df) == 0:
         return []
     # Change the date format of the published_date column to match what we want in the output.
     results_df = change_date_format(results_df, 'published_date')
     results = results_df.values.tolist()
     results = results[:num_rows]
-    return results, num_results, num_rows, query
+    return results, num_results, num_rows, query, facets
                           
-def search_references_plus(query, num_rows, search_type):
+@single_flight
+def search_references_plus(query, num_rows, search_type, filters=()):
     """ Takes user's query as input, finds all references with the given
     author name/title, gets the local citation url and finds sentences in
-    which the citations occurred. """
+    which the citations occurred. filters are the facet values selected by
+    the user (see filter_queries), the facet counts are returned at the end. """
     # If search_type = title, we do an exact search. If search_type = authors, we do 
     # a proximity search with proximity = len(query) + 3 (as there are ands in the author
     # names, and search may be by last name of one author, full name of other author and so on.
     
     # NOTE: results is now a dataframe in v2.
     if search_type == 'title':
-        # Return all rows to count no. of citations.
-        results_df, query, num_results = search_solr(query, num_rows*10,
+        # 10 times num_rows sentences, as sentences from the same citing paper are grouped (exact counts: citation_stats)
+        results_df, query, num_results, facets = search_solr(query, num_rows*10,
                                              'references_plus', 'cited_paper_details',
-                                             'proximity_title', 'citing_published_date desc', None)
+                                             'proximity_title', 'citing_published_date desc',
+                                             filter_queries(filters, 'references_plus'), with_facets=True)
     
     if search_type == 'authors':
-        # Return all rows to count no. of citations.
-        results_df, query, num_results = search_solr(query, num_rows*10,
-                                                 'references_plus', 'cited_paper_details',
-                                                 'proximity_authors', 'citing_published_date desc', None)
+        # Exact lookups of the normalized author keys (1 filter query per author separated by semicolons),
+        # which Solr serves from the filter cache. 10 times num_rows sentences, as sentences from the same citing
+        # paper are grouped (exact counts: citation_stats)
+        key_queries = cited_author_filter_queries(query)
+        results_df = []
+        if key_queries != []:
+            results_df, _, num_results, facets = search_solr('*:*', num_rows*10, 'references_plus', 'cited_paper_details',
+                                                     None, 'citing_published_date desc',
+                                                     key_queries + filter_queries(filters, 'references_plus', []),
+                                                     with_facets=True)
+        if len(results_df) != 0:
+            # The views display the query up to its last double quote
+            query = '"{}"'.format(query)
+        else:
+            # Authors written in a format the keys don't cover: proximity search on cited_paper_details
+            results_df, query, num_results, facets = search_solr(query, num_rows*10,
+                                                     'references_plus', 'cited_paper_details',
+                                                     'proximity_authors', 'citing_published_date desc',
+                                                     filter_queries(filters, 'references_plus'), with_facets=True)
     if len(results_df) == 0:
         return []
+    # Use the display dates for the citing_published_date column (before grouping, which only keeps the displayed columns)
+    results_df = change_date_format(results_df, 'citing_published_date')
     # results_df is a df
     # Get sentiment and add it to the end of the citing_sentence column: no separate column
     results_df = get_sentiment_from_model(results_df)
     # Group sentences from the same citing paper together
-    grouped_results_df = group_sentences_together(results_df)
+    with timed_stage('grouping'):
+        grouped_results_df = group_sentences_together(results_df)
     # This is  not the real numresults, it is just sent to the template to prove that numrows 
     # is greater/less than/equal to numresults
     num_results = len(grouped_results_df)
     # Get num_rows rows out of grouped_results_df
     grouped_results_df = grouped_results_df.head(num_rows)
-    # Change the date format of the citing_published_date column to match what we want in the output.
-    grouped_results_df = change_date_format(grouped_results_df, 'citing_published_date')
     # Add offsets of the location of the annotation in the sentence: append to the list citing_sentence to create a list of lists
     # with offsets included for each sentence (offsets for annotation's location in the sentence)
-    # Input [sentence1, sentece2,]
-    grouped_results_df['citing_sentence'] = grouped_results_df[['annotation', 'citing_sentence']].apply(addoffsets_citation, axis=1)
-    results_list = grouped_results_df.values.tolist()
-    return (results_list, num_results, num_rows, query)
+    # Input [sentence1, sentece2,]. The offsets are precomputed at index time, the offset columns are dropped afterwards.
+    with timed_stage('offsets'):
+        grouped_results_df['citing_sentence'] = grouped_results_df[['annotation', 'citing_sentence', 'annotation_start',
+                                                                    'annotation_end']].apply(addoffsets_citation, axis=1)
+        grouped_results_df = grouped_results_df.drop(['annotation_start', 'annotation_end'], axis=1)
+        results_list = grouped_results_df.values.tolist()
+    return (results_list, num_results, num_rows, query, facets)
+
+def search_citation_stats_solr(query, query_type, filter_query=None):
+    """ Searches the citation_stats index (1 doc per cited paper, built from references_plus at index time) on
+    cited_paper_details, and returns the first CITATION_STATS_MAX_ROWS docs (the most cited papers first), the no.
+    of docs which match and the statistics of all of them (CITATION_STATS_FACET). Unlike search_solr, None is
+    returned if Solr returns an error or is overloaded (e.g. citation_stats hasn't been built yet): the statistics
+    are optional on the results pages. """
+    solr_url = 'http://localhost:8983/solr/citation_stats/select'
+    url_params = {'q': add_query_type(query, query_type), 'rows': CITATION_STATS_MAX_ROWS, 'df': 'cited_paper_details',
+                  'fl': ','.join(CITATION_STATS_FIELDS), 'sort': 'num_citing_papers desc',
+                  'json.facet': json.dumps(CITATION_STATS_FACET)}
+    if filter_query is not None:
+        url_params['fq'] = filter_query
+    try:
+        solr_response = solr_get('citation_stats', solr_url, url_params)
+    except SolrUnavailable:
+        return None
+    with timed_stage('json_parsing'):
+        data = solr_response.json()
+    return data['response']['docs'], data['response']['numFound'], data.get('facets', {})
+
+@single_flight
+def search_citation_stats(query, search_type):
+    """ Returns the citation statistics of the cited papers which match query (search_type 'title' or 'authors',
+    matched like in search_references_plus), precomputed in citation_stats: no. of cited papers which match, no. of
+    citing sentences, no. of distinct citing papers, list of (year, no. of citing papers), and the no. of citing
+    sentences with each predicted sentiment (None if the index has no sentiment). Returns None if nothing matches.
+    The counts are computed by Solr over all the matching cited papers, so that a paper which cites several of them
+    is counted once. The citing papers per year are merged from the stored citing papers of the
+    CITATION_STATS_MAX_ROWS most cited ones: if more cited papers match, num_year_cited_papers (the no. of cited
+    papers they are counted over) is less than num_cited_papers. The statistics are over all the citing sentences:
+    the facet filters of the results page don't apply to them. """
+    if search_type == 'title':
+        response = search_citation_stats_solr(query, 'proximity_title')
+    else:
+        key_queries = cited_author_filter_queries(query)
+        response = search_citation_stats_solr('*:*', None, key_queries) if key_queries != [] else None
+        if key_queries == [] or (response is not None and response[1] == 0):
+            response = search_citation_stats_solr(query, 'proximity_authors')
+    if response is None or response[1] == 0:
+        return None
+    docs, num_found, facets = response
+    # Solr returns the sums as floats
+    stats = {'num_cited_papers': num_found,
+             'num_citing_sentences': int(facets.get('num_citing_sentences', 0)),
+             'num_citing_papers': int(facets.get('num_citing_papers', 0)),
+             'num_year_cited_papers': len(docs)}
+    if len(docs) == 1:
+        years = [year_count.split(':') for year_count in docs[0].get('citations_per_year', [])]
+        stats['citations_per_year'] = [(year, int(count)) for year, count in years]
+    else:
+        # citing_papers: arxiv_identifier|year
+        citing_papers = dict(citing_paper.split('|') for doc in docs for citing_paper in doc.get('citing_papers', []))
+        papers_per_year = {}
+        for year in citing_papers.values():
+            papers_per_year[year] = papers_per_year.get(year, 0) + 1
+        stats['citations_per_year'] = sorted(papers_per_year.items())
+    if 'num_positive' in docs[0]:
+        stats['sentiment'] = {sentiment: int(facets.get('num_' + sentiment, 0))
+                              for sentiment in ('positive', 'neutral', 'negative')}
+    else:
+        stats['sentiment'] = None
+    return stats
 
 def change_date_format(df, column_name):
-    """ Converts a column column_name to the format %B %d, %Y from the current format %Y-%m-%d+Timestamp (Solr format) """
-    df[column_name] = pd.to_datetime(df[column_name])
-    df[column_name] = df[column_name].dt.strftime('%B %d, %Y')
-    #print(df[column_name])
+    """ Replaces the dates in column column_name (%Y-%m-%d+Timestamp, Solr format) by the dates in the format
+    %B %d, %Y. The *_plus indexers store these preformatted in column_name + '_display' (see date_formats.py in
+    Solr/Indexing), which is moved into column_name as it is: no dates are parsed per request. Only docs indexed
+    before the display field existed are converted here. """
+    display_column = column_name + '_display'
+    with timed_stage('dates'):
+        if display_column not in df.columns:
+            df[display_column] = None
+        missing = df[display_column].isnull()
+        if missing.any():
+            df.loc[missing, display_column] = pd.to_datetime(df.loc[missing, column_name]).dt.strftime(DISPLAY_DATE_FORMAT)
+        # The display column is dropped: the columns stay in the order the templates unpack them
+        df[column_name] = df[display_column]
+        df = df.drop(display_column, axis=1)
     return df
 
 def addoffsets_citation(row):
     """ Adds offsets for the start and end of the annotation in the each sentence of sentence_list. 
-    row is a row of the dataframe with columns 'citing_sentence' and 'annotation' """
+    row is a row of the dataframe with columns 'annotation', 'citing_sentence', 'annotation_start' and 'annotation_end',
+    where the last 3 are lists (one value per sentence). The offsets are stored in references_plus at index time, so
+    the sentence only has to be sliced. For docs indexed without offsets (-1), the annotation is located with a literal
+    search (not a regex: annotations can contain regex metacharacters). If it is not found, nothing is highlighted."""
     # Foll. list will be of the form [[sentence1, annotation_index, before_annotation_index, after_annotation_index], [sentence2,...],...]]
-    sentence_list = row.iloc[1]#row.citings_sentence
     annotation = row.iloc[0]#row.annotation
     sentence_with_annotations = []
-    for sentence in sentence_list:
-        # sublist will contain 1 sentence, and three sets of indices 
-        sublist = []
-        match = re.search(annotation, sentence)
-        sublist.append(sentence)
+    for sentence, start, end in zip(row.iloc[1], row.iloc[2], row.iloc[3]):
+        if start < 0:
+            start = sentence.find(annotation)
+            end = start + len(annotation) if start != -1 else 0
+            start = max(start, 0)
         # Find indices of annotation in sentence (separated by :), indices of the sentence before the annotation and
         # indices of the sentence after the annotation, both also separated by a colon.
         # This is used in the template, where {{sentence|slice:annotation_indices}} is used to get the part to highlight the annotation. 
-        sublist.extend(["{}:{}".format(match.start(), match.end()), "{}:{}".format(0, match.start()), "{}:".format(match.end())])
-        sentence_with_annotations.append(sublist)
+        sentence_with_annotations.append([sentence, "{}:{}".format(start, end), "{}:{}".format(0, start), "{}:".format(end)])
     return sentence_with_annotations
 
+def load_sentiment_model():
+    """ Returns the sentiment model (anything with a predict method), loading it the first time it is needed.
+    sklearn is only imported if there is no NumPy artifact. """
+    if 'model' not in sentiment_model:
+        if os.path.exists(SENTIMENT_SCORER_FILENAME):
+            sentiment_model['model'] = LinearTextScorer.load(SENTIMENT_SCORER_FILENAME)
+        else:
+            from sklearn.externals import joblib
+            sentiment_model['model'] = joblib.load(SENTIMENT_PIPELINE_FILENAME)
+    return sentiment_model['model']
+
 def get_sentiment_from_model(df):
     """ Takes a list of lists of results, converts it into a df, and gets the citation polarity from a machine learning
     (SGDClassifier) model learned previously. This is appended at the end of the sentence and the results are converted
     back to the orig form and returned."""
     # Convert the list of lists into a dataframe, replace missing values (Nones are converted into NaNs when a dataframe is created)
-    text_pipeline = joblib.load('papersearchengine/citation_model_pipeline.joblib')
+    with timed_stage('model_load'):
+        text_pipeline = load_sentiment_model()
     # Read the pipeline from the pickle (joblib)
     #text_pipeline = joblib.load('papersearchengine/citation_model_pipeline_v2.joblib')
     # Preprocess: add polar word (neg + pos) counts
     #positive_polarity_words, negative_polarity_words = read_polar_phrases()
     #df[['processed', 'num_negative_words', 'num_positive_words']] = processing(df.sentence, positive_polarity_words, negative_polarity_words)
     #df['sentiment'] = text_pipeline.predict(df[['sentence', 'processed', 'num_negative_words', 'num_positive_words']])
-    df['sentiment'] = text_pipeline.predict(df.citing_sentence)
+    with timed_stage('sentiment'):
+        df['sentiment'] = text_pipeline.predict(df.citing_sentence)
     # Map sentiment symbol to the actual sentiment
     # Map sentiment symbol to the actual sentiment
     #sentiment_mapping = {'o': emoji.emojize(' (:first_quarter_moon:)', use_aliases=True), 
@@ -142,16 +293,24 @@ def group_sentences_together(df):
     # Drop duplicate rows based on citing_arxiv identifier, citing_sentence and annotation
     dropbasedoncols = ['citing_arxiv_identifier', 'citing_sentence', 'annotation']
     df = df.drop_duplicates(subset=dropbasedoncols)
+    # Annotation offsets: docs indexed before the offsets were added to references_plus don't have them, set them to -1.
+    for offset_column in ('annotation_start', 'annotation_end'):
+        if offset_column not in df.columns:
+            df[offset_column] = -1
+    df[['annotation_start', 'annotation_end']] = df[['annotation_start', 'annotation_end']].fillna(-1).astype('int64')
 
     # Convert the list of lists into a dataframe, replace missing values (Nones are converted into NaNs when a dataframe is created)
 
     groupby_list = ['citing_published_date', 'citing_arxiv_identifier', 'citing_paper_title', 'citing_paper_authors', 
                     'citing_arxiv_url', 'citing_revision_dates', 'citing_dblp_url', 'annotation', 'cited_paper_details']
 
-    df_grouped = pd.DataFrame(df.groupby(groupby_list, sort=False)['citing_sentence'].apply(list)).reset_index()
+    # The sentences and the offsets of the annotation in each of them are grouped into lists in the same order.
+    df_grouped = df.groupby(groupby_list, sort=False).agg({'citing_sentence': list, 'annotation_start': list,
+                                                           'annotation_end': list}).reset_index()
     # Reorder the columns
     cols = ['annotation', 'cited_paper_details', 'citing_sentence', 'citing_arxiv_identifier', 'citing_paper_title',
-            'citing_paper_authors', 'citing_arxiv_url', 'citing_published_date', 'citing_revision_dates', 'citing_dblp_url']
+            'citing_paper_authors', 'citing_arxiv_url', 'citing_published_date', 'citing_revision_dates', 'citing_dblp_url',
+            'annotation_start', 'annotation_end']
     df_grouped = df_grouped[cols]
     return df_grouped
 
@@ -172,27 +331,46 @@ def flatten_dates_modify_annotations(results):
         result[0] = "<{}>".format(result[0])
     return results
 
-def search_authors(query, num_rows):
+@single_flight
+def search_authors(query, num_rows, filters=()):
     """ Returns all metadata (title, authors, urls) when names of 1 or more
-    authors are given in the user query. """
-    results_df, query, num_results = search_solr(query, num_rows * 10,
-                                             'metadata_plus', 'authors', 'and', 
-                                             'published_date desc', None)
+    authors are given in the user query. The authors are looked up as exact
+    normalized keys in author_keys (1 cached filter query per author). If
+    nothing is found, the proximity ('and') search on authors is used.
+    filters are the facet values selected by the user (see filter_queries),
+    the facet counts are returned at the end. """
+    if query == []:
+        return []
+    key_queries = author_filter_queries(query, 'author_keys')
+    results_df = []
+    if key_queries != []:
+        results_df, _, num_results, facets = search_solr('*:*', num_rows * 10, 'metadata_plus', 'authors', None,
+                                                 'published_date desc', key_queries +
+                                                 filter_queries(filters, 'metadata_plus', []), with_facets=True)
+    if len(results_df) == 0:
+        results_df, query, num_results, facets = search_solr(query, num_rows * 10,
+                                                 'metadata_plus', 'authors', 'and', 
+                                                 'published_date desc', filter_queries(filters, 'metadata_plus'),
+                                                 with_facets=True)
     if len(results_df) == 0:
         return []
     # Change the date format of the published_date column to match what we want in the output.
     results_df = change_date_format(results_df, 'published_date')
     results = results_df.values.tolist()
     results = results[:num_rows]
-    return results, num_results, num_rows, query
+    return results, num_results, num_rows, query, facets
 
-def search_meta_titles(query, num_rows):
+@single_flight
+def search_meta_titles(query, num_rows, filters=()):
     """ Returns all metadata (title, authors, url) when a partial or
-    complete title is given in the user query. """
+    complete title is given in the user query. filters are the facet values
+    selected by the user (see filter_queries), the facet counts are returned
+    at the end. """
     
-    results_df, query, num_results = search_solr(query, num_rows * 10,
+    results_df, query, num_results, facets = search_solr(query, num_rows * 10,
                                              'metadata_plus', 'title', 'exact', 
-                                             'published_date desc', None)
+                                             'published_date desc', filter_queries(filters, 'metadata_plus'),
+                                             with_facets=True)
     if len(results_df) == 0:
         return []
     
@@ -200,7 +378,114 @@ def search_meta_titles(query, num_rows):
     results_df = change_date_format(results_df, 'published_date')
     results = results_df.values.tolist()
     results = results[:num_rows]
-    return results, num_results, num_rows, query
+    return results, num_results, num_rows, query, facets
+
+@single_flight
+def search_similar_papers(query, num_rows, filters=()):
+    """ Returns the metadata (title, authors, url) of the num_rows papers which are the most similar to the
+    paper whose arXiv identifier is given in the user query, most similar first, with the similarity (cosine
+    of the paper vectors) at the end of each result. The neighbours are found in the in-process index built
+    by build_similar_papers.py (see similar_papers.py): Solr is only asked for their metadata, with a single
+    terms filter. filters are the facet values selected by the user (see filter_queries): Solr applies them
+    to the neighbours, so more neighbours are fetched (SIMILAR_PAPERS_OVERFETCH times more per round, up to
+    SIMILAR_PAPERS_MAX_CANDIDATES) until num_rows of them pass. The facet counts (of the neighbours sent to
+    Solr in the last round) are returned at the end. """
+    similar_papers_index = get_similar_papers_index()
+    if similar_papers_index is None:
+        return []
+    fqs = filter_queries(filters, 'metadata_plus', [])
+    num_candidates = num_rows
+    if fqs != []:
+        num_candidates = min(num_rows * SIMILAR_PAPERS_OVERFETCH, max(num_rows, SIMILAR_PAPERS_MAX_CANDIDATES))
+    while True:
+        with timed_stage('similar_papers'):
+            neighbours = similar_papers_index.most_similar(query.strip(), num_candidates)
+        if neighbours == []:
+            return []
+        similarities = dict(neighbours)
+        results_df, _, num_results, facets = search_solr('*:*', len(neighbours), 'metadata_plus', 'title', None, None,
+                                                 ['{!terms f=arxiv_identifier}' + ','.join(similarities)] + fqs,
+                                                 with_facets=True)
+        # Stop when enough neighbours pass the filters, or when there are no more neighbours to fetch
+        if (num_results >= num_rows or len(neighbours) < num_candidates
+                or num_candidates >= max(num_rows, SIMILAR_PAPERS_MAX_CANDIDATES)):
+            break
+        num_candidates = min(num_candidates * SIMILAR_PAPERS_OVERFETCH, max(num_rows, SIMILAR_PAPERS_MAX_CANDIDATES))
+    if len(results_df) == 0:
+        return []
+    # Change the date format of the published_date column to match what we want in the output.
+    results_df = change_date_format(results_df, 'published_date')
+    results_df['similarity'] = results_df['arxiv_identifier'].map(similarities).round(3)
+    results_df = results_df.sort_values('similarity', ascending=False, kind='mergesort').head(num_rows)
+    results = results_df.values.tolist()
+    return results, len(results), num_rows, query, facets
+
+def escape_phrase(value):
+    """ Escapes backslashes and double quotes, so that value can be used in a quoted Solr phrase. """
+    return value.replace('\\', '\\\\').replace('"', '\\"')
+
+def filter_queries(filters, collection, default=None):
+    """ Converts the facet values selected by the user into Solr filter queries for collection. Each filter is
+    'facet:value': 'year:2017', 'author:Tim Berners-Lee' or 'sentiment:p' (author and sentiment only exist for
+    references_plus). Each one becomes a separate fq, so that Solr caches it in its filterCache and serves it
+    again when the user refines the same query or another query with the same filter. Filters which don't apply
+    to the collection or have an invalid value are ignored (they come from the URL). Returns default if there
+    is no valid filter. """
+    fqs = []
+    for facet_filter in filters or ():
+        facet, _, value = facet_filter.partition(':')
+        if facet == 'year' and re.fullmatch(r'\d{4}', value):
+            # Half-open range: the whole year, without NOW, so that the fq is cacheable
+            fqs.append('{}:[{}-01-01T00:00:00Z TO {}-01-01T00:00:00Z}}'.format(FACET_DATE_FIELDS[collection], value,
+                                                                            int(value) + 1))
+        elif facet == 'sentiment' and value in SENTIMENT_LABELS and collection in FACET_VALUE_FIELDS:
+            fqs.append('{}:{}'.format(FACET_VALUE_FIELDS[collection]['sentiment'], value))
+        elif facet == 'author' and value != '' and collection in FACET_VALUE_FIELDS:
+            fqs.append('{}:"{}"'.format(FACET_VALUE_FIELDS[collection]['author'], escape_phrase(value)))
+    return fqs if fqs != [] else default
+
+def facet_params(collection):
+    """ Solr parameters which compute the facet counts of collection in the same request as the search: a range
+    facet with 1 bucket per year on the date field, and field facets on the string fields. """
+    params = {'facet': 'true', 'facet.mincount': 1, 'facet.limit': FACET_LIMIT,
+              'facet.range': FACET_DATE_FIELDS[collection],
+              'facet.range.start': '{}-01-01T00:00:00Z'.format(FACET_START_YEAR),
+              'facet.range.end': 'NOW/YEAR+1YEAR', 'facet.range.gap': '+1YEAR'}
+    if collection in FACET_VALUE_FIELDS:
+        params['facet.field'] = list(FACET_VALUE_FIELDS[collection].values())
+    return params
+
+def parse_facets(data, collection):
+    """ Returns the facet counts in a Solr response as an OrderedDict: facet name -> list of (value, label, count).
+    Years are listed from the latest, other values by decreasing count. """
+    facets = OrderedDict()
+    facet_counts = data.get('facet_counts')
+    if facet_counts is None:
+        return facets
+    # Range and field facets are flat lists: [value1, count1, value2, count2...]
+    counts = facet_counts['facet_ranges'].get(FACET_DATE_FIELDS[collection], {}).get('counts', [])
+    years = [(date[:4], count) for date, count in zip(counts[::2], counts[1::2]) if count > 0]
+    facets['year'] = [(year, year, count) for year, count in reversed(years)]
+    for facet, field in FACET_VALUE_FIELDS.get(collection, {}).items():
+        counts = facet_counts['facet_fields'].get(field, [])
+        facets[facet] = [(value, SENTIMENT_LABELS.get(value, value) if facet == 'sentiment' else value, count)
+                         for value, count in zip(counts[::2], counts[1::2])]
+    return facets
+
+def author_filter_queries(authors, field):
+    """ Returns 1 filter query per author (exact term lookup on the author key field). Each one is cached
+    separately in Solr's filterCache, so the same author in a different combination is a cache hit. Authors
+    without a key (no letter or digit) are left out: their filter would match nothing. """
+    keys = [author_key(author) for author in authors]
+    return ['{}:"{}"'.format(field, key) for key in keys if key != '']
+
+def cited_author_filter_queries(query):
+    """ Returns the filter queries of a cited author search (authors separated by semicolons) on references_plus or
+    citation_stats: 1 exact lookup of the normalized author key (see author_names.py) per author. The searches fall
+    back to the proximity search on cited_paper_details if they find nothing, e.g. for the references whose authors
+    are written in a format the keys don't cover. An index built before cited_author_keys existed (or with an older
+    version of the keys) must be rebuilt. """
+    return author_filter_queries(split_authors(query), 'cited_author_keys')
 
 def add_query_type(query, query_type):
     """ Returns the query based on the query type (exact or proximity)
@@ -224,24 +509,83 @@ def add_query_type(query, query_type):
         query = ' AND '.join(query)
     return query
 
-def search_solr(query, num_rows, collection, search_field, query_type, sort_field=None, filter_query=None):
+def search_solr(query, num_rows, collection, search_field, query_type, sort_field=None, filter_query=None,
+                with_facets=False):
     """ Creates a URL to call Solr along with the search query, search field
     and number of rows as parameters, and sends a GET request to SOLR. It
     then calls the parse_json func to parse the json, and returns results
-    from that function."""
+    from that function. Solr is called through the core's admission
+    gate (see admission.py). If with_facets is True, the facet counts of the
+    collection are computed in the same request and returned at the end
+    (see parse_facets)."""
     solr_url = 'http://localhost:8983/solr/' + collection + '/select'
     query = add_query_type(query, query_type)
     if sort_field is not None:
         url_params = {'q': query, 'rows': num_rows, 'df': search_field, 'sort': sort_field}
     else:
         url_params = {'q': query, 'rows': num_rows, 'df': search_field}
-    solr_response = requests.get(solr_url, params=url_params)
-    if solr_response.ok:
+    if filter_query is not None:
+        # A single filter query or a list of them (1 fq parameter each)
+        url_params['fq'] = filter_query
+    if with_facets:
+        url_params.update(facet_params(collection))
+    # Raises SolrUnavailable/SolrOverloaded (a 503 "try again" page) instead of killing the worker
+    solr_response = solr_get(collection, solr_url, url_params)
+    with timed_stage('json_parsing'):
         data = solr_response.json()
-        return parse_json(data, collection)
+    with timed_stage('dataframe'):
+        results = parse_json(data, collection)
+    if with_facets:
+        return results + (parse_facets(data, collection),)
+    return results
+
+def search_solr_cursor(query, collection, search_field, query_type, sort_field, fields, filter_query=None,
+                       rows_per_page=1000):
+    """ Generator version of search_solr which is used to export large result sets. Instead of asking
+    for num_rows rows in one request, it pages through all the results with Solr's cursorMark, and
+    yields the docs (dicts with the fields in fields) one at a time as each page arrives. Only one page
+    is held in memory at any time. A cursor needs a sort which ends on the uniqueKey of the collection,
+    so the uniqueKey is added to sort_field as a tie-breaker. filter_query is a filter query or a list
+    of them, like in search_solr."""
+    solr_url = 'http://localhost:8983/solr/' + collection + '/select'
+    query = add_query_type(query, query_type)
+    sort_field = '{}, {} asc'.format(sort_field, UNIQUE_KEYS[collection])
+    cursor_mark = '*'
+    while True:
+        url_params = {'q': query, 'rows': rows_per_page, 'df': search_field, 'sort': sort_field,
+                      'fl': ','.join(fields), 'cursorMark': cursor_mark}
+        if filter_query is not None:
+            url_params['fq'] = filter_query
+        # Each page goes through the core's admission gate: a long export doesn't hold a slot between pages
+        solr_response = solr_get(collection, solr_url, url_params)
+        data = solr_response.json()
+        for doc in data['response']['docs']:
+            yield doc
+        # Solr returns the same cursor mark again when there are no more results.
+        if data['nextCursorMark'] == cursor_mark:
+            break
+        cursor_mark = data['nextCursorMark']
+
+def count_solr(collection, filter_query):
+    """ Returns the no. of docs of collection which match the filter queries (no docs are fetched). """
+    solr_url = 'http://localhost:8983/solr/' + collection + '/select'
+    solr_response = solr_get(collection, solr_url, {'q': '*:*', 'rows': 0, 'fq': filter_query})
+    return solr_response.json()['response']['numFound']
+
+def author_export_query(query, collection, fallback_query_type, facet_queries=()):
+    """ Returns the (query, query type, filter queries) with which search_solr_cursor exports the results of an
+    author search (query: list of authors, metadata_plus) or a cited author search (query: authors separated by
+    semicolons, references_plus), so that the export has the same rows as the search: the author key filters, or
+    the proximity search (fallback_query_type) if they find nothing. facet_queries are the filter queries of the
+    facet values selected by the user. """
+    if collection == 'metadata_plus':
+        key_queries = author_filter_queries(query, 'author_keys')
     else:
-        print("Invalid response returned from Solr")
-        sys.exit(11)
+        key_queries = cited_author_filter_queries(query)
+    facet_queries = list(facet_queries)
+    if key_queries != [] and count_solr(collection, key_queries + facet_queries) > 0:
+        return '*:*', None, key_queries + facet_queries
+    return query, fallback_query_type, facet_queries if facet_queries != [] else None
 
 def parse_json(data, collection):
     """ Calls the appropriate json parser based on the collection,
@@ -344,12 +688,15 @@ def parse_references_plus_json(data):
     <field name="citing_sentencenum" type="pint" indexed="true" stored="true" multiValued="false"/>
     <field name="citing_sentence" type="text_classic" indexed="true" stored="true" multiValued="false"/>
     <field name="citing_arxiv_identifier" type="string" indexed="true" stored="true" multiValued="false"/>
+    <field name="annotation_start" type="pint" indexed="false" stored="true" multiValued="false"/>
+    <field name="annotation_end" type="pint" indexed="false" stored="true" multiValued="false"/>
     
     <!-- arxiv metadata-->
     <field name="citing_arxiv_url" type="string" indexed="true" stored="true" multiValued="false"/> 
     <field name="citing_paper_authors" type="text_classic" indexed="true" stored="true" multiValued="false"/> 
     <field name="citing_paper_title" type="text_classic" indexed="true" stored="true" multiValued="false"/> 
     <field name="citing_published_date" type="daterange" indexed="true" stored="true" multiValued="true"/>
+    <field name="citing_published_date_display" type="string" indexed="false" stored="true" multiValued="false"/>
     <field name="citing_revision_dates" type="string" indexed="true" stored="true" multiValued="false"/> 
 
     <!-- meta field: dblp_url-->
@@ -374,6 +721,7 @@ def parse_papers_plus_json(data):
     <field name="authors" type="text_classic" indexed="true" stored="true" multiValued="false"/> 
     <field name="title" type="text_classic" indexed="true" stored="true" multiValued="false"/> 
     <field name="published_date" type="pdate" indexed="true" stored="true" multiValued="false"/>
+    <field name="published_date_display" type="string" indexed="false" stored="true" multiValued="false"/>
     <field name="revision_dates" type="string" indexed="true" stored="true" multiValued="false"/>
 
     <!-- meta field: dblp_url-->
@@ -398,6 +746,7 @@ def parse_metadata_plus_json(data):
     <field name="authors" type="text_classic" indexed="true" stored="true" multiValued="false"/> 
     <field name="title" type="text_classic" indexed="true" stored="true" multiValued="false"/> 
     <field name="published_date" type="pdate" indexed="true" stored="true" multiValued="false"/>
+    <field name="published_date_display" type="string" indexed="false" stored="true" multiValued="false"/>
     <field name="revision_dates" type="string" indexed="true" stored="true" multiValued="false"/>
 
     <!-- meta field: dblp_url-->
@@ -43,7 +43,9 @@ class SearchMetatitleForm(forms.Form):
     query = forms.CharField(widget = forms.TextInput( 
     attrs={
         'class': 'form-control',
-        'placeholder': "Enter paper's title (or part of it), e.g., 'linked data quality'"
+        'placeholder': "Enter paper's title (or part of it), e.g., 'linked data quality'",
+        'list': 'query_suggestions',
+        'autocomplete': 'off'
     }
         ), max_length=100)
     numrows = forms.IntegerField(required=False, min_value=1, max_value=1000, widget = forms.NumberInput(
@@ -56,7 +58,9 @@ class SearchAuthorsForm(forms.Form):
     query = forms.CharField(widget = forms.TextInput( 
     attrs={
         'class': 'form-control',
-        'placeholder': "Enter list of authors (separated by semicolons; e.g., 'Tim Berners-Lee')"
+        'placeholder': "Enter list of authors (separated by semicolons; e.g., 'Tim Berners-Lee')",
+        'list': 'query_suggestions',
+        'autocomplete': 'off'
     }
         ), max_length=100)
     numrows = forms.IntegerField(required=False, min_value=1, max_value=1000, widget = forms.NumberInput(
@@ -65,3 +69,15 @@ class SearchAuthorsForm(forms.Form):
          'placeholder': 'No. of results (default: 100)'
     }))
 
+class SimilarPapersForm(forms.Form):
+    query = forms.CharField(widget = forms.TextInput( 
+    attrs={
+        'class': 'form-control',
+        'placeholder': "Enter a paper's arXiv identifier, e.g., '1712.05577'"
+    }
+        ), max_length=30)
+    numrows = forms.IntegerField(required=False, min_value=1, max_value=100, widget = forms.NumberInput(
+    attrs={
+         'class': 'form-control',
+         'placeholder': 'No. of results (default: 10)'
+    }))
@@ -0,0 +1,216 @@
+""" Pure-NumPy scorer for the citation sentiment model. The fitted sklearn pipeline (vectorizer + TF-IDF + linear
+classifier) is compiled by create_ml_model.py into a .npz artifact which holds only NumPy arrays: the IDF weight and
+class weights of each column, the intercepts, the class labels and the tokenizer settings, and the mapping of the
+n-grams to the columns. For a CountVectorizer, this is the vocabulary (the n-grams and their columns). For a
+HashingVectorizer, it is n_features: the column of any n-gram is computed with the same MurmurHash3 as sklearn's, so
+that n-grams which weren't seen at training time count in the TF-IDF norm exactly as they do in the pipeline. Only the
+columns of the n-grams seen at training time are stored (sorted, looked up with searchsorted): all the others have the
+same, highest IDF weight and no class weights. The weights are stored as float32. The Django workers load this artifact instead of unpickling the pipeline, so they don't need to import sklearn.
+NOTE: this module must not import sklearn or any PaperSearch module: it is also imported by create_ml_model.py. """
+import re
+from itertools import repeat
+import numpy as np
+
+ARTIFACT_FILENAME = 'citation_model_scorer.npz'
+
+MURMUR_C1 = np.uint32(0xcc9e2d51)
+MURMUR_C2 = np.uint32(0x1b873593)
+# Masks of the 0-3 bytes at the end of a key which don't make a whole 4-byte block
+TAIL_MASKS = np.array([0, 0xff, 0xffff, 0xffffff], dtype=np.uint32)
+
+def rotate_left(values, bits):
+    """ Rotates the bits of a uint32 array to the left. """
+    return (values << np.uint32(bits)) | (values >> np.uint32(32 - bits))
+
+def murmurhash3_32(terms):
+    """ MurmurHash3 (x86, 32 bits, seed 0) of the UTF-8 encoding of each n-gram in a list, as signed 32-bit integers:
+    the same values as sklearn.utils.murmurhash3_32(term, seed=0), which HashingVectorizer uses. The n-grams are
+    encoded in one go and read in 4-byte blocks straight from the encoded bytes; the n-grams are sorted by length, so
+    that block b is only computed for the prefix of the n-grams which have more than b blocks. """
+    if len(terms) == 0:
+        return np.array([], dtype=np.int32)
+    # n-grams never contain a newline: it isn't a word character. The padding lets the last block be read whole.
+    encoded = '\n'.join(terms).encode('utf-8') + b'\0\0\0\0'
+    size = len(encoded) - 4
+    # The little-endian 4-byte word which starts at each byte
+    words = np.ndarray(shape=(size + 1,), dtype='<u4', buffer=encoded, strides=(1,))
+    ends = np.append(np.flatnonzero(np.frombuffer(encoded, dtype=np.uint8, count=size) == 10), size)
+    starts = np.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    lengths = ends - starts
+    order = np.argsort(-lengths, kind='stable')
+    starts = starts[order]
+    lengths = lengths[order]
+    num_blocks = lengths >> 2
+    hashes = np.zeros(len(terms), dtype=np.uint32)
+    # No. of n-grams with more than b blocks, for each b
+    num_terms = np.searchsorted(-num_blocks, -np.arange(num_blocks[0]), side='left')
+    for block, count in enumerate(num_terms):
+        k = rotate_left(words[starts[:count] + 4 * block] * MURMUR_C1, 15) * MURMUR_C2
+        hashes[:count] = rotate_left(hashes[:count] ^ k, 13) * np.uint32(5) + np.uint32(0xe6546b64)
+    remainders = lengths & 3
+    tail = np.flatnonzero(remainders)
+    k = words[starts[tail] + 4 * num_blocks[tail]] & TAIL_MASKS[remainders[tail]]
+    hashes[tail] ^= rotate_left(k * MURMUR_C1, 15) * MURMUR_C2
+    # Finalization
+    hashes ^= lengths.astype(np.uint32)
+    hashes ^= hashes >> np.uint32(16)
+    hashes *= np.uint32(0x85ebca6b)
+    hashes ^= hashes >> np.uint32(13)
+    hashes *= np.uint32(0xc2b2ae35)
+    hashes ^= hashes >> np.uint32(16)
+    result = np.empty_like(hashes)
+    result[order] = hashes
+    return result.view(np.int32)
+
+def hashing_columns(terms, n_features, alternate_sign):
+    """ Returns the columns (int64 array) and signs (float array, or None if they are all +1) which HashingVectorizer
+    gives a list of n-grams (same computation as sklearn's FeatureHasher). """
+    hashes = murmurhash3_32(terms).astype(np.int64)
+    columns = np.abs(hashes) % n_features
+    columns[hashes == -2**31] = (2**31 - 1 - (n_features - 1)) % n_features
+    signs = np.where(hashes < 0, -1.0, 1.0) if alternate_sign else None
+    return columns, signs
+
+class LinearTextScorer:
+    """ Predicts labels with the same tokenization, n-grams, TF-IDF weighting (l2-normalized) and linear
+    decision function as the pipeline it was compiled from. """
+    def __init__(self, arrays):
+        self.n_features = int(arrays['n_features'])
+        self.alternate_sign = bool(arrays['alternate_sign'])
+        if self.n_features == 0:
+            terms = arrays['terms'].tobytes().decode('utf-8').split('\n') if len(arrays['terms']) > 0 else []
+            self.term_index = dict(zip(terms, arrays['term_columns'].tolist()))
+        self.weight_columns = arrays['weight_columns']
+        self.default_idf = float(arrays['default_idf'])
+        self.idf = arrays['idf']
+        self.coef = arrays['coef']
+        self.intercept = arrays['intercept']
+        self.classes = arrays['classes']
+        self.stop_words = frozenset(arrays['stop_words'].tolist())
+        self.ngram_range = tuple(int(n) for n in arrays['ngram_range'])
+        self.token_regex = re.compile(str(arrays['token_pattern']))
+        self.lowercase = bool(arrays['lowercase'])
+        self.sublinear_tf = bool(arrays['sublinear_tf'])
+
+    @classmethod
+    def load(cls, filename=ARTIFACT_FILENAME):
+        """ Loads a scorer from an artifact saved by save_artifact. """
+        with np.load(filename, allow_pickle=False) as artifact:
+            if 'weight_columns' not in artifact.files:
+                raise ValueError("{} was exported in an older format: export it again with create_ml_model.py".format(filename))
+            return cls({name: artifact[name] for name in artifact.files})
+
+    def analyze(self, sentence):
+        """ Splits a sentence into n-grams exactly like sklearn's word analyzer: lowercase, tokenize with the
+        token pattern, remove stop words, then add the n-grams (words joined by a space) for n in ngram_range. """
+        if self.lowercase:
+            sentence = sentence.lower()
+        tokens = self.token_regex.findall(sentence)
+        if self.stop_words:
+            tokens = [token for token in tokens if token not in self.stop_words]
+        min_n, max_n = self.ngram_range
+        if max_n == 1:
+            return tokens
+        ngrams = list(tokens) if min_n == 1 else []
+        for n in range(max(min_n, 2), min(max_n, len(tokens)) + 1):
+            # zip of the tokens shifted by 0..n-1 gives the n-grams in order
+            ngrams.extend(map(' '.join, zip(*[tokens[i:] for i in range(n)])))
+        return ngrams
+
+    def term_columns(self, ngrams):
+        """ Returns the columns of a list of n-grams (int64 array, -1 for the n-grams which aren't in the vocabulary
+        of a CountVectorizer model) and their signs (float array, or None if they are all +1). """
+        if self.n_features > 0:
+            return hashing_columns(ngrams, self.n_features, self.alternate_sign)
+        columns = np.fromiter(map(self.term_index.get, ngrams, repeat(-1)), dtype=np.int64, count=len(ngrams))
+        return columns, None
+
+    def column_weights(self, columns):
+        """ Returns the IDF weights and the class weights (no. of columns x no. of classes) of an array of columns.
+        A hashing model only stores the weights of the columns in weight_columns: the others have default_idf and
+        class weights of 0. """
+        if self.n_features == 0:
+            return self.idf[columns], self.coef[columns]
+        if len(self.weight_columns) == 0:
+            return np.full(len(columns), self.default_idf), np.zeros((len(columns), self.coef.shape[1]))
+        positions = np.minimum(np.searchsorted(self.weight_columns, columns), len(self.weight_columns) - 1)
+        stored = self.weight_columns[positions] == columns
+        idf = np.where(stored, self.idf[positions], self.default_idf)
+        coef = self.coef[positions] * stored[:, np.newaxis]
+        return idf, coef
+
+    def decision_function(self, sentences):
+        """ Returns the scores (no. of sentences x no. of classes, or x 1 for a binary model) of a batch of sentences. """
+        num_sentences = len(sentences)
+        ngrams = []
+        lengths = []
+        for sentence in sentences:
+            sentence_ngrams = self.analyze(sentence)
+            ngrams.extend(sentence_ngrams)
+            lengths.append(len(sentence_ngrams))
+        columns, signs = self.term_columns(ngrams)
+        rows = np.repeat(np.arange(num_sentences, dtype=np.int64), lengths)
+        # n-grams which the model doesn't know are dropped
+        known = columns >= 0
+        if not known.all():
+            columns = columns[known]
+            rows = rows[known]
+        # Term frequencies: add up the n-grams which fall into the same (sentence, column) cell
+        num_columns = self.n_features or len(self.idf)
+        if signs is None:
+            cells, tf = np.unique(rows * num_columns + columns, return_counts=True)
+        else:
+            cells, cell_ids = np.unique(rows * num_columns + columns, return_inverse=True)
+            tf = np.bincount(cell_ids, weights=signs[known], minlength=len(cells))
+        rows = cells // num_columns
+        columns = cells % num_columns
+        if self.sublinear_tf:
+            tf = np.log(tf) + 1
+        idf, cell_coef = self.column_weights(columns)
+        # TF-IDF, l2-normalized per sentence
+        tfidf = tf * idf
+        norms = np.sqrt(np.bincount(rows, weights=tfidf ** 2, minlength=num_sentences))
+        norms[norms == 0] = 1
+        tfidf /= norms[rows]
+        scores = np.empty((num_sentences, self.coef.shape[1]))
+        for class_index in range(self.coef.shape[1]):
+            scores[:, class_index] = np.bincount(rows, weights=tfidf * cell_coef[:, class_index], minlength=num_sentences)
+        return scores + self.intercept
+
+    def predict(self, sentences):
+        """ Returns the predicted label of each sentence (a NumPy array, like Pipeline.predict). """
+        scores = self.decision_function(list(sentences))
+        if scores.shape[1] == 1:
+            return self.classes[(scores[:, 0] > 0).astype(int)]
+        return self.classes[scores.argmax(axis=1)]
+
+def save_artifact(filename, terms, term_columns, idf, coef, intercept, classes, stop_words, ngram_range, token_pattern,
+                  lowercase, sublinear_tf, n_features=0, alternate_sign=False):
+    """ Saves a scorer artifact. idf has 1 weight per column and coef is no. of columns x no. of classes. For a
+    CountVectorizer model, terms are the n-grams of the vocabulary and term_columns their columns. For a
+    HashingVectorizer model, terms and term_columns are empty, n_features > 0 is the no. of columns and alternate_sign
+    is that of the vectorizer: idf and coef have a row for every column, and only the columns which have class weights
+    or an IDF weight below the highest one (the n-grams seen at training time) are saved. """
+    terms = list(terms)
+    if any('\n' in term for term in terms):
+        raise ValueError("The n-grams of the vocabulary can't contain a newline.")
+    idf = np.asarray(idf, dtype=np.float64)
+    coef = np.asarray(coef, dtype=np.float64)
+    weight_columns = np.array([], dtype=np.int32)
+    default_idf = 0.0
+    if n_features > 0:
+        if len(idf) != n_features:
+            raise ValueError("A hashing model needs the idf weights and coefficients of all its n_features columns.")
+        default_idf = idf.max()
+        weight_columns = np.flatnonzero((idf < default_idf) | coef.any(axis=1)).astype(np.int32)
+        idf = idf[weight_columns]
+        coef = coef[weight_columns]
+    np.savez(filename, terms=np.frombuffer('\n'.join(terms).encode('utf-8'), dtype=np.uint8),
+             term_columns=np.asarray(term_columns, dtype=np.int32), n_features=np.array(n_features),
+             alternate_sign=np.array(alternate_sign), weight_columns=weight_columns,
+             default_idf=np.array(default_idf), idf=idf.astype(np.float32), coef=coef.astype(np.float32),
+             intercept=np.asarray(intercept, dtype=np.float64), classes=np.asarray(classes, dtype=str),
+             stop_words=np.array(sorted(stop_words), dtype=str), ngram_range=np.array(ngram_range),
+             token_pattern=np.array(token_pattern), lowercase=np.array(lowercase), sublinear_tf=np.array(sublinear_tf))
@@ -0,0 +1,71 @@
+""" In-process nearest-neighbour index for the "similar papers" search. build_similar_papers.py computes a
+TF-IDF vector of the full text of each paper (all the sentences indexed in papers_plus), reduces it with a
+truncated SVD and saves the l2-normalized vectors (1 row per paper, float32) and the arXiv identifiers (sorted)
+in 2 .npy files. The vectors are memory-mapped, so all the workers share one copy in the OS page cache, and
+the k most similar papers of a paper are found with a single matrix-vector product (cosine similarity) and a
+partial sort, without any call to Solr. NOTE: this module only needs NumPy (no sklearn). """
+import os
+import threading
+import numpy as np
+
+# The index files are SIMILAR_PAPERS_PREFIX + '.vectors.npy' and SIMILAR_PAPERS_PREFIX + '.ids.npy'
+SIMILAR_PAPERS_PREFIX = 'papersearchengine/similar_papers'
+
+class SimilarPapersIndex:
+    """ Paper vectors (no. of papers x no. of dimensions, l2-normalized) and the sorted arXiv identifiers of
+    the rows. """
+    def __init__(self, vectors, arxiv_identifiers):
+        self.vectors = vectors
+        self.arxiv_identifiers = arxiv_identifiers
+
+    @classmethod
+    def load(cls, prefix=SIMILAR_PAPERS_PREFIX):
+        """ Loads an index saved by save_index. The vectors are memory-mapped (read-only). """
+        vectors = np.load(prefix + '.vectors.npy', mmap_mode='r', allow_pickle=False)
+        arxiv_identifiers = np.load(prefix + '.ids.npy', allow_pickle=False)
+        return cls(vectors, arxiv_identifiers)
+
+    def row(self, arxiv_identifier):
+        """ Returns the row of a paper (binary search of the sorted identifiers), or None if it isn't indexed. """
+        position = np.searchsorted(self.arxiv_identifiers, arxiv_identifier)
+        if position < len(self.arxiv_identifiers) and self.arxiv_identifiers[position] == arxiv_identifier:
+            return int(position)
+        return None
+
+    def most_similar(self, arxiv_identifier, k=10):
+        """ Returns a list of (arXiv identifier, cosine similarity) of the k papers most similar to the given
+        paper, most similar first. An empty list is returned if the paper isn't indexed. """
+        row = self.row(arxiv_identifier)
+        if row is None or k <= 0:
+            return []
+        scores = self.vectors.dot(self.vectors[row])
+        # The paper itself is always its own nearest neighbour
+        scores[row] = -np.inf
+        k = min(k, len(scores) - 1)
+        if k <= 0:
+            return []
+        # Partial sort: only the top k are sorted
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind='mergesort')]
+        return [(str(self.arxiv_identifiers[position]), float(scores[position])) for position in top]
+
+def save_index(prefix, vectors, arxiv_identifiers):
+    """ Saves an index: the rows are sorted by arXiv identifier, and the vectors are stored as float32. """
+    arxiv_identifiers = np.asarray(arxiv_identifiers, dtype=str)
+    order = np.argsort(arxiv_identifiers, kind='mergesort')
+    np.save(prefix + '.vectors.npy', np.ascontiguousarray(np.asarray(vectors, dtype=np.float32)[order]))
+    np.save(prefix + '.ids.npy', arxiv_identifiers[order])
+
+# The index, loaded once per process by get_similar_papers_index
+similar_papers_index = {}
+similar_papers_lock = threading.Lock()
+
+def get_similar_papers_index():
+    """ Returns the similar papers index, loading it the first time it is needed, or None if it hasn't been
+    built (see build_similar_papers.py). """
+    with similar_papers_lock:
+        if 'index' not in similar_papers_index:
+            if not os.path.exists(SIMILAR_PAPERS_PREFIX + '.vectors.npy'):
+                return None
+            similar_papers_index['index'] = SimilarPapersIndex.load(SIMILAR_PAPERS_PREFIX)
+        return similar_papers_index['index']
@@ -0,0 +1,50 @@
+""" Request coalescing (single-flight) for the search functions of django_paper_search_v2. When a link to a results
+page is shared, many identical searches arrive at the same time. The first one (the leader) runs the search; the
+others which arrive while it is still running wait for it and get the same result instead of sending the same
+queries to Solr and repeating the sentiment, grouping and date formatting work. Nothing is cached: once the
+leader has finished, the next identical search runs again. NOTE: the searches are coalesced per process (per
+worker), and the result is shared between the callers, so it must not be modified by them. """
+import functools
+import threading
+from .timing import timed_stage
+
+class InFlightCall:
+    """ A search which is running: the followers wait on done, then read result (or error). """
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+# key: (function name, arguments), value: InFlightCall
+in_flight = {}
+in_flight_lock = threading.Lock()
+
+def single_flight(func):
+    """ Decorator which coalesces concurrent calls of func with the same arguments (compared by their repr, as
+    the author search gets a list). The time spent waiting for the leader is recorded in the 'coalesced' stage. """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        key = (func.__name__, repr(args), repr(sorted(kwargs.items())))
+        with in_flight_lock:
+            call = in_flight.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = in_flight[key] = InFlightCall()
+        if not is_leader:
+            with timed_stage('coalesced'):
+                call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = func(*args, **kwargs)
+        except BaseException as error:
+            # e.g. SolrOverloaded from search_solr: the followers fail the same way as the leader
+            call.error = error
+            raise
+        finally:
+            with in_flight_lock:
+                del in_flight[key]
+            call.done.set()
+        return call.result
+    return wrapper
@@ -1,3 +1,83 @@
-from django.test import TestCase
+from django.test import SimpleTestCase
+from .author_names import author_key, split_name, split_authors, starts_with_surname_initials, cited_author_keys
 
-# Create your tests here.
+class AuthorKeyTests(SimpleTestCase):
+    """ The keys searched by the author searches must be the same for every way of writing a name. """
+    def test_first_names_or_initials_first(self):
+        self.assertEqual(author_key('Tim Berners-Lee'), 'bernerslee_t')
+        self.assertEqual(author_key('T. Berners-Lee'), 'bernerslee_t')
+
+    def test_surname_comma_first_names_or_initials(self):
+        self.assertEqual(author_key('Berners-Lee, Tim'), 'bernerslee_t')
+        self.assertEqual(author_key('Berners-Lee, T.'), 'bernerslee_t')
+
+    def test_surname_initials(self):
+        self.assertEqual(author_key('Berners-Lee T'), 'bernerslee_t')
+        self.assertEqual(author_key('Ng AY'), 'ng_a')
+
+    def test_surname_only(self):
+        self.assertEqual(author_key('Berners-Lee'), 'bernerslee')
+
+    def test_accents_and_empty_names(self):
+        self.assertEqual(author_key('José García'), 'garcia_j')
+        self.assertEqual(author_key(''), '')
+        self.assertEqual(author_key('.'), '')
+
+class SplitNameTests(SimpleTestCase):
+    def test_surname_comma_initials(self):
+        self.assertEqual(split_name('Berners-Lee, T.'), ('Berners-Lee', ['T.']))
+
+    def test_surname_initials(self):
+        self.assertEqual(split_name('Berners-Lee T'), ('Berners-Lee', ['T']))
+        # 2-letter surnames aren't initials: they aren't all capitals
+        self.assertEqual(split_name('Ng AY'), ('Ng', ['AY']))
+
+    def test_first_names_then_surname(self):
+        self.assertEqual(split_name('Tim Berners-Lee'), ('Berners-Lee', ['Tim']))
+        self.assertEqual(split_name('Christopher D. Manning'), ('Manning', ['Christopher', 'D.']))
+
+    def test_empty_name(self):
+        self.assertEqual(split_name(''), ('', []))
+
+class SplitAuthorsTests(SimpleTestCase):
+    def test_empty_authors_are_left_out(self):
+        self.assertEqual(split_authors('Tim Berners-Lee; ;James Hendler;'), ['Tim Berners-Lee', 'James Hendler'])
+        self.assertEqual(split_authors(';'), [])
+
+class StartsWithSurnameInitialsTests(SimpleTestCase):
+    def test_surname_initials_references(self):
+        self.assertTrue(starts_with_surname_initials('Berners-Lee T, Hendler J. The semantic web'))
+        self.assertTrue(starts_with_surname_initials('Li Y, Ng AY, Xu W. Title of the paper'))
+        # 1 author: the full stop after the initial ends the author list
+        self.assertTrue(starts_with_surname_initials('Hendler J. The semantic web. Scientific American'))
+
+    def test_other_formats(self):
+        self.assertFalse(starts_with_surname_initials('Berners-Lee, T., Hendler, J.: The semantic web'))
+        self.assertFalse(starts_with_surname_initials('Christopher D. Manning, Hinrich Schütze. Foundations'))
+        self.assertFalse(starts_with_surname_initials('J. Hendler. The semantic web'))
+        self.assertFalse(starts_with_surname_initials('Hendler, J. (2001) The semantic web.'))
+
+class CitedAuthorKeysTests(SimpleTestCase):
+    """ The keys indexed in cited_author_keys for the reference formats of cited_paper_details. """
+    def test_surname_comma_initials_colon(self):
+        self.assertEqual(cited_author_keys('Berners-Lee, T., Hendler, J.: The semantic web'),
+                         ['bernerslee', 'bernerslee_t', 'hendler', 'hendler_j'])
+
+    def test_surname_initials(self):
+        self.assertEqual(cited_author_keys('Berners-Lee T, Hendler J. The semantic web'),
+                         ['bernerslee', 'bernerslee_t', 'hendler', 'hendler_j'])
+        self.assertEqual(cited_author_keys('Li Y, Ng AY, Xu W. Title of the paper'),
+                         ['li', 'li_y', 'ng', 'ng_a', 'xu', 'xu_w'])
+
+    def test_first_names_and(self):
+        self.assertEqual(cited_author_keys('Tim Berners-Lee, James Hendler, and Ora Lassila. The semantic web. '
+                                           'Scientific American, 2001.'),
+                         ['bernerslee', 'bernerslee_t', 'hendler', 'hendler_j', 'lassila', 'lassila_o'])
+
+    def test_et_al(self):
+        self.assertEqual(cited_author_keys('Berners-Lee T, et al. The semantic web.'), ['bernerslee', 'bernerslee_t'])
+        self.assertEqual(cited_author_keys('Berners-Lee, T. et al. (2001) The semantic web.'),
+                         ['bernerslee', 'bernerslee_t'])
+
+    def test_year_in_brackets(self):
+        self.assertEqual(cited_author_keys('Hendler, J. (2001) The semantic web.'), ['hendler', 'hendler_j'])
@@ -0,0 +1,103 @@
+""" Request-level timing for PaperSearch. The search functions in django_paper_search_v2 wrap each stage of a
+search (Solr request, JSON parsing, DataFrame building, model loading, sentiment prediction, grouping, date
+formatting, template rendering...) in timed_stage(name). TimingMiddleware collects these stage timings for the
+current request, sends them to the browser in a Server-Timing header, and adds the total latency of the request
+to a histogram for its view (i.e. search type). The histograms and the accumulated stage times are exposed in the
+Prometheus text format by the metrics view. NOTE: the metrics are kept per process (per worker). """
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+from django.http import HttpResponse
+
+# Upper bounds (in seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, float('inf'))
+
+# Stage timings of the request handled by the current thread: dict stage -> seconds (None outside a request)
+current_request = threading.local()
+# key: view name, value: dict with bucket counts, sum and count of request latencies
+latency_histograms = {}
+# key: (view name, stage), value: total seconds spent in the stage
+stage_totals = {}
+metrics_lock = threading.Lock()
+# Functions which return more lines for the metrics endpoint (e.g. the Solr admission counters)
+metric_sources = []
+
+@contextmanager
+def timed_stage(stage):
+    """ Context manager which adds the time spent in its block to stage in the timings of the current request.
+    Time spent several times in the same stage (e.g. 2 Solr requests) is added up. Outside a request (or in
+    another thread), nothing is recorded. """
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        timings = getattr(current_request, 'timings', None)
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0) + perf_counter() - start
+
+def observe_request(view_name, total, timings):
+    """ Adds the latency of one request to the histogram of its view, and its stage timings to the totals. """
+    with metrics_lock:
+        histogram = latency_histograms.setdefault(view_name, {'buckets': [0] * len(LATENCY_BUCKETS), 'sum': 0, 'count': 0})
+        for i, upper_bound in enumerate(LATENCY_BUCKETS):
+            if total <= upper_bound:
+                histogram['buckets'][i] += 1
+        histogram['sum'] += total
+        histogram['count'] += 1
+        for stage, seconds in timings.items():
+            stage_totals[(view_name, stage)] = stage_totals.get((view_name, stage), 0) + seconds
+
+def server_timing_header(timings, total):
+    """ Builds the value of the Server-Timing header: stage;dur=milliseconds, ..., total;dur=milliseconds """
+    entries = ['{};dur={:.1f}'.format(stage, seconds * 1000) for stage, seconds in timings.items()]
+    entries.append('total;dur={:.1f}'.format(total * 1000))
+    return ', '.join(entries)
+
+class TimingMiddleware:
+    """ Django middleware which times each request and the stages recorded by timed_stage during it. """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        current_request.timings = {}
+        start = perf_counter()
+        try:
+            response = self.get_response(request)
+            total = perf_counter() - start
+            timings = current_request.timings
+        finally:
+            current_request.timings = None
+        # Static files and the metrics endpoint itself are not resolved to a search view
+        view_name = request.resolver_match.url_name if request.resolver_match is not None else None
+        if view_name is not None and view_name != 'metrics':
+            observe_request(view_name, total, timings)
+        response['Server-Timing'] = server_timing_header(timings, total)
+        return response
+
+def register_metrics(source):
+    """ Registers a function which returns a list of lines (Prometheus text format) to add to the metrics. """
+    metric_sources.append(source)
+
+def format_bound(upper_bound):
+    """ Formats a bucket bound as Prometheus expects it (+Inf for infinity). """
+    return '+Inf' if upper_bound == float('inf') else repr(upper_bound)
+
+def metrics(request):
+    """ Returns the request latency histograms (per view) and the time spent in each stage (per view) in the
+    Prometheus text exposition format. """
+    lines = ['# HELP papersearch_request_seconds Latency of PaperSearch requests per view.',
+             '# TYPE papersearch_request_seconds histogram']
+    with metrics_lock:
+        for view_name, histogram in sorted(latency_histograms.items()):
+            for upper_bound, count in zip(LATENCY_BUCKETS, histogram['buckets']):
+                lines.append('papersearch_request_seconds_bucket{{view="{}",le="{}"}} {}'.format(
+                    view_name, format_bound(upper_bound), count))
+            lines.append('papersearch_request_seconds_sum{{view="{}"}} {}'.format(view_name, histogram['sum']))
+            lines.append('papersearch_request_seconds_count{{view="{}"}} {}'.format(view_name, histogram['count']))
+        lines.extend(['# HELP papersearch_stage_seconds_total Time spent in each stage of PaperSearch requests per view.',
+                      '# TYPE papersearch_stage_seconds_total counter'])
+        for (view_name, stage), seconds in sorted(stage_totals.items()):
+            lines.append('papersearch_stage_seconds_total{{view="{}",stage="{}"}} {}'.format(view_name, stage, seconds))
+    for source in metric_sources:
+        lines.extend(source())
+    return HttpResponse('\n'.join(lines) + '\n', content_type='text/plain; version=0.0.4')
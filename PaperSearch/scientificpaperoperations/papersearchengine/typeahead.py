@@ -0,0 +1,142 @@
+""" In-process typeahead for the author and title searches. All the author names and titles in metadata_plus
+are normalized and stored in sorted lists (one per type), so that a prefix lookup is a binary search followed
+by a short scan, without any call to Solr. The lists are built in a background thread the first time a suggestion
+is asked for (there are no suggestions until they are ready), and are rebuilt in a background thread whenever the
+version of the metadata_plus index changes (checked at most once every REFRESH_INTERVAL seconds). A build which
+fails because Solr is unavailable or overloaded is retried at the next check. """
+import threading
+import unicodedata
+import re
+from bisect import bisect_left
+from time import time
+from .django_paper_search_v2 import search_solr_cursor
+from .admission import solr_get, SolrUnavailable
+
+# Min. no. of seconds between 2 checks of the metadata_plus index version
+REFRESH_INTERVAL = 60
+MAX_SUGGESTIONS = 10
+
+# Current prefix indices (key: 'author'/'title', value: (sorted keys, display ids, displays)), and the version of
+# metadata_plus they were built from.
+prefix_indices = {}
+index_state = {'version': None, 'last_checked': 0, 'rebuilding': False}
+index_lock = threading.Lock()
+
+def normalize(text):
+    """ Lowercases text, strips accents, and replaces all punctuation/whitespace runs by a single space, so
+    that e.g. 'Berners-Lee, Tim' and 'berners lee tim' produce the same key. """
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return re.sub(r'[\W_]+', ' ', text).strip()
+
+def build_prefix_index(entries):
+    """ Takes an iterable of (key variants, display string) pairs and returns a prefix index: a sorted list of
+    normalized keys, a parallel list with the position of each key's display string, and the list of unique
+    display strings. Several keys can point to the same display string (e.g. 'tim berners lee' and
+    'berners lee tim'). """
+    displays = []
+    display_ids = {}
+    pairs = []
+    for variants, display in entries:
+        if display not in display_ids:
+            display_ids[display] = len(displays)
+            displays.append(display)
+        for variant in variants:
+            key = normalize(variant)
+            if key != '':
+                pairs.append((key, display_ids[display]))
+    pairs = sorted(set(pairs))
+    return [key for key, _ in pairs], [display_id for _, display_id in pairs], displays
+
+def search_prefix_index(prefix_index, prefix, limit=MAX_SUGGESTIONS):
+    """ Returns up to limit display strings whose keys start with prefix (after normalization), in the
+    alphabetical order of the keys. """
+    keys, ids, displays = prefix_index
+    prefix = normalize(prefix)
+    if prefix == '':
+        return []
+    suggestions = []
+    seen = set()
+    position = bisect_left(keys, prefix)
+    while position < len(keys) and keys[position].startswith(prefix) and len(suggestions) < limit:
+        if ids[position] not in seen:
+            seen.add(ids[position])
+            suggestions.append(displays[ids[position]])
+        position += 1
+    return suggestions
+
+def author_variants(author):
+    """ Key variants for an author name: the full name, and the surname followed by the other names,
+    so that the author can be found by typing either the first name or the surname. """
+    names = author.split()
+    if len(names) < 2:
+        return [author]
+    return [author, ' '.join([names[-1]] + names[:-1])]
+
+def read_metadata_plus():
+    """ Reads the authors and titles of all the docs in metadata_plus (paged with a cursor) and returns
+    2 lists of (key variants, display string) pairs: one for authors, one for titles. """
+    authors = []
+    titles = []
+    for doc in search_solr_cursor('*:*', 'metadata_plus', 'title', None, 'published_date desc', ['authors', 'title']):
+        # authors is a single string in metadata_plus with the authors separated by semicolons
+        for author in (doc.get('authors') or '').split(';'):
+            author = ' '.join(author.split())
+            if author != '':
+                authors.append((author_variants(author), author))
+        title = ' '.join((doc.get('title') or '').split())
+        if title != '':
+            titles.append(([title], title))
+    return authors, titles
+
+def get_index_version():
+    """ Returns the current version of the metadata_plus index from Solr's Luke request handler, or None
+    if it can't be read. """
+    solr_url = 'http://localhost:8983/solr/metadata_plus/admin/luke'
+    try:
+        solr_response = solr_get('metadata_plus', solr_url, {'numTerms': 0, 'wt': 'json'}, timeout=5)
+    except SolrUnavailable:
+        return None
+    return solr_response.json()['index'].get('version')
+
+def rebuild_prefix_indices(version):
+    """ Builds new author and title prefix indices, and swaps them in once they are complete. If Solr is unavailable,
+    the current indices (if any) are kept, and the build is tried again at the next check. """
+    try:
+        authors, titles = read_metadata_plus()
+        new_indices = {'author': build_prefix_index(authors), 'title': build_prefix_index(titles)}
+        with index_lock:
+            prefix_indices.update(new_indices)
+            index_state['version'] = version
+    except SolrUnavailable as error:
+        print("Typeahead indices not rebuilt, Solr is unavailable: {}".format(error))
+    finally:
+        with index_lock:
+            index_state['rebuilding'] = False
+
+def refresh_prefix_indices():
+    """ Checks the version of metadata_plus (at most once every REFRESH_INTERVAL seconds), and starts a rebuild of
+    the indices in a background thread if they don't exist yet or if the index has changed. The request never
+    waits for a build: the old indices (or no suggestions at all, before the first build) are used meanwhile. """
+    with index_lock:
+        if time() - index_state['last_checked'] < REFRESH_INTERVAL or index_state['rebuilding']:
+            return
+        index_state['last_checked'] = time()
+    version = get_index_version()
+    with index_lock:
+        if index_state['rebuilding']:
+            return
+        # If the version can't be read, the existing indices are kept until the next check
+        if prefix_indices and (version is None or version == index_state['version']):
+            return
+        index_state['rebuilding'] = True
+    threading.Thread(target=rebuild_prefix_indices, args=(version,), daemon=True).start()
+
+def suggest(suggestion_type, prefix, limit=MAX_SUGGESTIONS):
+    """ Returns up to limit authors (suggestion_type='author') or titles (suggestion_type='title') which
+    start with prefix. """
+    refresh_prefix_indices()
+    prefix_index = prefix_indices.get(suggestion_type)
+    if prefix_index is None:
+        return []
+    return search_prefix_index(prefix_index, prefix, limit)
@@ -1,5 +1,5 @@
 from django.urls import path
-from . import views
+from . import views, api, timing, admission
 
 urlpatterns = [
     path('', views.index, name='index'),
@@ -13,5 +13,10 @@ urlpatterns = [
     path('citedpapersearchresults/', views.cited_paper_search, name='citedpapersearchresults'),
     path('citedauthorsearch/', views.cited_author_serach, name='citedauthorsearch'),
     path('citedauthorsearchresults/', views.cited_author_serach, name='citedauthorsearchresults'),
+    path('similarpapers/', views.similar_papers, name='similarpapers'),
     path('about/', views.about, name='about'),
+    path('suggest/', views.suggest, name='suggest'),
+    path('metrics/', timing.metrics, name='metrics'),
+    path('api/v1/<str:search_type>/', api.search, name='api_search'),
+    path('api/v1/<str:search_type>/export/', api.export, name='api_export'),
 ]
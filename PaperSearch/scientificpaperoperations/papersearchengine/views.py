@@ -1,13 +1,21 @@
 import datetime
 import re
 from django.shortcuts import render
-from django.http import HttpResponse, Http404, HttpResponseRedirect
+from django.http import HttpResponse, Http404, HttpResponseRedirect, JsonResponse
 from .forms import SearchPapersForm, SearchCitedAuthorsForm, SearchCitedPaperForm, SearchAuthorsForm, SearchMetatitleForm
+from .forms import SimilarPapersForm
 from .django_paper_search_v2 import *
+from . import typeahead
+from .timing import timed_stage
 #from .django_paper_search import *
 
 # Create your views here.
 
+def render_results(request, template_name, context):
+    """ Renders a results page, recording the time spent in template rendering. """
+    with timed_stage('render'):
+        return render(request, template_name, context)
+
 def index(request):
     return render(
      request,
@@ -31,16 +39,21 @@ def phrase_search(request):
             numrows = cleaned.get('numrows')
             if numrows is None:
                 numrows = 100
+            # Facet values selected by the user (1 fq parameter each)
+            filters = tuple(request.GET.getlist('fq'))
             # Render the search results form
-            reslist = search_sentences_plus(query, numrows)
+            reslist = search_sentences_plus(query, numrows, filters)
             if reslist == []:
                 # No results found
                 printdict = {'query': query, 'numresults': 0, 'results':[], 'numrows': numrows}
+                facets = None
             else:
-                results, num_results, num_rows, query  = reslist
+                results, num_results, num_rows, query, facets = reslist
                 printdict = {'query': query, 'numresults': num_results, 'results':results, 'numrows': numrows}
 
-            return render(request, 'papersearchengine/phrasesearchresults.html', 
+            printdict.update(facet_context(request, facets, filters))
+
+            return render_results(request, 'papersearchengine/phrasesearchresults.html', 
                           printdict)
     else:
         form=SearchPapersForm()
@@ -64,15 +77,20 @@ def metadatatitle_search(request):
              numrows = cleaned.get('numrows')
              if numrows is None:
                  numrows = 100
-             reslist = search_meta_titles(query, numrows)
+             # Facet values selected by the user (1 fq parameter each)
+             filters = tuple(request.GET.getlist('fq'))
+             reslist = search_meta_titles(query, numrows, filters)
              if reslist == []:
                  # No results found
                  printdict = {'query': query, 'numresults': 0, 'results':[], 'numrows': numrows}
+                 facets = None
              else:
-                 results, num_results, num_rows, query  = reslist
+                 results, num_results, num_rows, query, facets = reslist
                  printdict = {'query': query, 'numresults': num_results, 'results':results, 'numrows': numrows}
 
-             return render(request, 'papersearchengine/titlesearchresults.html', 
+             printdict.update(facet_context(request, facets, filters))
+
+             return render_results(request, 'papersearchengine/titlesearchresults.html', 
                            printdict)
      else:
          form=SearchMetatitleForm()
@@ -96,27 +114,81 @@ def author_search(request):
              numrows = cleaned.get('numrows')
              if numrows is None:
                  numrows = 100
-             # Split the query to individual authors and remove spaces and send the authors list to 
+             # Facet values selected by the user (1 fq parameter each)
+             filters = tuple(request.GET.getlist('fq'))
+             # Split the query to individual authors (without spaces and empty authors) and send the authors list to
              # search_authors. 
-             authors = query.split(';')
-             authors = [author.strip() for author in authors]
+             authors = split_authors(query)
              # Create a display string for the query with ANDs between authors.
              displayauthors = ' AND '.join(authors)
-             reslist = search_authors(authors, numrows)
+             reslist = search_authors(authors, numrows, filters)
              if reslist == []:
                  # No results found
                  printdict = {'query': displayauthors, 'numresults': 0, 'results':[], 'numrows': numrows}
+                 facets = None
              else:
-                 results, num_results, num_rows, query  = reslist
+                 results, num_results, num_rows, query, facets = reslist
                  printdict = {'query': displayauthors, 'numresults': num_results, 'results':results, 'numrows': numrows}
 
-             return render(request, 'papersearchengine/authorsearchresults.html', 
+             printdict.update(facet_context(request, facets, filters))
+
+             return render_results(request, 'papersearchengine/authorsearchresults.html', 
                            printdict)
      else:
          form=SearchAuthorsForm()
      # Render empty form       
      return render(request, 'papersearchengine/authorsearch.html', {'form':form})
 
+def similar_papers(request):
+     """ Implements the similar papers search (papers whose content is the most similar to the paper with the
+     given arXiv identifier) by displaying a search form, checking for errors and rendering the results in the
+     front-end. The results pages of the other paper searches link here for each result."""
+     if request.method == 'GET' and request.GET.get('query'):
+         form = SimilarPapersForm(request.GET)
+         if form.is_valid():
+             cleaned = form.cleaned_data
+             query = cleaned.get('query')
+             numrows = cleaned.get('numrows')
+             if numrows is None:
+                 numrows = 10
+             # Facet values selected by the user (1 fq parameter each)
+             filters = tuple(request.GET.getlist('fq'))
+             reslist = search_similar_papers(query, numrows, filters)
+             if reslist == []:
+                 # Unknown arXiv identifier (or the similar papers index hasn't been built)
+                 printdict = {'query': query, 'numresults': 0, 'results':[], 'numrows': numrows}
+                 facets = None
+             else:
+                 results, num_results, num_rows, query, facets = reslist
+                 printdict = {'query': query, 'numresults': num_results, 'results':results, 'numrows': numrows}
+
+             printdict.update(facet_context(request, facets, filters))
+
+             return render_results(request, 'papersearchengine/similarpapersresults.html',
+                           printdict)
+     else:
+         form=SimilarPapersForm()
+     # Render empty form
+     return render(request, 'papersearchengine/similarpapers.html', {'form':form})
+
+def facet_context(request, facets, filters):
+    """ Returns the template context for the facets: for each facet, its values with their counts and the URL
+    which adds the value as a filter (fq parameter) to the current search, and the selected filters with the
+    URL which removes each of them. facets is None if the search found nothing. """
+    def url_with_filters(new_filters):
+        params = request.GET.copy()
+        params.setlist('fq', new_filters)
+        return '?' + params.urlencode()
+    facet_links = []
+    for facet, values in (facets or {}).items():
+        links = [(label, count, url_with_filters(list(filters) + ['{}:{}'.format(facet, value)]))
+                 for value, label, count in values if '{}:{}'.format(facet, value) not in filters]
+        if links != []:
+            facet_links.append((facet, links))
+    active_filters = [(facet_filter, url_with_filters([other for other in filters if other != facet_filter]))
+                      for facet_filter in filters]
+    return {'facets': facet_links, 'active_filters': active_filters}
+
 def normalize_results(results):
     """ This func normalizes the published date and authors of metadata so that they are displayed in the right format.
     """
@@ -171,17 +243,24 @@ def cited_author_serach(request):
              numrows = cleaned.get('numrows')
              if numrows is None:
                  numrows = 100
+             # Facet values selected by the user (1 fq parameter each)
+             filters = tuple(request.GET.getlist('fq'))
              # Render the search results form
-             reslist = search_references_plus(query, numrows, 'authors')
+             reslist = search_references_plus(query, numrows, 'authors', filters)
              if reslist == []:
                  # No results found
                  printdict = {'query': query, 'numresults': 0, 'results':[], 'numrows': numrows}
+                 facets = None
              else:
-                 results, num_results, num_rows, query = reslist
+                 # Exact counts and citations per year, precomputed at index time
+                 citation_stats = search_citation_stats(query, 'authors')
+                 results, num_results, num_rows, query, facets = reslist
                  # Display only the query (remove the proximity symbol etc.)
                  query = query[:query.rfind('"')+1]
-                 printdict = {'query': query, 'results':results, 'numrows': numrows, 'numresults': num_results}
-             return render(request, 'papersearchengine/citedauthorsearchresults.html', 
+                 printdict = {'query': query, 'results':results, 'numrows': numrows, 'numresults': num_results,
+                              'citation_stats': citation_stats}
+             printdict.update(facet_context(request, facets, filters))
+             return render_results(request, 'papersearchengine/citedauthorsearchresults.html', 
                            printdict)
      else:
          form=SearchCitedAuthorsForm()
@@ -205,17 +284,24 @@ def cited_paper_search(request):
              numrows = cleaned.get('numrows')
              if numrows is None:
                  numrows = 100
+             # Facet values selected by the user (1 fq parameter each)
+             filters = tuple(request.GET.getlist('fq'))
              # Render the search results form
-             reslist = search_references_plus(query, numrows, 'title')
+             reslist = search_references_plus(query, numrows, 'title', filters)
              if reslist == []:
                  # No results found
                  printdict = {'query': query, 'numresults': 0, 'results':[], 'numrows': numrows}
+                 facets = None
              else:
-                 results, num_results, num_rows, query = reslist
+                 # Exact counts and citations per year, precomputed at index time
+                 citation_stats = search_citation_stats(query, 'title')
+                 results, num_results, num_rows, query, facets = reslist
                  # Display only the query (remove the proximity symbol etc.)
                  query = query[:query.rfind('"')+1]
-                 printdict = {'query': query, 'results':results, 'numrows': numrows, 'numresults': num_results}
-             return render(request, 'papersearchengine/citedpapersearchresults.html', printdict)
+                 printdict = {'query': query, 'results':results, 'numrows': numrows, 'numresults': num_results,
+                              'citation_stats': citation_stats}
+             printdict.update(facet_context(request, facets, filters))
+             return render_results(request, 'papersearchengine/citedpapersearchresults.html', printdict)
      else:
          form=SearchCitedPaperForm()
      # Render empty form       
@@ -236,16 +322,32 @@ def change_dateformat_addoffsets_citation(results):
         for sentence in result[2]:
             # sublist will contain 1 sentence, and three sets of indices 
             sublist = []
-            match = re.search(result[0], sentence)
+            # Literal search, not a regex: annotations can contain regex metacharacters. If the annotation isn't found,
+            # nothing is highlighted.
+            start = sentence.find(result[0])
+            end = start + len(result[0]) if start != -1 else 0
+            start = max(start, 0)
             sublist.append(sentence)
             # Find indices of annotation in sentence (separated by :), indices of the sentence before the annotation and
             # indices of the sentence after the annotation, both also separated by a colon.
             # This is used in the template, where {{sentence|slice:annotation_indices}} is used to get the part to highlight the annotation. 
-            sublist.extend(["{}:{}".format(match.start(), match.end()), "{}:{}".format(0, match.start()), "{}:".format(match.end())])
+            sublist.extend(["{}:{}".format(start, end), "{}:{}".format(0, start), "{}:".format(end)])
             sentence_with_annotations.append(sublist)
         result[2] = sentence_with_annotations
     return results
 
+def suggest(request):
+    """ Returns typeahead suggestions (JSON) for the author search (type=author) or the title search (type=title),
+    for the text in the prefix parameter. For authors, only the last of the semicolon-separated authors is completed."""
+    suggestion_type = request.GET.get('type', 'author')
+    if suggestion_type not in ('author', 'title'):
+        return JsonResponse({'error': 'type must be author or title'}, status=400)
+    prefix = request.GET.get('prefix', '')
+    if suggestion_type == 'author':
+        prefix = prefix.split(';')[-1]
+    suggestions = typeahead.suggest(suggestion_type, prefix)
+    return JsonResponse({'type': suggestion_type, 'prefix': prefix, 'suggestions': suggestions})
+
 def about(request):
     """ Displays an About Us page. """
     return render(
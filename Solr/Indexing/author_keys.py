@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+"""
+    #-------------------------------------------------------------------------------
+    # Name:        AUTHOR KEYS
+    # Purpose:     Loads the normalized author keys (lowercased surname, and surname +
+    #              first initial) for the indexers: they are indexed in the multi-valued
+    #              author_keys field of metadata_plus and cited_author_keys field of
+    #              references_plus and citation_stats. The keys are built by author_names.py
+    #              in PaperSearch, which the author searches use as well, so that the indexed
+    #              keys and the searched keys can't differ. It has no dependencies on the
+    #              rest of PaperSearch, so it is imported from its directory.
+    #-------------------------------------------------------------------------------
+
+"""
+import os
+import sys
+
+PAPERSEARCH_ENGINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'PaperSearch',
+                                      'scientificpaperoperations', 'papersearchengine')
+sys.path.append(PAPERSEARCH_ENGINE_DIR)
+from author_names import author_keys, author_keys_from_list, cited_author_keys
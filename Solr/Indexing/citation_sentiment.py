@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""
+    #-------------------------------------------------------------------------------
+    # Name:        CITATION SENTIMENT
+    # Purpose:     Loads the citation sentiment model for the references_plus indexers (the
+    #              citing_sentiment field, which citation_stats aggregates): the NumPy scorer
+    #              exported by create_ml_model.py in PaperSearch. The scorer module has no
+    #              dependencies on the rest of PaperSearch (and no sklearn), so it is imported
+    #              from its directory.
+    #-------------------------------------------------------------------------------
+
+"""
+import os
+import sys
+
+PAPERSEARCH_ENGINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'PaperSearch',
+                                      'scientificpaperoperations', 'papersearchengine')
+sys.path.append(PAPERSEARCH_ENGINE_DIR)
+from sentiment_scorer import LinearTextScorer
+
+DEFAULT_MODEL = os.path.join(PAPERSEARCH_ENGINE_DIR, 'citation_model_scorer.npz')
+
+def load_scorer(filename=DEFAULT_MODEL):
+    """ Returns the sentiment scorer, or None (with a message) if it hasn't been exported: the indexers then
+    leave out the sentiment fields. """
+    if not os.path.exists(filename):
+        print("No sentiment model found at {}: the sentiment fields will not be indexed".format(filename))
+        return None
+    return LinearTextScorer.load(filename)
+
+def add_sentiments(scorer, records, sentence_field='citing_sentence', sentiment_field='citing_sentiment'):
+    """ Adds the predicted sentiment (p/o/n) of the sentence of each record (a list of dicts) to the record. All
+    the sentences are scored in 1 call, so that the cost of a call is paid once per batch, not once per sentence.
+    Nothing is added if scorer is None. """
+    if scorer is None or records == []:
+        return records
+    sentiments = scorer.predict([record.get(sentence_field) or '' for record in records])
+    for record, sentiment in zip(records, sentiments):
+        record[sentiment_field] = str(sentiment)
+    return records
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+"""
+    #-------------------------------------------------------------------------------
+    # Name:        DATE FORMATS
+    # Purpose:     Builds the date fields of the *_plus indices from the list of arXiv
+    #              dates of a paper (version 1 first, then the revisions): the sortable
+    #              published date (pdate), the published date preformatted for display
+    #              (e.g. 'May 14, 2018') and the revision dates string. PaperSearch shows
+    #              the stored display date as it is, so the result pages don't parse or
+    #              reformat dates.
+    #-------------------------------------------------------------------------------
+
+"""
+import datetime
+
+DISPLAY_FORMAT = '%B %d, %Y'
+
+def display_date(solr_date):
+    """ Converts a date in the Solr format (%Y-%m-%dT%H:%M:%SZ, or just %Y-%m-%d) to the display format. """
+    return datetime.datetime.strptime(solr_date[:10], '%Y-%m-%d').strftime(DISPLAY_FORMAT)
+
+def date_fields(published_dates, prefix=''):
+    """ Returns a dict with the date fields of a Solr record: published_date (date of version 1),
+    published_date_display and revision_dates ('unavailable' or 'revised on <date1>;<date2>...').
+    prefix is prepended to the field names ('citing_' in references_plus). """
+    if published_dates == []:
+        return {prefix + 'revision_dates': 'unavailable'}
+    fields = {prefix + 'published_date': published_dates[0],
+              prefix + 'published_date_display': display_date(published_dates[0])}
+    if len(published_dates) == 1:
+        fields[prefix + 'revision_dates'] = 'unavailable'
+    else:
+        revision = ';'.join([display_date(pdate) for pdate in published_dates[1:]])
+        fields[prefix + 'revision_dates'] = 'revised on {}'.format(revision)
+    return fields
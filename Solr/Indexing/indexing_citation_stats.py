@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+    #-------------------------------------------------------------------------------
+    # Name:        CREATE CITATION STATS
+    # Purpose:     Aggregates the references_plus index (run it after indexing_references_plus.py)
+    #              into a new index 'citation_stats' with 1 doc per cited paper (annotation): no. of
+    #              citing sentences, no. of distinct citing papers, citing papers per year and the
+    #              predicted sentiment of the citing sentences. PaperSearch reads citation counts
+    #              and histograms from here with a single lookup instead of fetching and counting
+    #              references_plus rows.
+    #              references_plus is paged through with a cursor sorted on annotation, so each
+    #              annotation's docs arrive together and only 1 annotation is held in memory.
+    #              The sentiment counts are those of the citing_sentiment field of references_plus,
+    #              predicted once by indexing_references_plus.py (the model isn't run again here).
+    #              If references_plus has no sentiment, the sentiment fields are left out.
+    #-------------------------------------------------------------------------------
+
+"""
+import sys
+from collections import Counter
+from time import time
+import requests
+import pysolr
+from author_keys import cited_author_keys
+
+ROWS_PER_PAGE = 5000
+# No. of citation_stats docs sent to Solr at a time
+BATCH_SIZE = 1000
+FIELDS = ['annotation', 'cited_paper_details', 'citing_arxiv_identifier', 'citing_published_date', 'citing_sentiment']
+# Sentiment labels (citing_sentiment of references_plus) -> citation_stats fields
+SENTIMENT_FIELDS = {'p': 'num_positive', 'o': 'num_neutral', 'n': 'num_negative'}
+
+# Make a connection to Solr
+solr = pysolr.Solr('http://localhost:8983/solr/citation_stats')
+
+def read_references_plus():
+    """ Pages through all the references_plus docs, sorted by annotation, with Solr's cursorMark, and yields
+    them one at a time. """
+    solr_url = 'http://localhost:8983/solr/references_plus/select'
+    cursor_mark = '*'
+    while True:
+        url_params = {'q': '*:*', 'rows': ROWS_PER_PAGE, 'sort': 'annotation asc, id asc', 'fl': ','.join(FIELDS),
+                      'cursorMark': cursor_mark}
+        solr_response = requests.get(solr_url, params=url_params)
+        if not solr_response.ok:
+            print("Invalid response returned from Solr")
+            sys.exit(11)
+        data = solr_response.json()
+        for doc in data['response']['docs']:
+            yield doc
+        if data['nextCursorMark'] == cursor_mark:
+            return
+        cursor_mark = data['nextCursorMark']
+
+def group_by_annotation(docs):
+    """ Yields (annotation, list of docs) for each annotation: docs must be sorted by annotation. """
+    annotation = None
+    group = []
+    for doc in docs:
+        if doc['annotation'] != annotation and group != []:
+            yield annotation, group
+            group = []
+        annotation = doc['annotation']
+        group.append(doc)
+    if group != []:
+        yield annotation, group
+
+def build_stats_record(annotation, docs):
+    """ Builds the citation_stats doc of 1 annotation from its references_plus docs. """
+    # 1 citing paper can have several citing sentences: papers are counted once
+    citing_papers = {}
+    for doc in docs:
+        published_date = doc.get('citing_published_date')
+        citing_papers[doc.get('citing_arxiv_identifier')] = published_date[:4] if published_date else 'unknown'
+    papers_per_year = Counter(citing_papers.values())
+    solr_record = {'annotation': annotation,
+                   'cited_paper_details': docs[0].get('cited_paper_details'),
+                   'cited_author_keys': cited_author_keys(docs[0].get('cited_paper_details') or ''),
+                   'num_citing_sentences': len(docs),
+                   'num_citing_papers': len(citing_papers),
+                   'citing_papers': ['{}|{}'.format(arxiv_identifier, year) for arxiv_identifier, year in citing_papers.items()],
+                   'citations_per_year': ['{}:{}'.format(year, count) for year, count in sorted(papers_per_year.items())]}
+    sentiments = Counter(doc['citing_sentiment'] for doc in docs if 'citing_sentiment' in doc)
+    if sentiments:
+        for label, field in SENTIMENT_FIELDS.items():
+            solr_record[field] = sentiments.get(label, 0)
+    return solr_record
+
+def build_citation_stats():
+    """ Reads references_plus, and inserts 1 citation_stats doc per annotation in batches of BATCH_SIZE. """
+    list_for_solr = []
+    num_records = 0
+    for annotation, docs in group_by_annotation(read_references_plus()):
+        list_for_solr.append(build_stats_record(annotation, docs))
+        if len(list_for_solr) == BATCH_SIZE:
+            solr.add(list_for_solr)
+            num_records += len(list_for_solr)
+            print("Inserted {} records".format(num_records))
+            list_for_solr = []
+    if list_for_solr != []:
+        solr.add(list_for_solr)
+        num_records += len(list_for_solr)
+    solr.commit()
+    print("Inserted {} records in total".format(num_records))
+
+if __name__ == '__main__':
+    start_time = time()
+    build_citation_stats()
+    print("Completed in {} seconds!".format(time() - start_time))
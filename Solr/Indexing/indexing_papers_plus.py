@@ -18,11 +18,11 @@ import os
 import csv
 from collections import defaultdict
 import requests
-import datetime
 import pysolr
 from glob import glob
 from time import time
 import concurrent.futures
+from date_formats import date_fields
 
 # Make a connection to Solr
 solr = pysolr.Solr('http://localhost:8983/solr/papers_plus')
@@ -138,16 +138,9 @@ def parse_file_build_index(filepath):
                 dblp_url = dblp_url if dblp_url is not None else 'unavailable'
                 solr_record['dblp_url'] = dblp_url
                 for title, authors, arxiv_url, published_dates in arxiv_metadata_result:
-                    # Flatten the published dates into a single string. Not using a DateRange field because
-                    # a grouping is done in django_paper_search which needs the dates to be a single string
-                    if len(published_dates) == 1:
-                        solr_record['published_date'] = published_dates[0]
-                        solr_record['revision_dates'] = 'unavailable'
-                    else:
-                        solr_record['published_date'] = published_dates[0]
-                        revision = ';'.join([datetime.datetime.strptime(pdate[:10], '%Y-%m-%d').strftime('%B %d, %Y') for pdate in published_dates[1:]])
-                        solr_record['revision_dates'] = 'revised on {}'.format(revision)
-                        #print(published_dates)
+                    # Sortable published date (version 1), display-ready published date (so that PaperSearch
+                    # doesn't reformat it per request) and the revision dates flattened into a single string
+                    solr_record.update(date_fields(published_dates))
                     solr_record['title'] = title
                     solr_record['authors'] = '; '.join(authors)
                     solr_record['arxiv_url'] = arxiv_url
@@ -17,14 +17,18 @@ import os
 import csv
 from collections import defaultdict
 import requests
-import datetime
 import pysolr
 from glob import iglob, glob
 from time import time
+from author_keys import cited_author_keys
+from citation_sentiment import load_scorer, add_sentiments
+from date_formats import date_fields
 import concurrent.futures
 
 # Make a connection to Solr
 solr = pysolr.Solr('http://localhost:8983/solr/references_plus')
+# Citation sentiment model (None if it hasn't been exported: citing_sentiment is then not indexed)
+scorer = load_scorer()
 
 def search_solr(query, collection, search_field, num_rows):
     """ Searches the specified collection on the specified search_field (and a
@@ -128,6 +132,7 @@ def parse_file_build_records(filename):
     <!-- REFS file fields: cited paper-->
     <field name="annotation" type="string" indexed="true" stored="true" multiValued="false"/>
     <field name="cited_paper_details" type="text_classic" indexed="true" stored="true" multiValued="false"/>
+    <field name="cited_author_keys" type="string" indexed="true" stored="false" multiValued="true"/>
     <!-- Insert this only for debugging, to search for records from a particular file-->
     <field name="reference_filename" type="string" indexed="false" stored="true" multiValued="false"/>
 
@@ -136,10 +141,14 @@ def parse_file_build_records(filename):
     <field name="citing_sentencenum" type="pint" indexed="true" stored="true" multiValued="false"/>
     <field name="citing_sentence" type="text_classic" indexed="true" stored="true" multiValued="false"/>
     <field name="citing_arxiv_identifier" type="string" indexed="true" stored="true" multiValued="false"/>
+    <field name="citing_sentiment" type="string" indexed="true" stored="false" multiValued="false"/>
+    <field name="annotation_start" type="pint" indexed="false" stored="true" multiValued="false"/>
+    <field name="annotation_end" type="pint" indexed="false" stored="true" multiValued="false"/>
 
     <!-- arxiv metadata-->
     <field name="citing_arxiv_url" type="string" indexed="true" stored="true" multiValued="false"/>
     <field name="citing_paper_authors" type="text_classic" indexed="true" stored="true" multiValued="false"/>
+    <field name="citing_author_facet" type="string" indexed="true" stored="false" multiValued="true"/>
     <field name="citing_paper_title" type="text_classic" indexed="true" stored="true" multiValued="false"/>
     <field name="citing_published_date" type="daterange" indexed="true" stored="true" multiValued="false"/>
     <field name="citing_revision_dates" type="string" indexed="true" stored="true" multiValued="false"/>
@@ -194,10 +203,20 @@ def parse_file_build_records(filename):
                     # NOTE: Annotations in the refs files don't have < and >
                     solr_record['annotation'] = '<{}>'.format(annotation)
                     solr_record['cited_paper_details'] = details
+                    # Normalized keys of the cited authors (multi-valued field) for exact author lookups. A tuple, not a
+                    # list: the records have to be hashable for the duplicate removal below.
+                    solr_record['cited_author_keys'] = tuple(cited_author_keys(details))
                     # Debug field: can be used to find records created from a particular (refs) file
                     solr_record['reference_filename'] = filename_without_extension
                     solr_record['citing_sentencenum'] = sentencenum
                     solr_record['citing_sentence'] = sentence
+                    # Offsets of the annotation in the sentence, so that Django can slice the sentence to highlight the
+                    # annotation without searching for it in every request. A literal search is used (not a regex), as
+                    # annotations can contain regex metacharacters.
+                    annotation_start = sentence.find(solr_record['annotation'])
+                    if annotation_start != -1:
+                        solr_record['annotation_start'] = annotation_start
+                        solr_record['annotation_end'] = annotation_start + len(solr_record['annotation'])
                     solr_record['citing_arxiv_identifier'] = arxiv_identifier
                     # arxiv_metadata_result will be a list of lists with each list containing title (string),
                     # authors (list), arxiv url (string), published_dates (list)
@@ -208,19 +227,13 @@ def parse_file_build_records(filename):
                     dblp_url = dblp_url if dblp_url is not None else 'unavailable'
                     solr_record['citing_dblp_url'] = dblp_url
                     for title, authors, arxiv_url, published_dates in arxiv_metadata_result:
-                        # Flatten the published dates into a single string. Not using a DateRange field because
-                        # a grouping is done in django_paper_search which needs the dates to be a single string
-                        if len(published_dates) == 1:
-                            solr_record['citing_published_date'] = published_dates[0]
-                            solr_record['citing_revision_dates'] = 'unavailable'
-                        else:
-                            solr_record['citing_published_date'] = published_dates[0]
-                            revision = ';'.join([datetime.datetime.strptime(pdate[:10], '%Y-%m-%d').strftime('%B %d, %Y') for pdate in published_dates[1:]])
-                            solr_record['citing_revision_dates'] = 'revised on {}'.format(revision)
-                        #published_dates = ';'.join([datetime.datetime.strptime(pdate[:10], '%Y-%m-%d').strftime('%Y-%m-%d') for  pdate in published_dates])
-                        #print(published_dates)
+                        # Sortable published date (version 1), display-ready published date (so that PaperSearch
+                        # doesn't reformat it per request) and the revision dates flattened into a single string
+                        solr_record.update(date_fields(published_dates, 'citing_'))
                         solr_record['citing_paper_title'] = title
                         solr_record['citing_paper_authors'] = '; '.join(authors)
+                        # Unanalyzed author names (multi-valued) for the citing author facet. A tuple: the records have to be hashable.
+                        solr_record['citing_author_facet'] = tuple(authors)
                         solr_record['citing_arxiv_url'] = arxiv_url
                     list_for_solr.append(solr_record)
         # As the refs input data is very low quality, a check is needed to see if the same annotation occurs twice in the same file
@@ -228,6 +241,9 @@ def parse_file_build_records(filename):
         # happen if the same annotation appears twice in the same file)
         unique_sets = set(frozenset(d.items()) for d in list_for_solr)
         unique_dicts = [dict(s) for s in unique_sets]
+        # Predicted sentiment of the citations (p/o/n), used as a facet in PaperSearch: the sentences of the
+        # file are scored in 1 call
+        add_sentiments(scorer, unique_dicts)
         # Add to Solr
         solr.add(unique_dicts)
         print("Inserted list length =", len(unique_dicts))
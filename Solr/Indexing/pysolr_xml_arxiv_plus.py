@@ -16,9 +16,10 @@
 from collections import defaultdict
 from lxml import etree
 import pysolr
-import datetime
 import requests
 from time import time
+from author_keys import author_keys_from_list
+from date_formats import date_fields
 
 # Parse the Arxiv xml file
 def get_xml_root():
@@ -129,16 +130,12 @@ def parse_xml_insert_into_solr(root):
                 arxiv_identifier = child.text[id_startindex:]
                 solr_record['arxiv_identifier'] = arxiv_identifier  # Return only the first date (1st element in list): the date of version 1.
 
-        # Add the dates
-        if len(published_dates) == 1:
-            solr_record['published_date'] = published_dates[0]
-            solr_record['revision_dates'] = 'unavailable'
-        else:
-            solr_record['published_date'] = published_dates[0]
-            revision = ';'.join([datetime.datetime.strptime(pdate[:10], '%Y-%m-%d').strftime('%B %d, %Y') for pdate in published_dates[1:]])
-            solr_record['revision_dates'] = 'revised on {}'.format(revision)
+        # Add the dates: sortable published date, display-ready published date and revision dates
+        solr_record.update(date_fields(published_dates))
         # Add the authors
         solr_record['authors'] = '; '.join(authors)
+        # Normalized author keys (multi-valued field) for exact author lookups
+        solr_record['author_keys'] = author_keys_from_list(authors)
         # Get the dblp url from the metadata index
         dblp_url = search_solr(arxiv_identifier, 'metadata', 'arxiv_identifier', 1)
         dblp_url = dblp_url if dblp_url is not None else 'unavailable'